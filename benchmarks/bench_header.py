@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_header
+    ------------
+
+    Measures the header parsing rate of ``nanoscope.read(header_only=True)``
+    in files per second, and the cost of tokenizing and classifying a single
+    header line.
+
+    Usage::
+
+        $ python benchmarks/bench_header.py [FILE ...] [-n REPEAT]
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import nanoscope  # noqa: E402
+from nanoscope.nanoscope import NanoscopeFile  # noqa: E402
+from nanoscope.parameter import parse_header  # noqa: E402
+
+
+DEFAULT_FILE = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                            'files', 'full_multiple_images.txt')
+
+
+def parse_rate(paths, repeat):
+    """
+    Returns the number of headers parsed per second, taking the best of
+    ``repeat`` runs over all of the paths.
+    """
+    def run():
+        for path in paths:
+            nanoscope.read(path, header_only=True)
+
+    run()  # warm up the file cache
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return len(paths) / best
+
+
+def line_cost(path, repeat, encoding='cp1252'):
+    """
+    Returns the best time in seconds to parse one line of the file's header.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(NanoscopeFile.header_chunk_size)
+    marker = NanoscopeFile.header_end.encode('ascii')
+    header = header[:header.index(b'\n', header.index(marker)) + 1]
+    lines = header.count(b'\n')
+
+    def run():
+        for _ in parse_header(header, encoding):
+            pass
+
+    best = min(timeit.repeat(run, number=10, repeat=repeat)) / 10
+    return best / lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('files', nargs='*', default=[DEFAULT_FILE])
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rate = parse_rate(args.files, args.repeat)
+    print('{0:.1f} files/s over {1} file(s)'.format(rate, len(args.files)))
+    cost = line_cost(args.files[0], args.repeat)
+    print('{0:.2f} us/line'.format(cost * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_import
+    ------------
+
+    Measures the time taken by ``import nanoscope`` in a fresh interpreter, and
+    checks that reading a file does not pull in astropy.
+
+    Usage::
+
+        $ python benchmarks/bench_import.py [-n REPEAT] [--limit SECONDS]
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SAMPLE = os.path.join(ROOT, 'tests', 'files', 'full_multiple_images.txt')
+
+IMPORT_CODE = ('import time\n'
+               't = time.time()\n'
+               'import nanoscope\n'
+               'print(time.time() - t)\n')
+READ_CODE = ('import sys, nanoscope\n'
+             'nanoscope.read({0!r}).height.process()\n'
+             'print("astropy" in sys.modules)\n').format(SAMPLE)
+
+
+def run(code):
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return output.decode('ascii').strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--limit', type=float, default=None,
+                        help='fail if the best import time exceeds this')
+    args = parser.parse_args(argv)
+
+    best = min(float(run(IMPORT_CODE)) for _ in range(args.repeat))
+    astropy_loaded = run(READ_CODE) == 'True'
+    print('import nanoscope: {0:.1f} ms'.format(best * 1000))
+    print('astropy loaded by read: {0}'.format(astropy_loaded))
+
+    if astropy_loaded or (args.limit is not None and best > args.limit):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
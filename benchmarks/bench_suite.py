@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_suite
+    -----------
+
+    Times every stage of reading and processing synthetic Nanoscope files
+    (see ``synthetic.py``) across image sizes, bytes per pixel and channel
+    counts: header parsing, reading, writing, flattening, conversion,
+    colorizing, the tiled pass, each statistic and the summary.
+
+    Each stage reports the best time of ``--repeat`` runs, its throughput in
+    megapixels per second and its peak traced memory. Results can be saved as
+    a baseline and later runs compared against it; the comparison exits with
+    status 1 if any stage is slower than the baseline by more than
+    ``--tolerance``.
+
+    Usage::
+
+        $ python benchmarks/bench_suite.py --sizes 256 1024 4096 \\
+              --bytes 2 4 --channels 1 4 --save-baseline baseline.json
+        $ python benchmarks/bench_suite.py --sizes 256 1024 4096 \\
+              --bytes 2 4 --channels 1 4 --compare baseline.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import nanoscope  # noqa: E402
+from synthetic import write_spm  # noqa: E402
+
+
+STATISTICS = ('mean_height', 'min_height', 'max_height', 'Ra', 'Rq', 'Rpm',
+              'Rvm', 'Rz', 'Pc', 'HSC', 'LSC')
+
+
+def stages(path):
+    """
+    Returns ``(name, setup, run)`` tuples for each stage benchmarked on the
+    file. ``setup`` returns the object that ``run`` is timed on, so that only
+    the stage itself is measured.
+    """
+    def height():
+        return nanoscope.read(path).height
+
+    def flat():
+        image = height()
+        image.flatten()
+        return image
+
+    def converted():
+        image = flat()
+        image.convert()
+        return image
+
+    def statistic(name):
+        def run(image):
+            image._cache.clear()
+            getattr(image, name)
+        return 'stat:' + name, converted, run
+
+    def write(p):
+        p.write(os.path.join(os.path.dirname(path), 'written.spm'))
+
+    def summary(image):
+        image._cache.clear()
+        image.summary()
+
+    return [
+        ('header', lambda: path,
+         lambda p: nanoscope.read(p, header_only=True)),
+        ('read', lambda: path, lambda p: nanoscope.read(p)),
+        ('read_mmap', lambda: path,
+         lambda p: nanoscope.read(p, mmap=True).height.raw_data.sum()),
+        ('write', lambda: nanoscope.read(path), write),
+        ('flatten', height, lambda image: image.flatten()),
+        ('convert', flat, lambda image: image.convert()),
+        ('colorize', converted, lambda image: image.colorize()),
+        ('process', height, lambda image: image.process()),
+        ('process_tiled', height, lambda image: image.process_tiled()),
+    ] + [statistic(name) for name in STATISTICS] + [
+        ('summary', converted, summary),
+    ]
+
+
+def measure(setup, run, repeat):
+    """
+    Returns the best time in seconds of ``repeat`` runs, each on a fresh
+    result of ``setup``, and the peak memory traced during one more run.
+    """
+    times = []
+    for _ in range(repeat):
+        subject = setup()
+        gc.collect()
+        times.append(timeit.timeit(lambda: run(subject), number=1))
+
+    subject = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(subject)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def benchmark(directory, size, bytes_per_pixel, channels, repeat):
+    """
+    Generates a synthetic file and returns a dict of the results of each
+    stage, keyed by ``stage/configuration``.
+    """
+    config = '{0}x{0}/{1}B/{2}ch'.format(size, bytes_per_pixel, channels)
+    path = os.path.join(directory, '{}_{}_{}.spm'.format(
+        size, bytes_per_pixel, channels))
+    if not os.path.exists(path):
+        write_spm(path, size, bytes_per_pixel, channels)
+
+    results = {}
+    for name, setup, run in stages(path):
+        seconds, peak = measure(setup, run, repeat)
+        pixels = size * size * (channels if name in ('read', 'write')
+                                else 1)
+        results['{}/{}'.format(name, config)] = {
+            'seconds': seconds,
+            'mpix_per_s': pixels / seconds / 1e6 if seconds else None,
+            'peak_bytes': peak,
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the keys of the results that are slower than the baseline by more
+    than the tolerance (a fraction), with their ratios.
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key]['seconds'] / baseline[key]['seconds']
+        if ratio > 1 + tolerance:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def report(results, baseline=None):
+    print('{:<44} {:>11} {:>10} {:>10}{}'.format(
+        'stage', 'time (ms)', 'MPix/s', 'peak (MB)',
+        '   vs base' if baseline else ''))
+    for key in sorted(results, key=lambda k: (k.split('/', 1)[1], k)):
+        result = results[key]
+        line = '{:<44} {:>11.3f} {:>10.1f} {:>10.1f}'.format(
+            key, result['seconds'] * 1e3, result['mpix_per_s'] or 0,
+            result['peak_bytes'] / 2 ** 20)
+        if baseline and key in baseline:
+            line += ' {:>9.2f}x'.format(
+                result['seconds'] / baseline[key]['seconds'])
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024])
+    parser.add_argument('--bytes', type=int, nargs='+', choices=(2, 4),
+                        default=[2, 4])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1])
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--directory',
+                        help='where to keep the generated files (default: a '
+                             'temporary directory that is removed)')
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline as a '
+                             'fraction (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    directory = args.directory or tempfile.mkdtemp(prefix='nanoscope-bench')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    results = {}
+    try:
+        for size in args.sizes:
+            for bytes_per_pixel in args.bytes:
+                for channels in args.channels:
+                    results.update(benchmark(directory, size, bytes_per_pixel,
+                                             channels, args.repeat))
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for key, ratio in regressions:
+            print('REGRESSION {}: {:.2f}x the baseline time'.format(
+                key, ratio))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
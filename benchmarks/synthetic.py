@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+    synthetic
+    ---------
+
+    Generates synthetic but valid Nanoscope files of any size for the
+    benchmarks. The file level header is taken from the sample file in
+    ``tests/files`` so that header parsing sees a realistic mix of
+    parameters, and each image gets its own ``Ciao image list`` section.
+
+    The image data is a tilted, curved surface with features and noise, so
+    that flattening and the statistics do real work. It is written a block of
+    scanlines at a time, so files larger than memory can be generated.
+
+    Usage::
+
+        $ python benchmarks/synthetic.py out.spm --size 4096 --bytes 4 \\
+              --channels 3
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import io
+import os
+
+import numpy as np
+
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                      'tests', 'files', 'full_multiple_images.txt')
+
+CHANNELS = [
+    # (image type, sensitivity)
+    ('Height', 'Sens. Zscan'),
+    ('Amplitude', 'Sens. Amplitude'),
+    ('Phase', 'Sens. Phase'),
+    ('Deflection', 'Sens. Deflection'),
+    ('Friction', 'Sens. Friction'),
+    ('Potential', 'Sens. Potential'),
+    ('Current', 'Sens. Current'),
+    ('Frequency', 'Sens. Frequency'),
+]
+
+IMAGE_SECTION = '\r\n'.join([
+    '\\*Ciao image list',
+    '\\Data offset: {offset}',
+    '\\Data length: {length}',
+    '\\Bytes/pixel: {bytes_per_pixel}',
+    '\\Start context: OL',
+    '\\Data type: AFM',
+    '\\Note: ',
+    '\\Plane fit: 0 0 0 0',
+    '\\Frame direction: Down',
+    '\\Samps/line: {size}',
+    '\\Number of lines: {size}',
+    '\\Aspect ratio: 1:1',
+    '\\Scan size: 2 2 ~m',
+    '\\Scan line: Main',
+    '\\Line direction: Retrace',
+    '\\Realtime planefit: Line',
+    '\\Offline planefit: None',
+    '\\Valid data len X: {size}',
+    '\\Valid data len Y: {size}',
+    '\\@2:Image Data: S [{name}] "{name}"',
+    '\\@Z magnify: C [2:Z scale] 0.002639945 ',
+    '\\@2:Z scale: V [{sensitivity}] (0.006693481 V/LSB) 438.6572 V',
+    '\\@2:Z offset: V [{sensitivity}] (0.006693481 V/LSB)       0 V',
+]) + '\r\n'
+
+BLOCK_LINES = 256
+
+
+def file_header(sample=SAMPLE):
+    """
+    Returns the file level header lines of the sample file, up to its first
+    image section.
+    """
+    with io.open(sample, 'rb') as f:
+        header = f.read(65536)
+    return header[:header.index(b'\\*Ciao image list')].decode('cp1252')
+
+
+def surface(size, start, stop, bytes_per_pixel, seed):
+    """
+    Returns scanlines ``start`` to ``stop`` of a synthetic surface, scaled to
+    use most of the range of the integer type.
+    """
+    random = np.random.RandomState(seed + start)
+    y = np.linspace(-1, 1, size)[start:stop, np.newaxis]
+    x = np.linspace(-1, 1, size)[np.newaxis, :]
+    # per-line tilt and offset, as left by the scanner, plus a bowed surface
+    # with periodic features and noise
+    data = (0.3 * x * (1 + 0.1 * np.sin(7 * y)) + 0.1 * y + 0.2 * x ** 2 +
+            0.05 * np.sin(40 * x) * np.cos(40 * y) +
+            0.01 * random.standard_normal((stop - start, size)))
+    limit = 2 ** (8 * bytes_per_pixel - 1) - 1
+    return np.round(data * 0.8 * limit).astype('<i{}'.format(bytes_per_pixel))
+
+
+def write_spm(path, size=512, bytes_per_pixel=2, channels=1, seed=0):
+    """
+    Writes a synthetic Nanoscope file with ``channels`` square images of
+    ``size`` scanlines.
+
+    :returns: The path that was written.
+    """
+    if not 1 <= channels <= len(CHANNELS):
+        raise ValueError('Between 1 and {} channels are '
+                         'supported'.format(len(CHANNELS)))
+    length = size * size * bytes_per_pixel
+    header = file_header()
+    sections = len(IMAGE_SECTION) + 64
+    header_length = len(header) + channels * sections + 64
+    header_length = -(-header_length // 4096) * 4096
+    header = header.replace('\\Data length: 40960',
+                            '\\Data length: {}'.format(header_length), 1)
+
+    for i, (name, sensitivity) in enumerate(CHANNELS[:channels]):
+        header += IMAGE_SECTION.format(
+            offset=header_length + i * length, length=length,
+            bytes_per_pixel=bytes_per_pixel, size=size, name=name,
+            sensitivity=sensitivity)
+    header += '\\*File list end\r\n\x1a'
+    header = header.encode('cp1252')
+    if len(header) > header_length:
+        raise ValueError('Header does not fit in {} bytes'.format(
+            header_length))
+
+    with io.open(path, 'wb') as f:
+        f.write(header + b'\0' * (header_length - len(header)))
+        for channel in range(channels):
+            for start in range(0, size, BLOCK_LINES):
+                stop = min(start + BLOCK_LINES, size)
+                f.write(surface(size, start, stop, bytes_per_pixel,
+                                seed + 1000003 * channel).tobytes())
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('path')
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--bytes', type=int, choices=(2, 4), default=2)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    write_spm(args.path, args.size, args.bytes, args.channels, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,4 +11,11 @@
 
 __version__ = '0.12.1'
 
+import sys
+
 from .nanoscope import read
+from .batch import read_many
+from .bundle import load_bundle
+
+if sys.version_info >= (3, 6):
+    from .aio import aread, aread_many
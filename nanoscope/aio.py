@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio API for reading files from high-latency storage without blocking
+the event loop::
+
+    import nanoscope
+
+    async def ingest(paths):
+        p = await nanoscope.aread('./file.000', channels=['Height'])
+        async for result in nanoscope.aread_many(paths, concurrency=256):
+            if result.error is None:
+                store(result.path, result.file.height.process().summary())
+
+The blocking reads run on a pool of I/O threads. The header of each file is
+read and parsed first, then its channels are read concurrently, and many
+files are read at once, up to the concurrency limit. Requires Python 3.6 or
+later.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import asyncio
+import collections
+import functools
+import io
+from concurrent import futures
+
+import numpy as np
+
+from .batch import ReadResult
+from .error import Error
+from .nanoscope import read
+
+
+__all__ = ['aread', 'aread_many']
+
+
+def _running_loop():
+    return getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+
+
+def _read_bytes(path, offset, length):
+    with io.open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+async def aread(path, encoding='cp1252', header_only=False,
+                check_version=True, channels=None, cache=None, executor=None):
+    """
+    Coroutine that reads the specified file like :func:`nanoscope.read`,
+    running the blocking reads in an executor. The header is read first and
+    then the channels are read concurrently.
+
+    :param path: Filename of the file to read.
+    :param encoding: The encoding to use when reading the file header.
+                     Defaults to cp1252.
+    :param header_only: Whether to read only the file header. Defaults to
+                        False.
+    :param check_version: Whether to enforce version checking for known
+                          supported versions. Defaults to True.
+    :param channels: Names of the image types to load up front, or ``None``
+                     to load all of them. Any other image type is loaded
+                     (blocking) the first time it is accessed.
+    :param cache: Optional :class:`nanoscope.cache.ResultCache` for the
+                  images.
+    :param executor: The ``concurrent.futures.Executor`` to run the reads
+                     in. Defaults to the event loop's default executor.
+    :returns: A NanoscopeFile object containing the image data.
+    """
+    loop = _running_loop()
+    nanoscope_file = await loop.run_in_executor(executor, functools.partial(
+        read, path, encoding, header_only=True, check_version=check_version,
+        cache=cache))
+    if header_only:
+        return nanoscope_file
+
+    nanoscope_file.header_only = False
+    image_types = [image_type for image_type in nanoscope_file.config['_Images']
+                   if channels is None or image_type in channels]
+    extents = [nanoscope_file._image_extent(image_type)
+               for image_type in image_types]
+    data = await asyncio.gather(*[
+        loop.run_in_executor(executor, _read_bytes, path, offset,
+                             dtype.itemsize * shape[0] * shape[1])
+        for offset, dtype, shape in extents])
+    for image_type, (_, dtype, shape), buffer in zip(image_types, extents,
+                                                     data):
+        raw_data = np.frombuffer(buffer, dtype=dtype,
+                                 count=shape[0] * shape[1])
+        nanoscope_file._add_image(image_type, raw_data.reshape(shape))
+    return nanoscope_file
+
+
+async def _aread_result(path, options):
+    try:
+        return ReadResult(path, await aread(path, **options), None)
+    except (Error, EnvironmentError, ValueError, KeyError) as e:
+        return ReadResult(path, None, e)
+
+
+async def aread_many(paths, concurrency=64, ordered=True, executor=None,
+                     encoding='cp1252', header_only=False, check_version=True,
+                     channels=None, cache=None):
+    """
+    Asynchronous generator that reads many files concurrently, yielding a
+    :class:`nanoscope.batch.ReadResult` for each. Errors are captured in the
+    result for the file instead of aborting the batch, as in
+    :func:`nanoscope.read_many`.
+
+    At most ``concurrency`` files are in flight, and no more are started
+    until their results are consumed, so a slow consumer holds back the
+    reads rather than buffering results.
+
+    :param paths: Iterable or asynchronous iterable of filenames to read.
+    :param concurrency: The maximum number of files read at once. Defaults
+                        to 64.
+    :param ordered: Whether to yield results in the order of ``paths``
+                    rather than as they complete. Defaults to True.
+    :param executor: The ``concurrent.futures.Executor`` to run the reads
+                     in. Defaults to a pool of ``concurrency`` threads for
+                     the batch.
+    :param encoding: The encoding to use when reading the file headers.
+    :param header_only: Whether to read only the file headers.
+    :param check_version: Whether to enforce version checking.
+    :param channels: Names of the image types to load up front.
+    :param cache: Optional :class:`nanoscope.cache.ResultCache` for the
+                  images.
+    :raises ValueError: If concurrency is less than 1.
+    """
+    if concurrency < 1:
+        raise ValueError('Concurrency must be at least 1')
+    own_executor = executor is None
+    if own_executor:
+        executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+    options = dict(encoding=encoding, header_only=header_only,
+                   check_version=check_version, channels=channels,
+                   cache=cache, executor=executor)
+    loop = _running_loop()
+    if hasattr(paths, '__aiter__'):
+        paths = paths.__aiter__()
+        next_path = paths.__anext__
+    else:
+        paths = iter(paths)
+
+        async def next_path():
+            try:
+                return next(paths)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    pending = collections.deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    path = await next_path()
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    pending.append(loop.create_task(
+                        _aread_result(path, options)))
+            if not pending:
+                return
+
+            if ordered:
+                yield await pending.popleft()
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.remove(task)
+                    yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
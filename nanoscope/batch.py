@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import collections
+import functools
+import io
+import multiprocessing
+import threading
+import timeit
+from concurrent import futures
+
+from .error import Error
+from .nanoscope import read
+
+
+__all__ = ['ReadResult', 'PrefetchStats', 'Prefetcher', 'imap', 'prefetch',
+           'read_many']
+
+
+ReadResult = collections.namedtuple('ReadResult', ['path', 'file', 'error'])
+"""
+Result of reading one file in a batch. ``file`` is the NanoscopeFile, or
+``None`` if reading failed with ``error``.
+"""
+
+PrefetchStats = collections.namedtuple('PrefetchStats', [
+    'files', 'bytes', 'elapsed', 'io_seconds', 'wait_seconds',
+    'compute_seconds', 'io_utilization', 'compute_utilization'])
+"""
+Utilization of a :class:`Prefetcher`. ``io_seconds`` is the time the I/O
+thread spent reading, ``wait_seconds`` the time the caller spent waiting for
+the next file and ``compute_seconds`` the time the caller spent on each file
+before asking for the next. The utilizations are those times as a fraction
+of the ``elapsed`` time.
+"""
+
+_EXECUTORS = {
+    'thread': futures.ThreadPoolExecutor,
+    'process': futures.ProcessPoolExecutor,
+}
+
+
+def _read(path, options):
+    """
+    Reads a single file, capturing errors in the result instead of raising.
+    """
+    try:
+        return ReadResult(path, read(path, **options), None)
+    except (Error, EnvironmentError, ValueError, KeyError) as e:
+        return ReadResult(path, None, e)
+
+
+def read_many(paths, workers=None, executor='thread', ordered=True,
+              encoding='cp1252', header_only=False, check_version=True,
+              mmap=False, channels=None):
+    """
+    Reads many files in parallel, streaming the results back as they are
+    ready. Meant as the batch counterpart of :func:`nanoscope.read`.
+
+    Files that cannot be read do not abort the batch; their error (e.g.
+    ``UnsupportedVersion``, ``MissingImageData``, ``InvalidParameter`` or an
+    ``OSError``) is returned in the result for that file instead.
+
+    :param paths: Iterable of filenames to read.
+    :param workers: The number of workers. Defaults to the number of CPUs.
+    :param executor: ``'thread'``, ``'process'``, or an existing
+                     ``concurrent.futures.Executor`` to submit the reads to.
+                     Defaults to ``'thread'``.
+    :param ordered: Whether to return results in the order of ``paths``
+                    rather than as they complete. Defaults to True.
+    :param encoding: The encoding to use when reading the file headers.
+    :param header_only: Whether to read only the file headers.
+    :param check_version: Whether to enforce version checking.
+    :param mmap: Whether to memory-map the image data.
+    :param channels: Names of the image types to load up front.
+    :returns: An iterator of :class:`ReadResult`.
+    :raises ValueError: If the executor type is unknown.
+    """
+    options = dict(encoding=encoding, header_only=header_only,
+                   check_version=check_version, mmap=mmap, channels=channels)
+    return imap(functools.partial(_read, options=options), paths, workers,
+                executor, ordered)
+
+
+def imap(function, items, workers=None, executor='thread', ordered=True):
+    """
+    Calls the function on each item in parallel, streaming the results back
+    as they are ready. The building block of :func:`read_many`, for batch
+    jobs that do more than read each file.
+
+    :param function: The function to call. It must be picklable (e.g. a
+                     module level function or a ``functools.partial`` of
+                     one) to be used with a process executor.
+    :param items: Iterable of the items to call the function on.
+    :param workers: The number of workers. Defaults to the number of CPUs.
+    :param executor: ``'thread'``, ``'process'``, or an existing
+                     ``concurrent.futures.Executor``. Defaults to
+                     ``'thread'``.
+    :param ordered: Whether to return results in the order of ``items``
+                    rather than as they complete. Defaults to True.
+    :returns: An iterator of the results.
+    :raises ValueError: If the executor type is unknown.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if isinstance(executor, futures.Executor):
+        return _stream(executor, function, items, workers, ordered)
+    if executor not in _EXECUTORS:
+        raise ValueError('Unknown executor {}'.format(executor))
+    return _stream_owned(_EXECUTORS[executor](max_workers=workers), function,
+                         items, workers, ordered)
+
+
+def _stream_owned(pool, function, items, workers, ordered):
+    with pool:
+        for result in _stream(pool, function, items, workers, ordered):
+            yield result
+
+
+def _stream(pool, function, items, workers, ordered):
+    """
+    Submits calls to the pool, keeping at most two per worker in flight so
+    that results are not buffered faster than they are consumed.
+    """
+    limit = 2 * workers
+    pending = collections.deque()
+    items = iter(items)
+    exhausted = False
+
+    while True:
+        while not exhausted and len(pending) < limit:
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+            else:
+                pending.append(pool.submit(function, item))
+        if not pending:
+            return
+
+        if ordered:
+            yield pending.popleft().result()
+        else:
+            done, _ = futures.wait(pending,
+                                   return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                yield future.result()
+
+
+def prefetch(paths, depth=2, max_bytes=256 << 20, encoding='cp1252',
+             header_only=False, check_version=True, channels=None):
+    """
+    Reads the files one after the other on a background I/O thread, reading
+    ahead while the caller processes the current file, so that reading and
+    processing overlap. The files are returned as :class:`ReadResult` in the
+    order of ``paths``, as from :func:`read_many`.
+
+    :param paths: Iterable of filenames to read.
+    :param depth: The number of files to read ahead of the current one.
+                  Defaults to 2.
+    :param max_bytes: The maximum size of the image data read ahead,
+                      including the current file. A file larger than this is
+                      read once every earlier file has been released.
+                      Defaults to 256 MiB.
+    :param encoding: The encoding to use when reading the file headers.
+    :param header_only: Whether to read only the file headers.
+    :param check_version: Whether to enforce version checking.
+    :param channels: Names of the image types to read ahead. Any other image
+                     type is loaded the first time it is accessed.
+    :returns: A :class:`Prefetcher` to iterate over.
+    :raises ValueError: If depth is less than 1.
+    """
+    return Prefetcher(paths, depth, max_bytes, encoding=encoding,
+                      header_only=header_only, check_version=check_version,
+                      channels=channels)
+
+
+class Prefetcher(object):
+    """
+    Iterator of the :class:`ReadResult` of files read ahead on a background
+    thread. See :func:`prefetch`.
+    """
+    _clock = staticmethod(timeit.default_timer)
+
+    def __init__(self, paths, depth=2, max_bytes=256 << 20, **options):
+        if depth < 1:
+            raise ValueError('Depth must be at least 1')
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self._paths = iter(paths)
+        self._options = options
+        self._queue = collections.deque()
+        self._buffered = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._done = False
+        self._closed = False
+        self._error = None
+        self._files = 0
+        self._bytes = 0
+        self._io_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._compute_seconds = 0.0
+        self._started = None
+        self._stopped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        if self._thread is not None:
+            raise ValueError('A Prefetcher can only be iterated once')
+        self._started = self._clock()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._results()
+
+    def close(self):
+        """
+        Stops reading ahead and waits for the I/O thread to finish.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._stopped is None:
+            self._stopped = self._clock()
+
+    def stats(self):
+        """
+        Returns the :class:`PrefetchStats` of the files returned so far.
+        """
+        end = self._stopped or self._clock()
+        elapsed = end - self._started if self._started is not None else 0.0
+        return PrefetchStats(
+            self._files, self._bytes, elapsed, self._io_seconds,
+            self._wait_seconds, self._compute_seconds,
+            self._io_seconds / elapsed if elapsed else 0.0,
+            self._compute_seconds / elapsed if elapsed else 0.0)
+
+    def _results(self):
+        size = 0
+        try:
+            while True:
+                start = self._clock()
+                with self._condition:
+                    self._buffered -= size  # the previous file is released
+                    self._condition.notify_all()
+                    while not self._queue and not self._done:
+                        self._condition.wait()
+                    if self._error is not None:
+                        raise self._error
+                    if not self._queue:
+                        return
+                    result, size = self._queue.popleft()
+                    self._condition.notify_all()
+                self._wait_seconds += self._clock() - start
+                self._files += 1
+                self._bytes += size
+
+                start = self._clock()
+                yield result
+                self._compute_seconds += self._clock() - start
+        finally:
+            self.close()
+
+    def _run(self):
+        try:
+            for path in self._paths:
+                if not self._read_ahead(path):
+                    return
+        except BaseException as e:
+            with self._condition:
+                self._error = e
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+
+    def _read_ahead(self, path):
+        """
+        Reads the file into the queue once there is room for it, returning
+        False if the prefetcher was closed.
+        """
+        options = self._options
+        start = self._clock()
+        try:
+            nanoscope_file = read(path, options['encoding'], header_only=True,
+                                  check_version=options['check_version'])
+            image_types = [] if options['header_only'] else [
+                t for t in nanoscope_file.config['_Images']
+                if options['channels'] is None or t in options['channels']]
+            extents = [nanoscope_file._image_extent(t) for t in image_types]
+            size = sum(dtype.itemsize * shape[0] * shape[1]
+                       for _, dtype, shape in extents)
+        except (Error, EnvironmentError, ValueError, KeyError) as e:
+            nanoscope_file, image_types, size = e, [], 0
+        self._io_seconds += self._clock() - start
+
+        with self._condition:
+            while not self._closed and (
+                    len(self._queue) >= self.depth or
+                    (self._buffered and
+                     self._buffered + size > self.max_bytes)):
+                self._condition.wait()
+            if self._closed:
+                return False
+            self._buffered += size
+
+        start = self._clock()
+        if isinstance(nanoscope_file, Exception):
+            result = ReadResult(path, None, nanoscope_file)
+        else:
+            result = ReadResult(path, nanoscope_file, None)
+            nanoscope_file.header_only = options['header_only']
+            try:
+                with io.open(path, 'rb') as file_object:
+                    for image_type in image_types:
+                        nanoscope_file._read_image_data(file_object,
+                                                        image_type)
+            except (Error, EnvironmentError, ValueError, KeyError) as e:
+                result = ReadResult(path, None, e)
+        self._io_seconds += self._clock() - start
+
+        with self._condition:
+            self._queue.append((result, size))
+            self._condition.notify_all()
+        return True
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Sidecar bundles of parsed Nanoscope files.
+
+A bundle holds the parsed header and the raw, flattened and converted data
+of every channel in a single file, so preprocessed scans can be reopened
+without parsing the text header or processing the data again::
+
+    import nanoscope
+
+    p = nanoscope.read('./file.000')
+    p.height.process()
+    p.save_bundle('./file.nsb')
+
+    p = nanoscope.load_bundle('./file.nsb')  # arrays are memory-mapped
+
+The file starts with an 8 byte magic string, the format version and the
+length of a JSON header as little-endian uint32, then the JSON header. The
+arrays follow, each aligned to 64 bytes from the start of the data section.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+import io
+import json
+import struct
+
+import numpy as np
+import six
+
+from .error import InvalidBundle
+from .nanoscope import NanoscopeFile
+from .parameter import (CiaoParameter, CiaoValue, CiaoScale, CiaoSelect,
+                        CiaoSectionHeader)
+from .units import Quantity, parse_quantity
+
+
+__all__ = ['save_bundle', 'load_bundle']
+
+
+MAGIC = b'NSBUNDLE'
+VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct('<8sII')
+_ARRAYS = ('raw', 'flat', 'converted')
+_PARAMETERS = dict((cls.__name__, cls)
+                   for cls in (CiaoParameter, CiaoValue, CiaoScale, CiaoSelect,
+                               CiaoSectionHeader))
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+_UNITS = {}
+
+
+def _encode(value):
+    """
+    Returns a JSON-serializable form of a header value, tagging the types that
+    JSON cannot represent so they can be restored.
+    """
+    if isinstance(value, dict):
+        return dict((k, _encode(v)) for k, v in six.iteritems(value))
+    if isinstance(value, datetime.datetime):
+        return {'__date__': value.strftime(_DATE_FORMAT)}
+    if isinstance(value, CiaoParameter):
+        return {'__parameter__': type(value).__name__,
+                'attributes': _encode(vars(value))}
+    if hasattr(value, 'unit') and hasattr(value, 'value'):
+        return {'__quantity__': [float(value.value),
+                                 value.unit.to_string()]}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value):
+    """
+    Restores a tagged header value from the form returned by :func:`_encode`.
+    Used as the ``object_hook`` of the JSON decoder, so it is called for every
+    JSON object, innermost first.
+    """
+    if '__date__' in value:
+        return datetime.datetime.strptime(value['__date__'], _DATE_FORMAT)
+    if '__quantity__' in value:
+        return _quantity(*value['__quantity__'])
+    if '__parameter__' in value:
+        parameter = _PARAMETERS[value['__parameter__']].__new__(
+            _PARAMETERS[value['__parameter__']])
+        parameter.__dict__.update(value['attributes'])
+        return parameter
+    return value
+
+
+def _quantity(number, unit):
+    """
+    Returns the quantity with the given value and unit string, parsing each
+    distinct unit string only once.
+    """
+    parsed = _UNITS.get(unit)
+    if parsed is None:
+        parsed = _UNITS[unit] = parse_quantity('1 ' + unit)
+    if isinstance(parsed, Quantity):
+        return Quantity(number, parsed.unit)
+    return parsed * number
+
+
+def _header_text(nanoscope_file):
+    """
+    Returns the original header block of the file as text, or ``None``.
+    """
+    header = getattr(nanoscope_file, '_header', None)
+    if isinstance(header, bytes):
+        return header.decode(nanoscope_file.encoding)
+    return header
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_bundle(nanoscope_file, path):
+    """
+    Writes the parsed header and the raw, flattened and converted data of
+    every channel of the file into a bundle. Channels that have not been
+    loaded yet are loaded first.
+
+    :param nanoscope_file: The NanoscopeFile to save.
+    :param path: The path of the bundle to write.
+    """
+    images = {}
+    arrays = []
+    end = 0
+    for image in nanoscope_file:
+        entry = {'height_scale': image.height_scale, 'arrays': {},
+                 'params': {}, 'converted_from_flat': (
+                     image._conversion is not None and
+                     image._conversion[0] is image.flat_data and
+                     image._conversion[2] is image.converted_data)}
+        written = {}
+        for name in _ARRAYS:
+            array = getattr(image, name + '_data')
+            if array is None:
+                continue
+            params = image._params(array)
+            if params is not None:
+                entry['params'][name] = list(params)
+            if id(array) in written:  # e.g. flat data that is the raw data
+                entry['arrays'][name] = written[id(array)]
+                continue
+            contiguous = np.ascontiguousarray(array)
+            info = {'offset': _aligned(end), 'dtype': contiguous.dtype.str,
+                    'shape': list(contiguous.shape)}
+            entry['arrays'][name] = written[id(array)] = info
+            arrays.append((info['offset'], contiguous))
+            end = info['offset'] + contiguous.nbytes
+        images[image.type] = entry
+
+    header = json.dumps({
+        'config': _encode(nanoscope_file.config),
+        'encoding': nanoscope_file.encoding,
+        'header': _header_text(nanoscope_file),
+        'header_only': nanoscope_file.header_only,
+        'images': images,
+    }).encode('utf-8')
+    start = _aligned(_PREAMBLE.size + len(header))
+
+    with io.open(path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for offset, array in arrays:
+            f.seek(start + offset)
+            f.write(memoryview(array.reshape(-1).view(np.uint8)))
+        f.truncate(start + end)
+
+
+def load_bundle(path, mode='r', cache=None):
+    """
+    Opens a bundle written by :func:`save_bundle`. The arrays of every channel
+    are memory-mapped from the bundle without being copied.
+
+    :param path: The path of the bundle.
+    :param mode: The ``np.memmap`` mode of the arrays. Defaults to ``'r'``
+                 (read-only); ``'c'`` allows the arrays to be changed in
+                 memory without changing the bundle.
+    :param cache: Optional :class:`nanoscope.cache.ResultCache` for the
+                  images, as for :func:`nanoscope.read`.
+    :returns: A NanoscopeFile with the channels of the bundle.
+    :raises InvalidBundle: If the file is not a bundle or its format version
+                           is not supported.
+    """
+    with io.open(path, 'rb') as f:
+        preamble = f.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise InvalidBundle(path, 'file is too short')
+        magic, version, length = _PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise InvalidBundle(path, 'bad magic string')
+        if version != VERSION:
+            raise InvalidBundle(path, 'unsupported version {}'.format(version))
+        header = json.loads(f.read(length).decode('utf-8'),
+                            object_hook=_decode)
+    start = _aligned(_PREAMBLE.size + length)
+
+    nanoscope_file = NanoscopeFile.__new__(NanoscopeFile)
+    nanoscope_file.images = {}
+    nanoscope_file.config = header['config']
+    nanoscope_file.encoding = header['encoding']
+    nanoscope_file.header_only = header['header_only']
+    nanoscope_file.mmap = True
+    nanoscope_file.cache = cache
+    nanoscope_file._mmap = None
+    nanoscope_file._header = header.get('header')
+    nanoscope_file._file_object = None
+    nanoscope_file._file_name = None
+    if not header['images']:
+        return nanoscope_file
+
+    data = np.memmap(path, dtype=np.uint8, mode=mode)
+    nanoscope_file._mmap = data
+    views = {}
+    for image_type, entry in six.iteritems(header['images']):
+        arrays = {}
+        for name, info in six.iteritems(entry['arrays']):
+            if info['offset'] in views:  # e.g. flat data that is the raw data
+                arrays[name] = views[info['offset']]
+                continue
+            dtype = np.dtype(str(info['dtype']))
+            shape = tuple(info['shape'])
+            offset = start + info['offset']
+            length = dtype.itemsize * int(np.prod(shape))
+            if offset + length > data.size:
+                raise InvalidBundle(path, 'data of {} is '
+                                    'truncated'.format(image_type))
+            arrays[name] = views[info['offset']] = (
+                data[offset:offset + length].view(dtype).reshape(shape))
+
+        image = nanoscope_file._make_image(image_type, arrays.get('raw'))
+        image.flat_data = arrays.get('flat')
+        image.converted_data = arrays.get('converted')
+        image.height_scale = entry['height_scale']
+        for name, params in six.iteritems(entry['params']):
+            if name != 'raw':
+                image._provenance.append((arrays[name], tuple(params)))
+        if entry['converted_from_flat']:
+            image._conversion = (image.flat_data, image.conversion_factor,
+                                 image.converted_data)
+        nanoscope_file.images[image_type] = image
+    return nanoscope_file
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of processed image data and statistics.
+
+Results are keyed by a fingerprint of the raw data of a channel and the
+parameters used to process it, so the same scan is only processed once no
+matter which file handle or report it is read from::
+
+    import nanoscope
+    from nanoscope.cache import ResultCache
+
+    cache = ResultCache('~/.cache/nanoscope', max_bytes=2 << 30)
+    p = nanoscope.read('./file.000', cache=cache)
+    p.height.process().summary()  # loaded from the cache on a warm run
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import collections
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from . import metrics
+
+
+__all__ = ['ResultCache', 'fingerprint']
+
+
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'entries', 'size'])
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def fingerprint(data):
+    """
+    Returns a hex digest that identifies the contents, type and shape of the
+    array.
+    """
+    data = np.ascontiguousarray(data)
+    digest = hashlib.sha1('{}{}'.format(data.dtype.str,
+                                        data.shape).encode('ascii'))
+    digest.update(data.view(np.uint8).reshape(-1))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Directory of cached arrays (as ``.npy`` files that are memory-mapped when
+    loaded) and statistics (as JSON), evicted in least recently used order
+    once their total size exceeds ``max_bytes``.
+
+    The cache may be shared by several processes. Entries are written to a
+    temporary file and renamed into place, so readers never see a partial
+    entry. The directory is listed once and the total size is then tracked
+    as entries are saved, so saving does not slow down as the cache grows.
+    Entries saved by other processes are counted the next time the directory
+    is listed, after :meth:`info` or :meth:`clear`.
+
+    :param directory: The directory holding the cache. It is created if
+                      needed.
+    :param max_bytes: The maximum total size of the cached entries. Defaults
+                      to 1 GiB.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._reset()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_lock', '_index', '_heap', '_size'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._reset()
+
+    @staticmethod
+    def key(digest, *params):
+        """
+        Returns the cache key for the data with the given :func:`fingerprint`
+        processed with the given parameters.
+        """
+        params = json.dumps([digest] + [str(p) for p in params])
+        return hashlib.sha1(params.encode('utf-8')).hexdigest()
+
+    def load_array(self, key):
+        """
+        Returns the cached array for the key as a copy-on-write memory map, or
+        ``None`` if it is not cached. Writing to the array never changes the
+        cached entry.
+        """
+        path = self._path(key, '.npy')
+        try:
+            array = np.load(path, mmap_mode='c')
+        except (IOError, OSError, ValueError):
+            return self._miss()
+        return self._hit(path, array)
+
+    def save_array(self, key, array):
+        """
+        Stores the array under the key, evicting old entries if needed.
+        """
+        def write(f):
+            np.save(f, np.asanyarray(array), allow_pickle=False)
+        self._save(key, '.npy', write)
+
+    def load_json(self, key):
+        """
+        Returns the cached JSON value for the key, or ``None`` if it is not
+        cached.
+        """
+        path = self._path(key, '.json')
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except (IOError, OSError, ValueError):
+            return self._miss()
+        return self._hit(path, value)
+
+    def save_json(self, key, value):
+        """
+        Stores the JSON-serializable value under the key, evicting old entries
+        if needed.
+        """
+        data = json.dumps(value).encode('utf-8')
+        self._save(key, '.json', lambda f: f.write(data))
+
+    def info(self):
+        """
+        Returns the hit and miss counts, and the number and total size of the
+        cached entries.
+        """
+        entries = self._entries()
+        with self._lock:
+            self._reset()
+        return CacheInfo(self.hits, self.misses, len(entries),
+                         sum(size for _, size, _ in entries))
+
+    def clear(self):
+        """
+        Removes every entry and resets the hit and miss counts.
+        """
+        for path, _, _ in self._entries():
+            self._remove(path)
+        with self._lock:
+            self._reset()
+            self.hits = 0
+            self.misses = 0
+
+    def _reset(self):
+        """
+        Forgets the tracked entries, so the directory is listed again on the
+        next save.
+        """
+        # path -> (mtime, size) of the known entries, and a heap of
+        # (mtime, path, size) in least recently used order, which may hold
+        # outdated records that no longer match the index
+        self._index = None
+        self._heap = None
+        self._size = 0
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def _hit(self, path, value):
+        try:
+            os.utime(path, None)  # the modification time orders the LRU
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        metrics.count('result_cache_hits')
+        return value
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+        metrics.count('result_cache_misses')
+        return None
+
+    def _save(self, key, extension, write):
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        path = self._path(key, extension)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            stat = os.stat(temp)
+            _replace(temp, path)
+        except BaseException:
+            self._remove(temp)
+            raise
+        with self._lock:
+            if self._index is None:
+                self._scan()
+            else:
+                self._track(path, stat.st_mtime, stat.st_size)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.npy', '.json')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _scan(self):
+        """
+        Tracks the entries in the directory, replacing any tracked before.
+        """
+        entries = self._entries()
+        self._index = dict((path, (mtime, size))
+                           for path, size, mtime in entries)
+        self._heap = [(mtime, path, size) for path, size, mtime in entries]
+        heapq.heapify(self._heap)
+        self._size = sum(size for _, size, _ in entries)
+
+    def _track(self, path, mtime, size):
+        previous = self._index.get(path)
+        if previous is not None:
+            self._size -= previous[1]
+        self._index[path] = (mtime, size)
+        heapq.heappush(self._heap, (mtime, path, size))
+        self._size += size
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the total size is at
+        most ``max_bytes``. Each entry is checked before it is removed, as a
+        hit (in any process) makes it recently used again.
+        """
+        while self._size > self.max_bytes and self._heap:
+            mtime, path, size = heapq.heappop(self._heap)
+            if self._index.get(path) != (mtime, size):
+                continue  # outdated record
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is not None and stat.st_mtime != mtime:
+                self._track(path, stat.st_mtime, stat.st_size)
+                continue
+            if stat is not None:
+                self._remove(path)
+            del self._index[path]
+            self._size -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface, installed as the ``nanoscope`` command::
+
+    nanoscope info scans/ --channels Height
+    nanoscope stats 'scans/*.spm' -j 8 --order 2 --format ndjson
+    nanoscope render scans/ -o images/
+    nanoscope convert scans/ -o bundles/
+
+Every subcommand takes files, glob patterns or directories (searched
+recursively), processes the files in parallel with ``-j`` workers and streams
+one CSV or NDJSON row per file or channel to stdout as soon as it is ready.
+Files that cannot be read get a row with an ``error`` instead.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import argparse
+import csv
+import errno
+import fnmatch
+import functools
+import glob
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import six
+
+from . import __version__
+from .batch import imap
+from .error import Error
+from .nanoscope import FILE_PATTERNS, read
+
+
+__all__ = ['main']
+
+
+_SUMMARY = ('mean_height', 'min_height', 'max_height', 'Ra', 'Rq', 'Rp', 'Rv',
+            'Rt', 'Rpm', 'Rvm', 'Rz', 'Pc', 'Pd', 'HSC', 'LSC')
+_FIELDS = {
+    'info': ('path', 'channel', 'description', 'lines', 'samples',
+             'bytes_per_pixel', 'data_offset', 'version', 'date', 'error'),
+    'stats': ('path', 'channel', 'unit') + _SUMMARY + ('error',),
+    'render': ('path', 'channel', 'output', 'error'),
+    'convert': ('path', 'channel', 'output', 'error'),
+}
+
+# Longest error message written in a row
+_MAX_ERROR = 200
+
+
+def _expand(paths, patterns):
+    """
+    Generator of the files named by ``paths``, expanding glob patterns and
+    searching directories recursively for files matching any of
+    ``patterns``. Paths that match nothing are passed through so they are
+    reported as errors.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if any(fnmatch.fnmatch(filename, pattern)
+                           for pattern in patterns):
+                        yield os.path.join(directory, filename)
+        elif glob.has_magic(path):
+            for match in sorted(glob.glob(path)):
+                if os.path.isdir(match):
+                    for found in _expand([match], patterns):
+                        yield found
+                else:
+                    yield match
+        else:
+            yield path
+
+
+def _channels(nanoscope_file, channels):
+    names = list(nanoscope_file.config['_Images'])
+    if channels is None:
+        return names
+    return [name for name in names if name in channels]
+
+
+def _output_path(path, directory, suffix):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(directory or os.path.dirname(path), stem + suffix)
+
+
+def _info(path, options):
+    nanoscope_file = read(path, header_only=True)
+    for name in _channels(nanoscope_file, options['channels']):
+        config = nanoscope_file.config['_Images'][name]
+        date = nanoscope_file.config.get('Date')
+        yield {
+            'path': path,
+            'channel': name,
+            'description': config.get('Description'),
+            'lines': config.get('Number of lines'),
+            'samples': config.get('Samps/line'),
+            'bytes_per_pixel': config.get('Bytes/pixel'),
+            'data_offset': config.get('Data offset'),
+            'version': nanoscope_file.config.get('Version'),
+            'date': date.isoformat() if date is not None else None,
+        }
+
+
+def _stats(path, options):
+    nanoscope_file = read(path, channels=options['channels'], mmap=True)
+    for name in _channels(nanoscope_file, options['channels']):
+        image = nanoscope_file.image(name)
+        row = {'path': path, 'channel': name, 'unit': image.unit}
+        row.update(image.summarize(options['order']))
+        yield row
+
+
+def _render(path, options):
+    nanoscope_file = read(path, channels=options['channels'], mmap=True)
+    for name in _channels(nanoscope_file, options['channels']):
+        image = nanoscope_file.image(name)
+        pixels = image.process(options['order']).colorize()
+        output = _output_path(path, options['output'], '_{}.{}'.format(
+            name, options['image_format']))
+        _write_image(pixels, output, options['image_format'])
+        yield {'path': path, 'channel': name, 'output': output}
+
+
+def _convert(path, options):
+    nanoscope_file = read(path, channels=options['channels'], mmap=True)
+    channels = _channels(nanoscope_file, options['channels'])
+    for name in channels:
+        nanoscope_file.image(name).process(options['order'])
+    if options['to'] == 'bundle':
+        nanoscope_file.images = dict((name, nanoscope_file.image(name))
+                                     for name in channels)
+        nanoscope_file.config['_Images'] = dict(
+            (name, nanoscope_file.config['_Images'][name])
+            for name in channels)
+        output = _output_path(path, options['output'], '.nsb')
+        nanoscope_file.save_bundle(output)
+        yield {'path': path, 'channel': ','.join(channels), 'output': output}
+        return
+    for name in channels:
+        output = _output_path(path, options['output'], '_{}.npy'.format(name))
+        np.save(output, nanoscope_file.image(name).converted_data)
+        yield {'path': path, 'channel': name, 'output': output}
+
+
+def _write_image(pixels, path, image_format):
+    """
+    Writes the RGB pixels as a binary PPM, or through Pillow for any other
+    format.
+    """
+    if image_format == 'ppm':
+        with io.open(path, 'wb') as f:
+            f.write('P6\n{} {}\n255\n'.format(pixels.shape[1],
+                                              pixels.shape[0]).encode('ascii'))
+            f.write(np.ascontiguousarray(pixels).tobytes())
+        return
+    from PIL import Image
+    Image.fromarray(pixels).save(path)
+
+
+def _has_pillow():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_COMMANDS = {
+    'info': _info,
+    'stats': _stats,
+    'render': _render,
+    'convert': _convert,
+}
+
+
+def _run(path, command, options):
+    """
+    Runs the command on one file, returning its rows. Errors are returned as
+    a row for the file instead of being raised, so one bad file does not stop
+    the batch.
+    """
+    try:
+        return list(_COMMANDS[command](path, options))
+    except (Error, EnvironmentError, ValueError, KeyError) as e:
+        return [{'path': path, 'error': _error(e)}]
+
+
+def _error(exception):
+    """
+    Returns the message of the exception for an error row, cut down to its
+    first line and at most ``_MAX_ERROR`` characters.
+    """
+    message = '{}: {}'.format(type(exception).__name__, exception)
+    message = (message.splitlines() or [''])[0]
+    if len(message) > _MAX_ERROR:
+        message = message[:_MAX_ERROR - 3] + '...'
+    return message
+
+
+def _value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is not None and not isinstance(value, (six.string_types,
+                                                    six.integer_types,
+                                                    float)):
+        return six.text_type(value)
+    return value
+
+
+class _CsvWriter(object):
+
+    def __init__(self, stream, fields):
+        self.stream = stream
+        self.fields = fields
+        self._writer = csv.writer(stream, lineterminator='\n')
+        self._write(fields)
+
+    def _write(self, values):
+        if six.PY2:
+            values = [six.text_type(v).encode('utf-8') if v is not None
+                      else '' for v in values]
+        self._writer.writerow(values)
+
+    def write(self, row):
+        self._write([_value(row.get(f)) for f in self.fields])
+        self.stream.flush()
+
+
+class _JsonWriter(object):
+
+    def __init__(self, stream, fields):
+        self.stream = stream
+        self.fields = fields
+
+    def write(self, row):
+        row = dict((f, _value(row[f])) for f in self.fields if f in row)
+        self.stream.write(json.dumps(row, sort_keys=True) + '\n')
+        self.stream.flush()
+
+
+_WRITERS = {'csv': _CsvWriter, 'ndjson': _JsonWriter}
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='nanoscope',
+        description='Inspect and process Nanoscope AFM files.')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s {}'.format(__version__))
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('paths', nargs='+', metavar='path',
+                        help='files, glob patterns or directories')
+    common.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of files to process in parallel')
+    common.add_argument('--channels', type=lambda s: s.split(','),
+                        help='comma separated image types, e.g. Height,Phase')
+    common.add_argument('--pattern', action='append', dest='patterns',
+                        help='filename pattern of the files to find in '
+                             'directories, may be given more than once '
+                             '(default: {})'.format(' '.join(FILE_PATTERNS)))
+    common.add_argument('--format', choices=sorted(_WRITERS), default='csv',
+                        help='output format (default: %(default)s)')
+    common.add_argument('--unordered', action='store_true',
+                        help='write rows as files finish, not in order')
+
+    processing = argparse.ArgumentParser(add_help=False)
+    processing.add_argument('--order', type=int, default=1,
+                            help='order of the flattening polynomial '
+                                 '(default: %(default)s)')
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('-o', '--output',
+                        help='output directory (default: next to each file)')
+
+    subparsers.add_parser('info', parents=[common],
+                          help='list the image types in each file')
+    subparsers.add_parser('stats', parents=[common, processing],
+                          help='roughness statistics of each image')
+    render = subparsers.add_parser('render', parents=[common, processing,
+                                                      output],
+                                   help='colorize each image')
+    render.add_argument('--image-format',
+                        help='image file format, ppm is always available '
+                             'and others need Pillow (default: png if '
+                             'Pillow is installed, else ppm)')
+    convert = subparsers.add_parser('convert', parents=[common, processing,
+                                                        output],
+                                    help='save processed data')
+    convert.add_argument('--to', choices=('bundle', 'npy'), default='bundle',
+                         help='bundle of all images or one .npy file per '
+                              'image (default: %(default)s)')
+    return parser
+
+
+def main(argv=None, stdout=None):
+    """
+    Runs the command line interface.
+
+    :param argv: The arguments, defaults to ``sys.argv[1:]``.
+    :param stdout: The text stream rows are written to, defaults to
+                   ``sys.stdout``.
+    :returns: The exit status, 1 if any file failed, else 0. Output stops
+              quietly if the reader of ``stdout`` goes away, e.g. when piped
+              to ``head``.
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.command == 'render':
+        pillow = _has_pillow()
+        if args.image_format is None:
+            args.image_format = 'png' if pillow else 'ppm'
+        elif args.image_format != 'ppm' and not pillow:
+            parser.error('Pillow is needed to write {} images, install it or '
+                         'use --image-format ppm'.format(args.image_format))
+    options = vars(args).copy()
+    command = options.pop('command')
+    if options.get('output') and not os.path.isdir(options['output']):
+        os.makedirs(options['output'])
+
+    task = functools.partial(_run, command=command, options=options)
+    status = 0
+    results = imap(task, _expand(args.paths,
+                                 args.patterns or FILE_PATTERNS),
+                   workers=max(args.jobs, 1),
+                   executor='process' if args.jobs > 1 else 'thread',
+                   ordered=not args.unordered)
+    try:
+        writer = _WRITERS[args.format](stdout or sys.stdout,
+                                       _FIELDS[command])
+        for rows in results:
+            for row in rows:
+                if row.get('error'):
+                    status = 1
+                writer.write(row)
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        if stdout is None:
+            # keep the interpreter from failing to flush stdout at exit
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+    finally:
+        results.close()
+    return status
@@ -36,3 +36,21 @@ class InvalidParameter(Error):
 
     def __str__(self):
         return '"{}" is not a valid Ciao parameter'.format(self.parameter)
+
+
+class MissingParameter(InvalidParameter):
+    """Error for a required Ciao parameter missing from the header."""
+
+    def __str__(self):
+        return 'Required parameter "{}" is missing'.format(self.parameter)
+
+
+class InvalidBundle(Error):
+    """Error for a file that is not a valid bundle."""
+
+    def __init__(self, path, reason):
+        self.path = path
+        self.reason = reason
+
+    def __str__(self):
+        return '{} is not a valid bundle: {}'.format(self.path, self.reason)
@@ -3,6 +3,11 @@ from __future__ import absolute_import, division, unicode_literals
 
 import numpy as np
 
+from . import metrics
+from .cache import fingerprint
+from .shared import reference, resolve
+from .statistics import Histogram, Moments, OrderStatistics
+
 
 class NanoscopeImage(object):
     """
@@ -18,12 +23,22 @@ class NanoscopeImage(object):
                   p * (6800 / 9) - (4505 / 9)), 0, 255)),
         },
     }
+    _lut_cache = {}
+    _lut_cache_size = 64
+    _flatten_cache = {}
+    _flatten_cache_size = 64
+    tile_lines = 256
+    result_cache = None
+    _summary_entries = ('mean_height', 'mean_roughness', 'rms_roughness',
+                        'mean_peak', 'mean_valley', 'min_height',
+                        'max_height', 'Pc', 'HSC', 'LSC', 'Rz')
 
     def __init__(self, image_type, raw_data, bytes_per_pixel, magnify,
                  scale, offset, scan_area, description):
         self.unit = scale.unit.to_string()
         self.bytes_per_pixel = bytes_per_pixel
         self.magnify = magnify
+        self._fingerprint = None
         self.raw_data = raw_data
         self.flat_data = None
         self.converted_data = None
@@ -35,6 +50,51 @@ class NanoscopeImage(object):
         self.description = description
 
         self._cache = {}
+        self._conversion = None
+        self._provenance = []
+
+    def __getstate__(self):
+        # arrays in shared memory or memory-mapped from a file are pickled as
+        # descriptors instead of being copied, see nanoscope.shared
+        state = self.__dict__.copy()
+        memo = {}
+        for name in ('_raw_data', 'flat_data', 'converted_data'):
+            state[name] = reference(state[name], memo)
+        state['_provenance'] = [(reference(array, memo), params)
+                                for array, params in self._provenance]
+        if self._conversion is not None:
+            flat_data, value, converted_data = self._conversion
+            state['_conversion'] = (reference(flat_data, memo), value,
+                                    reference(converted_data, memo))
+        return state
+
+    def __setstate__(self, state):
+        memo = {}
+        for name in ('_raw_data', 'flat_data', 'converted_data'):
+            state[name] = resolve(state[name], memo)
+        state['_provenance'] = [(resolve(array, memo), params)
+                                for array, params in state['_provenance']]
+        if state['_conversion'] is not None:
+            flat_data, value, converted_data = state['_conversion']
+            state['_conversion'] = (resolve(flat_data, memo), value,
+                                    resolve(converted_data, memo))
+        self.__dict__.update(state)
+
+    @property
+    def raw_data(self):
+        """
+        The raw data as read from the file.
+        """
+        return self._raw_data
+
+    @raw_data.setter
+    def raw_data(self, raw_data):
+        # results cached for the old data must not be found for new data.
+        # Releasing the raw data keeps the fingerprint, as the processed data
+        # still derives from it
+        if raw_data is not None:
+            self._fingerprint = None
+        self._raw_data = raw_data
 
     @property
     def data(self):
@@ -47,79 +107,342 @@ class NanoscopeImage(object):
             return self.flat_data
         return self.converted_data
 
-    def process(self, order=1):
+    @metrics.timed('process')
+    def process(self, order=1, dtype=np.float64, out=None,
+                keep=('raw', 'flat'), inplace=False):
         """
         Flattens and converts the raw data. Convenience function that reduces
         the manual steps needed.
 
+        By default the raw, flattened and converted data are all kept. Leaving
+        ``'flat'`` out of ``keep`` converts the flattened data in place, and
+        leaving ``'raw'`` out releases the raw data once it has been
+        flattened, so that ``process(dtype=np.float32, keep=())`` leaves a
+        single float32 array. Raw data that is already floating point and
+        writable can instead be processed in place with ``inplace=True``,
+        which leaves that one array without allocating another.
+
         :param order: The order of the polynomial to use when flattening.
                       Defaults to 1 (linear), which should give good results
                       for most images.
+        :param dtype: The floating point type of the processed data. Defaults
+                      to float64.
+        :param out: Optional array with the shape of the image that the
+                    flattened data is written into.
+        :param keep: The intermediates to retain, any of ``'raw'`` and
+                     ``'flat'``. Ignored when processing in place.
+        :param inplace: Whether to flatten and convert the raw data in place,
+                        see :meth:`flatten`. No intermediates are kept.
         :returns: The image with flattened and converted data for chaining
                   commands.
+        :raises ValueError: If ``keep`` names an unknown intermediate, or
+                            the raw data cannot be processed in place.
+        """
+        unknown = set(keep) - set(['raw', 'flat'])
+        if unknown:
+            raise ValueError('Cannot keep {}, only raw and flat data '
+                             'can be kept'.format(', '.join(sorted(unknown))))
+        if inplace:
+            return self.flatten(order, inplace=True).convert(inplace=True)
+        self.flatten(order, dtype=dtype, out=out)
+        if 'raw' not in keep:
+            self.raw_data = None
+        return self.convert(inplace='flat' not in keep)
+
+    @metrics.timed('process_tiled')
+    def process_tiled(self, order=1, tile_lines=None, out=None, flat_out=None,
+                      dtype=np.float64):
         """
-        return self.flatten(order).convert()
+        Flattens and converts the raw data in blocks of scanlines, for images
+        too large to process in one go. Each block is read from the raw data
+        (which may be memory-mapped), flattened, converted and written to the
+        output, so memory use is bounded by the tile size rather than the
+        image size.
+
+        The statistics are accumulated along the way from a histogram of the
+        flattened values, so they are available afterwards without another
+        pass over the data. If the values span too wide a range for the
+        histogram, as for some 4 byte data, the statistics are instead
+        calculated in a few more passes over the tiles of ``out``, which
+        keeps memory bounded by the tile size either way.
 
-    def flatten(self, order=1):
+        :param order: The order of the polynomial to use when flattening.
+                      Defaults to 1 (linear).
+        :param tile_lines: The number of scanlines processed at a time.
+                           Defaults to :attr:`tile_lines`.
+        :param out: Optional array, e.g. an ``np.memmap``, with the shape of
+                    the image that the converted data is written into.
+                    Defaults to a new array of ``dtype``.
+        :param flat_out: Optional array with the shape of the image that the
+                         flattened data is written into. If not given, the
+                         flattened data is not kept.
+        :param dtype: The floating point type of ``out`` when it is not given.
+        :returns: The image with converted data for chaining commands.
+        :raises ValueError: If ``out`` or ``flat_out`` has the wrong shape.
+        """
+        shape = self.raw_data.shape
+        out = self._output_buffer(out, shape, dtype)
+        if flat_out is not None:
+            self._output_buffer(flat_out, shape, dtype)
+
+        value = self.conversion_factor
+        histogram = Histogram(integral=True)
+        for start, flat in self._flatten_tiles(order, tile_lines):
+            stop = start + len(flat)
+            if flat_out is not None:
+                flat_out[start:stop] = flat
+            flat = flat.astype(out.dtype, copy=False)
+            histogram.add(flat)
+            np.multiply(flat, value, out=out[start:stop])
+            del flat
+
+        self.flat_data = flat_out
+        self.converted_data = out
+        self._conversion = (flat_out, value, out)
+        self._provenance = [(out, ('flatten', order, out.dtype.str, 'convert',
+                                   value, out.dtype.str))]
+        if flat_out is not None:
+            self._provenance.append(
+                (flat_out, ('flatten', order, flat_out.dtype.str)))
+        if histogram.overflowed:
+            tile_lines = max(tile_lines or self.tile_lines, 1)
+            self._cache = self._summarize_tiles(
+                lambda: (out[start:start + tile_lines]
+                         for start in range(0, shape[0], tile_lines)))
+            return self
+        statistics = histogram.order_statistics(value)
+        self._cache = self._summarize_histogram(statistics)
+        self._cache['order_statistics'] = statistics
+        return self
+
+    @metrics.timed('flatten')
+    def flatten(self, order=1, dtype=np.float64, out=None, inplace=False):
         """
         Flattens the raw data, by fitting each scanline to a polynomial with
         the order specified and subtracting that fit from the raw data.
 
         Typically happens prior to converting from raw data.
 
+        The fit is calculated in float64 a block of scanlines at a time, so
+        the flattened values are the same whole numbers for any ``dtype``
+        that can hold them, and no full-size float64 intermediates are made.
+
         :param order: The order of the polynomial to use when flattening.
                       Defaults to 1 (linear).
+        :param dtype: The floating point type of the flattened data when
+                      ``out`` is not given. Defaults to float64.
+        :param out: Optional array with the shape of the image that the
+                    flattened data is written into.
+        :param inplace: Whether to flatten the raw data in place rather than
+                        into a new array, which needs writable floating point
+                        raw data. The raw data is not kept.
         :returns: The image with flattened data for chaining commands.
+        :raises ValueError: If flattening in place without writable floating
+                            point raw data, or ``out`` has the wrong shape.
         """
-        self.flat_data = np.round([self._flatten_scanline(line, order)
-                                   for line in self.raw_data])
+        def calculate(out):
+            flat_data = self._output_buffer(out, self.raw_data.shape, dtype)
+            for start, flat in self._flatten_tiles(order):
+                flat_data[start:start + len(flat)] = flat
+            return flat_data
+
+        if inplace:
+            raw_data = self.raw_data
+            if raw_data.dtype.kind != 'f' or not raw_data.flags.writeable:
+                raise ValueError('Raw data of type {} cannot be flattened '
+                                 'in place'.format(raw_data.dtype))
+            out = raw_data
+        elif out is not None:
+            self._output_buffer(out, self.raw_data.shape, dtype)
+        params = ('flatten', order, np.dtype(dtype if out is None
+                                             else out.dtype).str)
+        self.flat_data = self._cached_array(self._result_key(params), out,
+                                            calculate)
+        if inplace:
+            self.raw_data = None
+        self._provenance = [(self.flat_data, params)]
         self._cache.clear()
         return self
 
-    def convert(self):
+    @metrics.timed('convert')
+    def convert(self, dtype=None, out=None, inplace=False):
         """
         Converts the raw data into data with the proper units for that image
         type (i.e. nm for Height, V for Amplitude).
 
         Typically happens after flattening the data.
 
+        :param dtype: The floating point type of the converted data when
+                      ``out`` is not given. Defaults to float64 for raw data
+                      and to the type of the flattened data otherwise.
+        :param out: Optional array with the shape of the image that the
+                    converted data is written into.
+        :param inplace: Whether to convert the flattened data in place rather
+                        than into a new array. The flattened data is not kept.
         :returns: The image with converted data for chaining commands.
+        :raises ValueError: If converting in place without floating point
+                            flattened data, or ``out`` has the wrong shape.
         """
         if self.flat_data is None:
+            if inplace:
+                raise ValueError('Only flattened data can be converted '
+                                 'in place')
             self.flat_data = self.raw_data
-        value = self.scale / pow(2, 8 * self.bytes_per_pixel)
-        self.converted_data = self.flat_data * value
+        flat_data = self.flat_data
+        value = self.conversion_factor
+        if inplace:
+            if (flat_data.dtype.kind != 'f' or
+                    (dtype is not None and
+                     np.dtype(dtype) != flat_data.dtype)):
+                raise ValueError('Flattened data of type {} cannot be '
+                                 'converted in place'.format(flat_data.dtype))
+            out = flat_data
+        elif out is not None:
+            self._output_buffer(out, flat_data.shape, dtype)
+        if out is not None:
+            dtype = out.dtype
+        elif dtype is None:
+            dtype = np.float64
+            if flat_data.dtype.kind == 'f':
+                dtype = flat_data.dtype
+
+        def calculate(out):
+            out = self._output_buffer(out, flat_data.shape, dtype)
+            return np.multiply(flat_data, value, out=out)
+
+        params = self._params(flat_data)
+        if params is not None:
+            params += ('convert', value, np.dtype(dtype).str)
+        self.converted_data = self._cached_array(self._result_key(params), out,
+                                                 calculate)
+        if inplace:
+            self.flat_data = None
+            self._conversion = None
+        else:
+            self._conversion = (flat_data, value, self.converted_data)
+        self._provenance = [p for p in self._provenance
+                            if p[0] is self.flat_data]
+        self._provenance.append((self.converted_data, params))
         self._cache.clear()
         return self
 
-    def colorize(self, colortable=12):
+    def _processed(self, order, flat_data, converted_data, entries):
+        """
+        Records the data and the statistics entries of
+        ``flatten(order, out=flat_data).convert(out=converted_data)`` followed
+        by :meth:`summary` run elsewhere, e.g. by a worker process.
+        """
+        value = self.conversion_factor
+        params = ('flatten', order, flat_data.dtype.str)
+        self.flat_data = flat_data
+        self.converted_data = converted_data
+        self._conversion = (flat_data, value, converted_data)
+        self._provenance = [
+            (flat_data, params),
+            (converted_data,
+             params + ('convert', value, converted_data.dtype.str))]
+        self._cache = dict(entries)
+        return self
+
+    @property
+    def conversion_factor(self):
+        """
+        Returns the factor that converts raw data into the units of the image.
+        """
+        return self.scale / pow(2, 8 * self.bytes_per_pixel)
+
+    @metrics.timed('colorize')
+    def colorize(self, colortable=12, out=None):
         """
         Colorizes the data according to the specified height scale. Currently
         uses colorscale #12 from Nanoscope as hardcoded behavior.
 
+        Each color channel is mapped through a lookup table of the data values
+        at which the channel steps to its next level, so the whole image is
+        colorized in a single vectorized pass.
+
         :param colortable: The Nanoscope colortable to use.
                            Only 12 is supported, and is the default.
+        :param out: Optional ``uint8`` array with shape ``(lines, samples, 3)``
+                    that the pixels are written into.
         :returns: The pixels of the image ready for use with
                   ``Pillow.Image.fromarray``.
-        :raises ValueError: If the colortable is not supported.
+        :raises ValueError: If the colortable is not supported or ``out`` has
+                            the wrong shape or dtype.
         """
         if colortable not in self.supported_colortables:
             raise ValueError('Colortable {} is not '
                              'currently supported'.format(colortable))
 
-        colors = self.supported_colortables[colortable]
-        get_color = (lambda v:
-            np.array([colors[c]((v + (self.height_scale / 2)) /
-                                self.height_scale) for c in 'rgb']))
         if self.converted_data is None:
             self.converted_data = self.data
+        data = self.converted_data[::-1]
 
-        data = []
-        for row in reversed(self.converted_data):
-            data.append([])
-            for col in row:
-                data[-1].append(get_color(col))
-        return np.array(data, dtype=np.uint8)
+        shape = data.shape + (3,)
+        if out is not None and (out.shape != shape or out.dtype != np.uint8):
+            raise ValueError('Output buffer must be uint8 '
+                             'with shape {}'.format(shape))
+
+        def calculate(out):
+            if out is None:
+                out = np.empty(shape, dtype=np.uint8)
+            lut = self._colortable_lut(colortable, self.height_scale)
+            for i, thresholds in enumerate(lut):
+                out[..., i] = np.searchsorted(thresholds, data, side='right')
+            return out
+
+        key = self._result_key(self._params(self.converted_data), 'colorize',
+                               colortable, self.height_scale)
+        return self._cached_array(key, out, calculate)
+
+    @classmethod
+    def _colortable_lut(cls, colortable, height_scale):
+        """
+        Returns the lookup table for the colortable at the given height scale,
+        building and caching it on first use.
+
+        The table holds, for each of the r, g and b channels, the 255 smallest
+        data values at which the channel reaches levels 1 through 255. Since
+        every curve is monotonic, the level of any value is the number of
+        thresholds that are less than or equal to it.
+        """
+        key = (colortable, height_scale)
+        lut = cls._lut_cache.get(key)
+        if lut is None:
+            if len(cls._lut_cache) >= cls._lut_cache_size:
+                cls._lut_cache.clear()
+            colors = cls.supported_colortables[colortable]
+            lut = np.array([cls._color_thresholds(colors[c], height_scale)
+                            for c in 'rgb'])
+            cls._lut_cache[key] = lut
+        return lut
+
+    @staticmethod
+    def _color_thresholds(curve, height_scale):
+        """
+        Finds the exact data values where the curve steps up each level.
+
+        Samples the curve on a dense grid to bracket each threshold, then
+        bisects between adjacent floats so that the table reproduces the
+        curve bit for bit, including its rounding behavior.
+        """
+        level = (lambda v: curve((v + (height_scale / 2)) / height_scale))
+        grid = np.linspace(-height_scale, height_scale, 4097)
+        k = np.arange(1, 256)
+        i = np.searchsorted(level(grid), k)
+        lo = grid[np.clip(i - 1, 0, len(grid) - 1)]
+        hi = grid[np.clip(i, 0, len(grid) - 1)]
+        # invariant: level(lo) < k <= level(hi) for every unsaturated level
+        while True:
+            mid = lo / 2 + hi / 2
+            active = (mid > lo) & (mid < hi)
+            if not active.any():
+                break
+            above = level(mid) >= k
+            hi = np.where(active & above, mid, hi)
+            lo = np.where(active & ~above, mid, lo)
+        thresholds = hi
+        return thresholds
 
     def reset_height_scale(self):
         """
@@ -253,6 +576,259 @@ class NanoscopeImage(object):
             self._cache['max_height'] = np.max(self.data)
         return self._cache['max_height']
 
+    @metrics.timed('summary')
+    def summary(self):
+        """
+        Calculates all of the roughness statistics together, using as few
+        passes over the data as possible and without building masked copies
+        of it. Every statistic is cached, so later access to the individual
+        properties is free.
+
+        :returns: A dict with the mean, minimum and maximum heights and the
+                  ``Ra``, ``Rq``, ``Rp``, ``Rv``, ``Rt``, ``Rpm``, ``Rvm``,
+                  ``Rz``, ``Pc``, ``Pd``, ``HSC`` and ``LSC`` statistics.
+        """
+        keys = self._summary_entries[:-1]
+        key = None
+        if not all(k in self._cache for k in self._summary_entries):
+            key = self._result_key(self._params(self.data), 'summary')
+            cached = key and self.result_cache.load_json(key)
+            if cached:
+                self._cache.update(cached)
+                key = None
+            elif not all(k in self._cache for k in keys):
+                self._cache.update(self._summarize(self.data))
+        if 'Rz' not in self._cache:
+            self._cache['Rz'] = self.n_point_roughness(n=5)
+        if key is not None:
+            self.result_cache.save_json(key, self._json_entries(self._cache))
+        return self._report(self._cache)
+
+    @metrics.timed('summarize')
+    def summarize(self, order=1, tile_lines=None):
+        """
+        Returns the same statistics as ``process(order).summary()``, in the
+        units of the converted data, without keeping the flattened data or
+        allocating the converted data.
+
+        The raw data (which may be memory-mapped) is flattened a block of
+        scanlines at a time into a histogram of whole numbers. All of the
+        statistics are calculated from the histogram and then scaled by the
+        :attr:`conversion_factor`, as each of them is linear in it. If the
+        values span too wide a range for the histogram, as for some 4 byte
+        data, the statistics are instead accumulated over three passes of
+        flattened blocks, so memory stays bounded by the block size.
+
+        :param order: The order of the polynomial to use when flattening, or
+                      ``None`` for the statistics of the raw data itself.
+                      Defaults to 1 (linear).
+        :param tile_lines: The number of scanlines flattened at a time.
+                           Defaults to :attr:`tile_lines`.
+        :returns: A dict with the same keys as :meth:`summary`.
+        """
+        if ('summarize', order) in self._cache:
+            return self._cache[('summarize', order)]
+        value = self.conversion_factor
+        key = self._result_key(('raw',), 'summarize', order, value)
+        entries = key and self.result_cache.load_json(key)
+        if not entries:
+            def tiles():
+                if order is None:
+                    lines = max(tile_lines or self.tile_lines, 1)
+                    for start in range(0, self.raw_data.shape[0], lines):
+                        yield self.raw_data[start:start + lines]
+                else:
+                    for _, flat in self._flatten_tiles(order, tile_lines):
+                        yield flat
+
+            histogram = Histogram(integral=True)
+            for tile in tiles():
+                if not histogram.add(tile):
+                    break
+            if histogram.overflowed:
+                entries = self._summarize_tiles(
+                    lambda: (tile * value for tile in tiles()))
+            else:
+                statistics = histogram.order_statistics(value)
+                entries = self._summarize_histogram(statistics)
+                entries['Rz'] = self._n_point_roughness(
+                    statistics, entries['mean_height'])
+            if key is not None:
+                self.result_cache.save_json(key, self._json_entries(entries))
+        summary = self._cache[('summarize', order)] = self._report(entries)
+        return summary
+
+    def _report(self, entries):
+        """
+        Returns the summary dict of the cached statistic entries.
+        """
+        mean = entries['mean_height']
+        rp = entries['max_height'] - mean
+        rv = abs(entries['min_height'] - mean)
+        return {
+            'mean_height': mean,
+            'min_height': entries['min_height'],
+            'max_height': entries['max_height'],
+            'Ra': entries['mean_roughness'],
+            'Rq': entries['rms_roughness'],
+            'Rp': rp,
+            'Rv': rv,
+            'Rt': rv + rp,
+            'Rpm': entries['mean_peak'],
+            'Rvm': entries['mean_valley'],
+            'Rz': entries['Rz'],
+            'Pc': entries['Pc'],
+            'Pd': entries['Pc'] / self.scan_area,
+            'HSC': entries['HSC'],
+            'LSC': entries['LSC'],
+        }
+
+    @classmethod
+    def _json_entries(cls, entries):
+        return dict((k, entries[k].item() if hasattr(entries[k], 'item')
+                     else entries[k]) for k in cls._summary_entries)
+
+    def _summarize(self, data):
+        """
+        Returns the cache entries for the statistics of ``data`` other than
+        the order statistics.
+
+        Deviations from the mean are computed once and reused. Sums over the
+        peaks and valleys follow from the sums of the deviations and of their
+        absolute values, so they only need the counts of each.
+        """
+        mean = np.mean(data)
+        deviation = data - mean
+        scratch = np.abs(deviation)
+        sum_abs = np.sum(scratch)
+        sum_deviation = np.sum(deviation)
+        np.square(deviation, out=scratch)
+        sum_square = np.sum(scratch)
+        peaks = np.count_nonzero(deviation > 0)
+        valleys = np.count_nonzero(deviation < 0)
+        del deviation
+
+        ra = sum_abs / data.size
+        np.abs(data, out=scratch)
+        peak_count = np.count_nonzero(scratch >= abs(ra))
+        del scratch
+
+        mean_peak, mean_valley = self._mean_peak_valley(
+            sum_abs, sum_deviation, peaks, valleys)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'mean_height': mean,
+                'mean_roughness': ra,
+                'rms_roughness': np.sqrt(sum_square / data.size),
+                'mean_peak': mean_peak,
+                'mean_valley': mean_valley,
+                'min_height': np.min(data),
+                'max_height': np.max(data),
+                'Pc': peak_count,
+                'HSC': np.count_nonzero(data >= ra),
+                'LSC': np.count_nonzero(data <= ra),
+            }
+
+    @staticmethod
+    def _summarize_histogram(statistics):
+        """
+        Returns the same cache entries as :meth:`_summarize`, calculated from
+        the distinct values of the data and their counts instead of the data
+        itself.
+        """
+        values, counts = statistics.values, statistics.counts
+        size = statistics.size
+        mean = np.dot(counts, values) / size
+        deviation = values - mean
+        sum_abs = np.dot(counts, np.abs(deviation))
+        sum_deviation = np.dot(counts, deviation)
+        sum_square = np.dot(counts, np.square(deviation))
+        peaks = np.sum(counts[deviation > 0])
+        valleys = np.sum(counts[deviation < 0])
+
+        ra = sum_abs / size
+        mean_peak, mean_valley = NanoscopeImage._mean_peak_valley(
+            sum_abs, sum_deviation, peaks, valleys)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'mean_height': mean,
+                'mean_roughness': ra,
+                'rms_roughness': np.sqrt(sum_square / size),
+                'mean_peak': mean_peak,
+                'mean_valley': mean_valley,
+                'min_height': values[0],
+                'max_height': values[-1],
+                'Pc': np.sum(counts[np.abs(values) >= abs(ra)]),
+                'HSC': np.sum(counts[values >= ra]),
+                'LSC': np.sum(counts[values <= ra]),
+            }
+
+    @classmethod
+    def _summarize_tiles(cls, tiles, n=5):
+        """
+        Returns the same cache entries as :meth:`_summarize`, and ``Rz``,
+        calculated a block of the data at a time in three passes: one for the
+        mean, extremes and n-point values, one for the deviations from the
+        mean and one for the counts relative to ``Ra``. Memory use is bounded
+        by the size of a block, whatever the range of the data.
+
+        :param tiles: Callable that returns a new iterable of the blocks of
+                      the data each time it is called.
+        :param n: The number of points of ``Rz``. Defaults to 5.
+        """
+        moments = Moments(n)
+        for tile in tiles():
+            moments.add(tile)
+        size, mean = moments.size, moments.mean
+
+        sum_abs = sum_deviation = sum_square = 0.0
+        peaks = valleys = 0
+        for tile in tiles():
+            deviation = np.subtract(tile, mean, dtype=np.float64)
+            sum_deviation += np.sum(deviation)
+            peaks += np.count_nonzero(deviation > 0)
+            valleys += np.count_nonzero(deviation < 0)
+            np.abs(deviation, out=deviation)
+            sum_abs += np.sum(deviation)
+            np.square(deviation, out=deviation)
+            sum_square += np.sum(deviation)
+            del deviation
+
+        ra = sum_abs / size
+        peak_count = high_spots = low_spots = 0
+        for tile in tiles():
+            peak_count += np.count_nonzero(np.abs(tile) >= abs(ra))
+            high_spots += np.count_nonzero(tile >= ra)
+            low_spots += np.count_nonzero(tile <= ra)
+
+        mean_peak, mean_valley = cls._mean_peak_valley(
+            sum_abs, sum_deviation, peaks, valleys)
+        return {
+            'mean_height': mean,
+            'mean_roughness': ra,
+            'rms_roughness': np.sqrt(sum_square / size),
+            'mean_peak': mean_peak,
+            'mean_valley': mean_valley,
+            'min_height': moments.minimum,
+            'max_height': moments.maximum,
+            'Pc': peak_count,
+            'HSC': high_spots,
+            'LSC': low_spots,
+            'Rz': cls._n_point_roughness(moments, mean, n),
+        }
+
+    @staticmethod
+    def _mean_peak_valley(sum_abs, sum_deviation, peaks, valleys):
+        """
+        Returns the mean height of the peaks and the mean depth of the
+        valleys, from the sums of the absolute and signed deviations from the
+        mean and the number of points above and below it. Either is NaN if
+        there are no such points.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (((sum_abs + sum_deviation) / 2) / np.float64(peaks),
+                    ((sum_abs - sum_deviation) / 2) / np.float64(valleys))
+
     def n_point_roughness(self, n=5):
         """
         Returns the average roughness in nm, defined as the mean of the n
@@ -262,10 +838,77 @@ class NanoscopeImage(object):
         :returns: The average roughness of the n highest peaks and n lowest
                   valleys, in nm.
         """
-        peak_elems = np.sort(self.data[self.data > self.mean_height])[-n:]
-        valley_elems = np.sort(self.data[self.data < self.mean_height])[:n]
+        return self._n_point_roughness(self.order_statistics(),
+                                       self.mean_height, n)
+
+    @staticmethod
+    def _n_point_roughness(statistics, mean, n=5):
+        peak_elems = statistics.largest(n)
+        peak_elems = peak_elems[peak_elems > mean]
+        valley_elems = statistics.smallest(n)
+        valley_elems = valley_elems[valley_elems < mean]
         return np.mean(peak_elems + valley_elems)
 
+    @metrics.timed('order_statistics')
+    def order_statistics(self):
+        """
+        Returns the :class:`~nanoscope.statistics.OrderStatistics` of the
+        data, which answer percentile, bearing ratio and n-point queries from
+        a single histogram.
+
+        Converted data is binned through the whole-number data it was
+        converted from. The histogram is built on first access and cached for
+        later. Running convert or flatten will force a rebuild on the next
+        access.
+        """
+        if 'order_statistics' not in self._cache:
+            data, scale = self.data, 1
+            if (self._conversion is not None and
+                    self._conversion[2] is self.converted_data):
+                data, scale = self._conversion[:2]
+            integral = data is self.flat_data or data is self.raw_data
+            self._cache['order_statistics'] = OrderStatistics(
+                data, scale, integral)
+        return self._cache['order_statistics']
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile of the data, interpolated like
+        ``np.percentile``. ``q`` may be a number or an array of numbers.
+
+        Scalar results are cached for later. Running convert or flatten will
+        force a recalculation on the next access.
+        """
+        if not np.isscalar(q):
+            return self.order_statistics().percentile(q)
+        return self._cached(('percentile', q),
+                            lambda: self.order_statistics().percentile(q)[()])
+
+    def bearing_ratio(self, height):
+        """
+        Returns the bearing (material) ratio at the given height in nm, that
+        is the fraction of the image at or above that height. ``height`` may
+        be a number or an array of numbers.
+
+        Scalar results are cached for later. Running convert or flatten will
+        force a recalculation on the next access.
+        """
+        if not np.isscalar(height):
+            return self.order_statistics().bearing_ratio(height)
+        return self._cached(
+            ('bearing_ratio', height),
+            lambda: self.order_statistics().bearing_ratio(height)[()])
+
+    def bearing_curve(self, points=101):
+        """
+        Returns the Abbott-Firestone bearing area curve.
+
+        :param points: The number of evenly spaced bearing ratios from 0 to 1.
+        :returns: A tuple ``(ratios, heights)`` with the height in nm at which
+                  the image reaches each bearing ratio.
+        """
+        return self.order_statistics().bearing_curve(points)
+
     def peak_count(self, threshold=None):
         """
         Calculates the total number of peaks and valleys in the image. A peak
@@ -298,13 +941,105 @@ class NanoscopeImage(object):
         threshold = threshold or self.mean_roughness
         return self.data[self.data <= threshold].size
 
-    def _flatten_scanline(self, data, order=1):
-        coefficients = np.polyfit(range(len(data)), data, order)
-        correction = np.array(
-            [sum([pow(i, n) * c
-            for n, c in enumerate(reversed(coefficients))])
-            for i in range(len(data))])
-        return data - correction
+    def _params(self, data):
+        """
+        Returns the processing parameters that produced ``data`` from the raw
+        data, or ``None`` if they are not known.
+        """
+        if data is None:
+            return None
+        if data is self.raw_data:
+            return ('raw',)
+        for array, params in self._provenance:
+            if array is data:
+                return params
+        return None
+
+    def _result_key(self, params, *extra):
+        """
+        Returns the key of the result of processing the raw data with the
+        given parameters in :attr:`result_cache`, or ``None`` if there is no
+        cache or the result cannot be cached.
+        """
+        if self.result_cache is None or params is None:
+            return None
+        if self._fingerprint is None:
+            if self.raw_data is None:
+                return None
+            self._fingerprint = fingerprint(self.raw_data)
+        return self.result_cache.key(self._fingerprint, *(params + extra))
+
+    def _cached_array(self, key, out, calculate):
+        """
+        Returns the array for the key from :attr:`result_cache`, copied into
+        ``out`` if given, else ``calculate(out)`` which is then cached.
+        """
+        if key is None:
+            return calculate(out)
+        array = self.result_cache.load_array(key)
+        if array is None:
+            array = calculate(out)
+            self.result_cache.save_array(key, array)
+        elif out is not None:
+            out[...] = array
+            array = out
+        return array
+
+    def _cached(self, key, calculate):
+        if key not in self._cache:
+            self._cache[key] = calculate()
+        return self._cache[key]
+
+    def _flatten_tiles(self, order, tile_lines=None):
+        """
+        Generator of ``(start, flat)`` tuples with the flattened data of each
+        block of scanlines, fitted and rounded in float64.
+        """
+        raw_data = self.raw_data
+        tile_lines = max(tile_lines or self.tile_lines, 1)
+        vandermonde, projection = self._flatten_basis(raw_data.shape[-1],
+                                                      order)
+        for start in range(0, raw_data.shape[0], tile_lines):
+            tile = raw_data[start:start + tile_lines]
+            coefficients = np.dot(tile, projection.T)
+            flat = tile - np.dot(coefficients, vandermonde.T)
+            yield start, np.round(flat, out=flat)
+
+    @staticmethod
+    def _output_buffer(out, shape, dtype):
+        """
+        Returns ``out``, or a new array of ``dtype`` if it is not given.
+
+        :raises ValueError: If ``out`` does not have the given shape.
+        """
+        if out is None:
+            return np.empty(shape, dtype=dtype)
+        if out.shape != shape:
+            raise ValueError('Output buffer must have '
+                             'shape {}'.format(shape))
+        return out
+
+    @classmethod
+    def _flatten_basis(cls, samples_per_line, order):
+        """
+        Returns the Vandermonde matrix and its least squares projection for
+        fitting scanlines of the given length, caching them per geometry up
+        to :attr:`_flatten_cache_size` geometries.
+
+        The abscissa is rescaled to [-1, 1] to keep the fit well conditioned
+        for long scanlines; this spans the same polynomials as
+        ``range(samples_per_line)`` so the fitted values are unchanged.
+        """
+        key = (samples_per_line, order)
+        basis = cls._flatten_cache.get(key)
+        if basis is None:
+            if len(cls._flatten_cache) >= cls._flatten_cache_size:
+                cls._flatten_cache.clear()
+            x = np.linspace(-1, 1, samples_per_line)
+            vandermonde = np.vander(x, order + 1)
+            basis = (vandermonde, np.linalg.pinv(vandermonde))
+            cls._flatten_cache[key] = basis
+        return basis
 
     Ra = mean_roughness
     Rq = rms_roughness
@@ -315,8 +1050,12 @@ class NanoscopeImage(object):
     zrange = total_roughness
     Rpm = mean_peak
     Rvm = mean_valley
-    Rz = property(lambda self: self.n_point_roughness(n=5))
-    Pc = property(lambda self: self.peak_count(self.mean_roughness))
-    Pd = property(lambda self: self.peak_density(self.mean_roughness))
-    HSC = property(lambda self: self.high_spot_count(self.mean_roughness))
-    LSC = property(lambda self: self.low_spot_count(self.mean_roughness))
+    Rz = property(lambda self: self._cached(
+        'Rz', lambda: self.n_point_roughness(n=5)))
+    Pc = property(lambda self: self._cached(
+        'Pc', lambda: self.peak_count(self.mean_roughness)))
+    Pd = property(lambda self: self.Pc / self.scan_area)
+    HSC = property(lambda self: self._cached(
+        'HSC', lambda: self.high_spot_count(self.mean_roughness)))
+    LSC = property(lambda self: self._cached(
+        'LSC', lambda: self.low_spot_count(self.mean_roughness)))
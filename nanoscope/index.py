@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent metadata index for directories of Nanoscope files.
+
+Headers are parsed once and stored in a SQLite database so that collections
+of scans can be searched without reading every file again::
+
+    from nanoscope.index import Index
+
+    with Index('scans.db') as index:
+        index.update('/data/afm')
+        paths = index.query(channel='Height', where={'Scan size': 2000,
+                                                     'Serial number': '1965G'})
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+import fnmatch
+import json
+import numbers
+import os
+import sqlite3
+
+import six
+
+from .error import Error
+from .nanoscope import FILE_PATTERNS, read
+from .parameter import CiaoParameter
+
+
+__all__ = ['Index']
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    version TEXT,
+    date TEXT,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    description TEXT,
+    data_offset INTEGER,
+    data_length INTEGER,
+    bytes_per_pixel INTEGER,
+    samps_per_line INTEGER,
+    number_of_lines INTEGER,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS params (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    channel TEXT,
+    key TEXT NOT NULL,
+    text_value TEXT,
+    num_value REAL
+);
+CREATE INDEX IF NOT EXISTS channels_name ON channels (name, file_id);
+CREATE INDEX IF NOT EXISTS params_num ON params (key, num_value, file_id);
+CREATE INDEX IF NOT EXISTS params_text ON params (key, text_value, file_id);
+CREATE INDEX IF NOT EXISTS files_date ON files (date);
+'''
+
+_OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'like')
+
+
+def _values(value):
+    """
+    Returns the (text, number) pair stored for a header value.
+    """
+    if isinstance(value, CiaoParameter):
+        value = value.hard_value
+    if isinstance(value, bool) or value is None:
+        return None, None
+    if isinstance(value, numbers.Real):
+        return None, float(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(), None
+    number = getattr(value, 'value', None)
+    if isinstance(number, numbers.Real):
+        return six.text_type(value), float(number)
+    return six.text_type(value), None
+
+
+def _json(config):
+    """
+    Serializes a config dict, representing parsed objects by their text.
+    """
+    def default(value):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        return six.text_type(value)
+    return json.dumps(config, default=default, sort_keys=True)
+
+
+class Index(object):
+    """
+    SQLite index of Nanoscope file headers. Stores every header parameter,
+    the ``_Images`` information of each channel (including data offsets), and
+    the size and modification time of each file so that updates only reparse
+    files that have changed.
+
+    :param path: Path of the database file. Defaults to an in-memory database.
+    :param encoding: The encoding used to read the file headers.
+    """
+
+    def __init__(self, path=':memory:', encoding='cp1252'):
+        self.path = path
+        self.encoding = encoding
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        self._connection.close()
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def __contains__(self, path):
+        return self._connection.execute(
+            'SELECT 1 FROM files WHERE path = ?',
+            (os.path.abspath(path),)).fetchone() is not None
+
+    def update(self, root, patterns=FILE_PATTERNS, check_version=True):
+        """
+        Crawls the directory tree and brings the index up to date. New files
+        and files whose size or modification time changed are parsed, and
+        files that no longer exist under ``root`` are removed. Files that are
+        not valid Nanoscope files or cannot be read are skipped.
+
+        :param root: The directory to crawl.
+        :param patterns: Filename patterns of the files to index. Defaults
+                         to numbered files such as ``scan.000`` and ``.spm``
+                         files.
+        :param check_version: Whether to skip files with unsupported versions.
+        :returns: A dict with the number of ``added``, ``updated``,
+                  ``removed``, ``unchanged`` and ``skipped`` files.
+        """
+        root = os.path.abspath(root)
+        counts = dict.fromkeys(['added', 'updated', 'removed', 'unchanged',
+                                'skipped'], 0)
+        clause, args = self._under('path', root)
+        rows = self._connection.execute(
+            'SELECT id, path, size, mtime FROM files WHERE ' + clause, args)
+        known = dict((path, (file_id, size, mtime))
+                     for file_id, path, size, mtime in rows)
+        seen = set()
+
+        with self._connection:
+            for directory, _, filenames in os.walk(root):
+                for filename in filenames:
+                    if not any(fnmatch.fnmatch(filename, p) for p in patterns):
+                        continue
+                    path = os.path.join(directory, filename)
+                    try:
+                        stat = os.stat(path)
+                    except EnvironmentError:
+                        # deleted during the crawl, or a broken link
+                        counts['skipped'] += 1
+                        continue
+                    seen.add(path)
+                    entry = known.get(path)
+                    if entry is not None and entry[1:] == (stat.st_size,
+                                                           stat.st_mtime):
+                        counts['unchanged'] += 1
+                        continue
+                    if entry is not None:
+                        self._remove(entry[0])
+                    if self._add(path, stat, check_version):
+                        counts['updated' if entry else 'added'] += 1
+                    else:
+                        counts['skipped'] += 1
+
+            for path in set(known) - seen:
+                self._remove(known[path][0])
+                counts['removed'] += 1
+        return counts
+
+    def query(self, channel=None, since=None, until=None, where=None,
+              channel_where=None, root=None):
+        """
+        Returns the sorted paths of the indexed files that match all of the
+        given conditions.
+
+        Conditions in ``where`` and ``channel_where`` map a header key to a
+        value, or to an ``(operator, value)`` tuple where the operator is one
+        of ``=``, ``!=``, ``<``, ``<=``, ``>``, ``>=`` or ``like``. Numbers
+        are compared with the numeric part of the header value (so
+        ``{'Scan size': 2000}`` matches ``2000 nm``) and anything else with
+        its text.
+
+        :param channel: Only files that contain this image type.
+        :param since: Only files with a ``Date`` at or after this datetime.
+        :param until: Only files with a ``Date`` before this datetime.
+        :param where: Conditions on the file-level header parameters.
+        :param channel_where: Conditions on the parameters of ``channel``, or
+                              of any channel if ``channel`` is not given.
+        :param root: Only files under this directory.
+        :returns: A list of paths.
+        :raises ValueError: If a condition uses an unknown operator.
+        """
+        clauses = []
+        args = []
+        if root is not None:
+            clause, root_args = self._under('f.path', os.path.abspath(root))
+            clauses.append(clause)
+            args.extend(root_args)
+        if since is not None:
+            clauses.append('f.date >= ?')
+            args.append(since.isoformat())
+        if until is not None:
+            clauses.append('f.date < ?')
+            args.append(until.isoformat())
+        if channel is not None:
+            clauses.append('EXISTS (SELECT 1 FROM channels c '
+                           'WHERE c.file_id = f.id AND c.name = ?)')
+            args.append(channel)
+        for key, condition in six.iteritems(where or {}):
+            self._condition(clauses, args, key, condition, None)
+        for key, condition in six.iteritems(channel_where or {}):
+            self._condition(clauses, args, key, condition, channel, True)
+
+        sql = 'SELECT f.path FROM files f'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY f.path'
+        return [row[0] for row in self._connection.execute(sql, args)]
+
+    def open(self, channels=None, header_only=False, mmap=False, **filters):
+        """
+        Generator of ``NanoscopeFile`` handles for the files matching the
+        filters, which are the same as for :meth:`query`. Channels are loaded
+        lazily, so by default only the queried ``channel`` is read up front.
+
+        :param channels: The image types to load up front. Defaults to the
+                         ``channel`` filter if given, else all of them.
+        :param header_only: Whether to read only the file headers.
+        :param mmap: Whether to memory-map the image data.
+        """
+        if channels is None and filters.get('channel') is not None:
+            channels = [filters['channel']]
+        for path in self.query(**filters):
+            yield read(path, encoding=self.encoding, header_only=header_only,
+                       mmap=mmap, channels=channels)
+
+    def channels(self, path):
+        """
+        Returns the indexed ``_Images`` information for the file as a list of
+        dicts with the name, description, data offset and length, bytes per
+        pixel, and geometry of each channel.
+        """
+        rows = self._connection.execute(
+            'SELECT c.name, c.description, c.data_offset, c.data_length, '
+            'c.bytes_per_pixel, c.samps_per_line, c.number_of_lines '
+            'FROM channels c JOIN files f ON c.file_id = f.id '
+            'WHERE f.path = ? ORDER BY c.rowid', (os.path.abspath(path),))
+        keys = ('name', 'description', 'data_offset', 'data_length',
+                'bytes_per_pixel', 'samps_per_line', 'number_of_lines')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _condition(self, clauses, args, key, condition, channel,
+                   per_channel=False):
+        if isinstance(condition, tuple):
+            operator, value = condition
+        else:
+            operator, value = '=', condition
+        if operator not in _OPERATORS:
+            raise ValueError('Unknown operator {}'.format(operator))
+
+        column = 'p.text_value'
+        if isinstance(value, numbers.Real) and not isinstance(value, bool):
+            column = 'p.num_value'
+            value = float(value)
+        elif isinstance(value, datetime.datetime):
+            value = value.isoformat()
+
+        sql = ('EXISTS (SELECT 1 FROM params p WHERE p.file_id = f.id '
+               'AND p.key = ? AND {0} {1} ?'.format(column, operator.upper()))
+        args.extend([key, value])
+        if not per_channel:
+            sql += ' AND p.channel IS NULL'
+        elif channel is not None:
+            sql += ' AND p.channel = ?'
+            args.append(channel)
+        else:
+            sql += ' AND p.channel IS NOT NULL'
+        clauses.append(sql + ')')
+
+    def _add(self, path, stat, check_version):
+        try:
+            nanoscope_file = read(path, encoding=self.encoding,
+                                  header_only=True, check_version=check_version)
+        except (Error, EnvironmentError, ValueError, KeyError):
+            return False
+
+        config = dict(nanoscope_file.config)
+        images = config.pop('_Images')
+        version, _ = _values(config.get('Version'))
+        date, _ = _values(config.get('Date'))
+        cursor = self._connection.execute(
+            'INSERT INTO files (path, size, mtime, version, date, config) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime, version, date, _json(config)))
+        file_id = cursor.lastrowid
+
+        params = [(file_id, None, k) + _values(v)
+                  for k, v in six.iteritems(config)]
+        for name, image in six.iteritems(images):
+            self._connection.execute(
+                'INSERT INTO channels (file_id, name, description, '
+                'data_offset, data_length, bytes_per_pixel, samps_per_line, '
+                'number_of_lines, config) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (file_id, name, image.get('Description'),
+                 image.get('Data offset'), image.get('Data length'),
+                 image.get('Bytes/pixel'), image.get('Samps/line'),
+                 image.get('Number of lines'), _json(image)))
+            params.extend((file_id, name, k) + _values(v)
+                          for k, v in six.iteritems(image))
+        self._connection.executemany(
+            'INSERT INTO params (file_id, channel, key, text_value, num_value) '
+            'VALUES (?, ?, ?, ?, ?)', params)
+        return True
+
+    def _remove(self, file_id):
+        self._connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    @staticmethod
+    def _under(column, directory):
+        """
+        Returns the SQL clause and its arguments matching the paths in
+        ``column`` that are under the directory. The prefix is compared
+        exactly, as ``LIKE`` ignores the case of ASCII letters.
+        """
+        prefix = os.path.join(directory, '')
+        return 'substr({0}, 1, ?) = ?'.format(column), [len(prefix), prefix]
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Stage level timers and counters for finding where reading and processing
+time goes.
+
+Recording is off by default and then costs a single flag check per stage.
+Once enabled, every call of an instrumented stage (reading the header,
+parsing quantities, reading image data, flattening, converting, colorizing,
+statistics, ...) is timed, and counters such as the bytes read, header lines
+parsed and cache hits are kept::
+
+    from nanoscope import metrics
+
+    metrics.enable()
+    p = nanoscope.read('./file.000')
+    p.height.process().summary()
+
+    metrics.snapshot()       # {'stages': {...}, 'counters': {...}}
+    metrics.to_prometheus()  # text exposition format
+
+Hooks registered with :func:`add_hook` are called with the stage name and
+its duration in seconds after every timed call. The metrics are per
+process, so workers of a process pool record their own.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import functools
+import threading
+import timeit
+
+import six
+
+
+__all__ = ['enable', 'disable', 'enabled', 'reset', 'add_hook',
+           'remove_hook', 'snapshot', 'to_prometheus', 'timed', 'count']
+
+
+_clock = timeit.default_timer
+
+
+class _Registry(object):
+    """
+    The recorded stage timings, counters and hooks of the process.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            calls, total, longest = self.stages.get(stage, (0, 0.0, 0.0))
+            self.stages[stage] = (calls + 1, total + seconds,
+                                  max(longest, seconds))
+        for hook in list(self.hooks):
+            hook(stage, seconds)
+
+    def count(self, counter, value):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+
+_registry = _Registry()
+
+
+def enable():
+    """
+    Starts recording stage timings and counters.
+    """
+    _registry.enabled = True
+
+
+def disable():
+    """
+    Stops recording. The metrics recorded so far are kept.
+    """
+    _registry.enabled = False
+
+
+def enabled():
+    """
+    Returns whether metrics are being recorded.
+    """
+    return _registry.enabled
+
+
+def reset():
+    """
+    Discards the recorded metrics.
+    """
+    _registry.reset()
+
+
+def add_hook(hook):
+    """
+    Registers a callable that is called as ``hook(stage, seconds)`` after
+    every timed stage while recording is enabled.
+    """
+    _registry.hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregisters a hook added with :func:`add_hook`.
+
+    :raises ValueError: If the hook is not registered.
+    """
+    _registry.hooks.remove(hook)
+
+
+def snapshot():
+    """
+    Returns a copy of the recorded metrics as a dict with the number of
+    ``calls``, total ``seconds`` and ``max_seconds`` of each stage under
+    ``'stages'``, and the value of each counter under ``'counters'``.
+    """
+    with _registry._lock:
+        stages = dict((stage, {'calls': calls, 'seconds': total,
+                               'max_seconds': longest})
+                      for stage, (calls, total, longest)
+                      in six.iteritems(_registry.stages))
+        return {'stages': stages, 'counters': dict(_registry.counters)}
+
+
+def to_prometheus(prefix='nanoscope'):
+    """
+    Returns the recorded metrics in the Prometheus text exposition format.
+
+    :param prefix: The prefix of the metric names. Defaults to nanoscope.
+    """
+    metrics = snapshot()
+    lines = []
+
+    def family(name, help_text, samples):
+        lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+        lines.append('# TYPE {}_{} counter'.format(prefix, name))
+        for labels, value in samples:
+            lines.append('{}_{}{} {!r}'.format(prefix, name, labels, value))
+
+    stages = sorted(six.iteritems(metrics['stages']))
+    if stages:
+        family('stage_calls_total', 'Number of calls of each stage.',
+               [('{{stage="{}"}}'.format(s), m['calls']) for s, m in stages])
+        family('stage_seconds_total', 'Time spent in each stage.',
+               [('{{stage="{}"}}'.format(s), m['seconds'])
+                for s, m in stages])
+    for counter, value in sorted(six.iteritems(metrics['counters'])):
+        family(counter + '_total', 'Total {}.'.format(
+            counter.replace('_', ' ')), [('', value)])
+    return ''.join(line + '\n' for line in lines)
+
+
+def timed(stage):
+    """
+    Decorator that records the duration of every call of the function as the
+    given stage while recording is enabled.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _registry.enabled:
+                return function(*args, **kwargs)
+            start = _clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _registry.record(stage, _clock() - start)
+        return wrapper
+    return decorator
+
+
+def count(counter, value=1):
+    """
+    Adds the value to the counter while recording is enabled.
+    """
+    if _registry.enabled:
+        _registry.count(counter, value)
@@ -6,12 +6,21 @@ import io
 import numpy as np
 import six
 
+from . import metrics
 from .image import NanoscopeImage
-from .parameter import parse_parameter
-from .error import UnsupportedVersion, MissingImageData
+from .parameter import parse_header
+from .error import (InvalidParameter, MissingImageData, MissingParameter,
+                    UnsupportedVersion)
 
 
-def read(f, encoding='cp1252', header_only=False, check_version=True):
+# Filename patterns of Nanoscope files: numbered captures such as
+# ``scan.000`` and ``.spm`` exports
+FILE_PATTERNS = ('*.[0-9][0-9][0-9]', '*.spm', '*.SPM')
+
+
+@metrics.timed('read')
+def read(f, encoding='cp1252', header_only=False, check_version=True,
+         mmap=False, channels=None, cache=None):
     """
     Reads the specified file, given as either a filename or an already opened
     file object. Passed file objects must be opened in binary mode. Meant as the
@@ -25,16 +34,29 @@ def read(f, encoding='cp1252', header_only=False, check_version=True):
                         False.
     :param check_version: Whether to enforce version checking for known
                           supported versions. Defaults to True.
+    :param mmap: Whether to memory-map the file instead of reading the image
+                 data into memory. Each image's ``raw_data`` is then a
+                 read-only view into the mapping. File objects without a file
+                 descriptor, such as ``io.BytesIO``, are read into memory
+                 instead. Defaults to False.
+    :param channels: Names of the image types to load up front, or ``None`` to
+                     load all of them. Any other image type is loaded the first
+                     time it is accessed. Defaults to None.
+    :param cache: Optional :class:`nanoscope.cache.ResultCache` that the images
+                  look up and store their processed data and statistics in.
+                  Defaults to None.
     :returns: A NanoscopeFile object containing the image data.
     :raises OSError: If a passed file object is not opened in binary mode.
     """
     try:
         with io.open(f, 'rb') as file_obj:
-            images = NanoscopeFile(file_obj, encoding, header_only, check_version)
+            images = NanoscopeFile(file_obj, encoding, header_only,
+                                   check_version, mmap, channels, cache)
     except TypeError:
-        if 'b' not in f.mode:
+        if 'b' not in getattr(f, 'mode', 'b'):
             raise OSError('File must be opened in binary mode.')
-        images = NanoscopeFile(f, encoding, header_only, check_version)
+        images = NanoscopeFile(f, encoding, header_only, check_version, mmap,
+                               channels, cache)
     return images
 
 
@@ -43,16 +65,30 @@ class NanoscopeFile(object):
     Handles reading and parsing Nanoscope files.
     """
     supported_versions = ['0x05120000', '0x05120130', '0x09300201', ]
+    header_start = '\\*File list'
+    header_end = '\\*File list end'
+    header_chunk_size = 65536
+    max_header_size = 16 << 20
 
-    def __init__(self, file_object, encoding='utf-8', header_only=False, check_version=True):
+    def __init__(self, file_object, encoding='utf-8', header_only=False,
+                 check_version=True, mmap=False, channels=None, cache=None):
         self.images = {}
         self.config = {'_Images': {}}
         self.encoding = encoding
+        self.header_only = header_only
+        self.mmap = mmap
+        self.cache = cache
+
+        self._mmap = None
+        self._header = None
+        self._file_object = file_object
+        self._file_name = getattr(file_object, 'name', None)
 
         self._read_header(file_object, check_version)
         if not header_only:
             for image_type in six.iterkeys(self.config['_Images']):
-                self._read_image_data(file_object, image_type)
+                if channels is None or image_type in channels:
+                    self._read_image_data(file_object, image_type)
 
     @property
     def height(self):
@@ -78,25 +114,84 @@ class NanoscopeFile(object):
     def image(self, image_type):
         """
         Returns the specified image type if it exists, else ``None``.
+
+        Image types that were not loaded when the file was read are loaded on
+        first access, reusing the memory map or reopening the file as needed.
         """
+        if (image_type not in self.images and not self.header_only and
+                image_type in self.config['_Images']):
+            self._load_image(image_type)
         return self.images.get(image_type, None)
 
     def image_types(self):
         """
         Returns a list of names for all image types.
         """
-        return list(self.images.keys())
+        if self.header_only:
+            return list(self.images.keys())
+        return list(self.config['_Images'].keys())
 
     def describe_images(self):
         """
         Returns a list of tuples (key, info) describing the image types.
         """
-        return [(k, self.image(k).description) for k in self.image_types()]
+        return [(k, self.config['_Images'][k]['Description'])
+                for k in self.image_types()]
 
     def __iter__(self):
-        for v in six.itervalues(self.images):
-            yield v
+        for k in self.image_types():
+            yield self.image(k)
+
+    def save_bundle(self, path):
+        """
+        Writes the parsed header and the raw, flattened and converted data of
+        every image type into a bundle that :func:`nanoscope.load_bundle`
+        opens without parsing or copying. See :mod:`nanoscope.bundle`.
+
+        :param path: The path of the bundle to write.
+        """
+        from .bundle import save_bundle
+        save_bundle(self, path)
+
+    def write(self, path):
+        """
+        Writes the header and the raw data of every image type as a Nanoscope
+        file. A file that was read is written back byte for byte unless its
+        ``config`` or data was changed. See :mod:`nanoscope.writer`.
+
+        :param path: The path of the file to write.
+        :raises ValueError: If the file was read with ``header_only``.
+        """
+        from .writer import write
+        write(self, path)
 
+    def __getstate__(self):
+        # open files and memory maps cannot be pickled, lazy loading reopens
+        # the file by name instead. The images pickle memory-mapped and
+        # shared data as descriptors, so mapped files stay cheap to pickle
+        state = self.__dict__.copy()
+        state['_file_object'] = None
+        state['_mmap'] = None
+        return state
+
+    def _load_image(self, image_type):
+        """
+        Read the data for an image type that was skipped when the file was
+        read. The original file object is used while it is still open, else
+        the file is reopened by name.
+
+        :raises ValueError: If the file is closed and cannot be reopened.
+        """
+        if self._mmap is not None or (self._file_object is not None and
+                                      not self._file_object.closed):
+            return self._read_image_data(self._file_object, image_type)
+        if not isinstance(self._file_name, six.string_types):
+            raise ValueError('Cannot load image {}, the file is closed and '
+                             'has no name to reopen'.format(image_type))
+        with io.open(self._file_name, 'rb') as file_object:
+            return self._read_image_data(file_object, image_type)
+
+    @metrics.timed('read_header')
     def _read_header(self, file_object, check_version=True):
         """
         Read the Nanoscope file header.
@@ -108,40 +203,183 @@ class NanoscopeFile(object):
                                     checking is enabled.
         """
         file_object.seek(0)
-        for line in file_object:
-            parameter = parse_parameter(line, self.encoding)
+        header = self._read_header_block(file_object, self.encoding)
+        self._header = header
+        metrics.count('bytes_read', len(header))
+        if metrics.enabled():
+            # counting the lines scans the header, skip it when not recording
+            metrics.count('header_lines', header.count(
+                b'\n' if isinstance(header, bytes) else '\n'))
+        parameters = parse_header(header, self.encoding)
+        for parameter in parameters:
             if not self._validate_version(parameter) and check_version:
                 raise UnsupportedVersion(parameter.hard_value)
-            if self._handle_parameter(parameter, file_object):
+            if self._handle_parameter(parameter, parameters):
                 return
 
+    @classmethod
+    def _read_header_block(cls, file_object, encoding, chunk_size=None,
+                           growth=1):
+        """
+        Read the raw header block from the current position up to and
+        including the ``\\*File list end`` line in as few reads as possible.
+        If there is no such line, the block is read up to the file level
+        ``Data length``, or :attr:`max_header_size` if it is not given, or to
+        the end of the file if that comes first.
+
+        :param file_object: Opened file, in binary or text mode.
+        :param encoding: The encoding of the header, for error messages.
+        :param chunk_size: The size of the first read. Defaults to
+                           :attr:`header_chunk_size`.
+        :param growth: The factor the size of each further read grows by.
+                       Defaults to 1.
+        :returns: The header block, as bytes or text to match the file.
+        :raises InvalidParameter: If the file does not start with a
+                                  ``\\*File list`` line.
+        """
+        chunks = []
+        length = 0
+        limit = cls.max_header_size
+        chunk_size = chunk_size or cls.header_chunk_size
+        markers = head = None
+        checked = found = False
+        end = -1
+        while end < 0 and length < limit:
+            chunk = file_object.read(min(chunk_size, limit - length))
+            if not chunk:
+                break
+            chunk_size *= growth
+            if markers is None:
+                markers = [cls.header_end, '\\*Ciao', '\\Data length:',
+                           '\n', cls.header_start]
+                if isinstance(chunk, bytes):
+                    markers = [m.encode('ascii') for m in markers]
+                marker, _, _, newline, _ = markers
+                head = tail = chunk[:0]
+            chunks.append(chunk)
+            length += len(chunk)
+
+            if not checked:
+                head += chunk
+                checked, data_length = cls._check_header_start(
+                    head, markers, encoding)
+                if data_length is not None:
+                    limit = min(limit, data_length)
+            if found:
+                end = chunk.find(newline)
+                if end >= 0:
+                    end += length - len(chunk)
+                continue
+            # the marker may straddle two chunks
+            window = tail + chunk
+            position = window.find(marker)
+            if position < 0:
+                tail = window[-len(marker):]
+                continue
+            found = True
+            end = window.find(newline, position)
+            if end >= 0:
+                end += length - len(window)
+
+        empty = chunk[:0]
+        if not checked and head:
+            cls._check_header_start(head, markers, encoding, complete=True)
+        header = empty.join(chunks)
+        return header[:end + 1] if end >= 0 else header[:limit]
+
+    @staticmethod
+    def _check_header_start(head, markers, encoding, complete=False):
+        """
+        Checks that the start of the header block is a ``\\*File list`` line
+        and looks for the file level ``Data length`` before the first section.
+
+        :param head: The start of the header block read so far.
+        :param markers: The end, section, ``Data length``, newline and start
+                        markers, as bytes or text to match the block.
+        :param encoding: The encoding of the header, for error messages.
+        :param complete: Whether the whole block has been read.
+        :returns: A tuple of whether the check is done, and the data length
+                  or ``None`` if it is not given.
+        :raises InvalidParameter: If the block does not start with a
+                                  ``\\*File list`` line.
+        """
+        _, section, key, newline, start = markers
+        if head[:len(start)] != start[:len(head)]:
+            line = head.split(newline, 1)[0][:80]
+            if isinstance(line, bytes):
+                line = line.decode(encoding, 'replace')
+            raise InvalidParameter(line.strip())
+        if len(head) < len(start):
+            return complete, None
+
+        section_start = head.find(section)
+        position = head.find(key, 0, section_start if section_start >= 0
+                             else len(head))
+        if position < 0:
+            done = complete or section_start >= 0 or len(head) > 4096
+            return done, None
+        line_end = head.find(newline, position)
+        if line_end < 0:
+            return complete, None
+        try:
+            return True, int(head[position + len(key):line_end].strip())
+        except ValueError:
+            return True, None
+
+    @metrics.timed('read_image_data')
     def _read_image_data(self, file_object, image_type):
         """
         Read the raw data for the specified image type if it is in the file.
 
         :param image_type: String indicating which image type to read.
         :returns: A NanoscopeImage instance of the specified type
+        :raises MissingImageData: If the image_type indicated is not in the file
+        """
+        data_offset, dtype, shape = self._image_extent(image_type)
+        number_points = shape[0] * shape[1]
+        if self.mmap and (self._mmap is not None or
+                          self._has_fileno(file_object)):
+            raw_data = self._map_image_data(file_object, data_offset, dtype,
+                                            number_points)
+        else:
+            file_object.seek(data_offset)
+            raw_data = np.frombuffer(
+                file_object.read(dtype.itemsize * number_points),
+                dtype=dtype, count=number_points)
+        return self._add_image(image_type, raw_data.reshape(shape))
+
+    def _image_extent(self, image_type):
+        """
+        Returns the offset, type and shape of the raw data of an image type in
+        the file.
+
         :raises MissingImageData: If the image_type indicated is not in the file
         """
         if image_type not in self.config['_Images']:
             raise MissingImageData(image_type)
 
         config = self.config['_Images'][image_type]
-        data_offset = config['Data offset']
-        data_size = config['Bytes/pixel']
-        number_lines = config['Number of lines']
-        samples_per_line = config['Samps/line']
-
-        file_object.seek(data_offset)
-        number_points = number_lines * samples_per_line
-        raw_data = (np.frombuffer(file_object.read(data_size * number_points),
-                                  dtype='<i{}'.format(data_size),
-                                  count=number_points)
-                   .reshape((number_lines, samples_per_line)))
+        dtype = np.dtype('<i{}'.format(config['Bytes/pixel']))
+        return (config['Data offset'], dtype,
+                (config['Number of lines'], config['Samps/line']))
+
+    def _add_image(self, image_type, raw_data):
+        """
+        Adds the image of the raw data read for the image type.
+        """
+        metrics.count('bytes_read', raw_data.nbytes)
+        self.images[image_type] = self._make_image(image_type, raw_data)
+        return self.images[image_type]
 
+    def _make_image(self, image_type, raw_data):
+        """
+        Returns a NanoscopeImage of the raw data, scaled according to the
+        header parameters of the image type.
+        """
+        config = self.config['_Images'][image_type]
         scan_size = self._get_config_fuzzy_key(config, ['Scan size', 'Scan Size'])
 
-        self.images[image_type] = NanoscopeImage(
+        image = NanoscopeImage(
             image_type,
             raw_data,
             config['Bytes/pixel'],
@@ -151,7 +389,36 @@ class NanoscopeFile(object):
             scan_size * scan_size,
             config['Description'],
         )
-        return self.images[image_type]
+        if self.cache is not None:
+            image.result_cache = self.cache
+        return image
+
+    def _map_image_data(self, file_object, data_offset, dtype, count):
+        """
+        Returns a read-only view of ``count`` values of ``dtype`` starting at
+        ``data_offset`` in a memory map of the file. The whole file is mapped
+        once and shared between all of the images.
+
+        :raises ValueError: If the file is too short to hold the data.
+        """
+        if self._mmap is None:
+            self._mmap = np.memmap(file_object, dtype=np.uint8, mode='r')
+        data_length = np.dtype(dtype).itemsize * count
+        data = self._mmap[data_offset:data_offset + data_length]
+        if data.size < data_length:
+            raise ValueError('buffer is smaller than requested size')
+        return data.view(dtype)
+
+    @staticmethod
+    def _has_fileno(file_object):
+        """
+        Returns whether the file object has a file descriptor to map.
+        """
+        try:
+            file_object.fileno()
+        except (AttributeError, EnvironmentError, ValueError):
+            return False
+        return True
 
     def _get_sensitivity_value(self, image_type, key):
         parameter = self.config['_Images'][image_type][key]
@@ -164,19 +431,20 @@ class NanoscopeFile(object):
             value = config.get(k, None)
             if value is not None:
                 return value
-        raise KeyError
+        raise MissingParameter(keys[0])
 
     def _validate_version(self, parameter):
         if parameter.type == 'H' or parameter.parameter != 'Version':
             return True
         return parameter.hard_value in self.supported_versions
 
-    def _handle_parameter(self, parameter, f):
+    def _handle_parameter(self, parameter, parameters):
         if parameter.type == 'H':  # header
             if parameter.header == 'File list end':
                 return True
             if parameter.header == 'Ciao image list':
-                return self._handle_parameter(self._read_image_header(f), f)
+                return self._handle_parameter(
+                    self._read_image_header(parameters), parameters)
         elif parameter.type == 'V':
             if not parameter.soft_scale and not parameter.hard_scale:
                 self.config[parameter.parameter] = parameter.hard_value
@@ -186,10 +454,9 @@ class NanoscopeFile(object):
             self.config[parameter.parameter] = parameter.hard_value
         return False
 
-    def _read_image_header(self, f):
+    def _read_image_header(self, parameters):
         image_config = {}
-        for line in f:
-            parameter = parse_parameter(line, self.encoding)
+        for parameter in parameters:
             if parameter.type == 'H':
                 return parameter
             elif parameter.type == 'S':
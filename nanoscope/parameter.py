@@ -1,16 +1,190 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, unicode_literals
 
+import collections
 import datetime
 import re
+import threading
 
 import six
-from astropy import units as u
 
+from . import metrics
 from .error import InvalidParameter
+from .units import parse_quantity
 
 
-__all__ = ['parse_parameter']
+__all__ = ['parse_parameter', 'parse_header', 'format_parameter',
+           'format_value', 'quantity_cache']
+
+
+_HEADER_REGEX = re.compile(r'\\\*(?P<header>.+)')
+_PARAMETER_REGEX = re.compile(r'\\(?P<ciao>@?)(?:(?P<group>[0-9]+):)?'
+                              r'(?P<parameter>[^:]+): '
+                              r'(?:(?P<type>[VCS]) )?(?P<value>.*)')
+_VALUE_REGEX = re.compile(r'(?:\[(?P<soft_scale>[^\[\]]*)\] )?'
+                          r'(?:\((?P<hard_scale>[^\(\)]*)\) )?'
+                          r'(?P<hard_value>[^\[\]\(\)]*)')
+_SCALE_REGEX = re.compile(r'(?:\[(?P<soft_scale>[^\[\]]*)\] )?'
+                          r'(?P<hard_value>[^\[\]]*)')
+_SELECT_REGEX = re.compile(r'(?:\[(?P<internal_designation>[^\[\]]*)\] )?'
+                           r'(?:\"(?P<external_designation>[^\"]*)\")?')
+
+_DATE_FORMAT = '%I:%M:%S %p %a %b %d %Y'
+_DATE_REGEX = re.compile(r'\d{1,2}:')
+_INT_REGEX = re.compile(r'[+-]?\d+\Z')
+_FLOAT_REGEX = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\Z')
+_HEX_REGEX = re.compile(r'0x[0-9A-Fa-f]+\Z')
+
+
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class QuantityCache(object):
+    """
+    Bounded LRU cache of parsed quantity strings, shared by every CiaoValue
+    in the process. Strings that are not valid quantities are cached as well,
+    so they are only rejected once.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse(self, string):
+        """
+        Parses the string as a quantity, using the cached result if the string
+        has been seen before.
+
+        :param string: The quantity string, e.g. ``12.95302 nm/V``.
+        :returns: A new :class:`nanoscope.units.Quantity` (or
+                  ``astropy.units.Quantity`` for units it does not cover), or
+                  ``None`` if the string is not a valid quantity.
+        """
+        with self._lock:
+            try:
+                parsed = self._cache.pop(string)
+            except KeyError:
+                self.misses += 1
+                metrics.count('quantity_cache_misses')
+            else:
+                self.hits += 1
+                metrics.count('quantity_cache_hits')
+                self._cache[string] = parsed
+                return parsed if parsed is None else parsed.copy()
+
+        try:
+            quantity = parse_quantity(string)
+        except (ValueError, TypeError):
+            quantity = None
+
+        with self._lock:
+            self._cache[string] = quantity
+            self._evict()
+        return quantity if quantity is None else quantity.copy()
+
+    def info(self):
+        """
+        Returns the hit and miss counts and the current and maximum size of
+        the cache.
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._cache))
+
+    def resize(self, maxsize):
+        """
+        Sets the maximum number of cached strings, evicting the least recently
+        used strings if needed.
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """
+        Empties the cache and resets the hit and miss counts.
+        """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self):
+        while len(self._cache) > max(self.maxsize, 0):
+            self._cache.popitem(last=False)
+
+
+quantity_cache = QuantityCache()
+
+
+def _parse_date(value):
+    """
+    Returns the value as a ``datetime.datetime`` if it is a header date, else
+    ``None``. Only values that start like a time are handed to strptime.
+    """
+    if _DATE_REGEX.match(value) is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, _DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def _parse_number(token, default):
+    """
+    Returns the token as an ``int`` or ``float``, else ``default``. The type
+    is decided by matching the token against the shapes of plain numbers, and
+    only unusual tokens (``nan``, ``inf``, digit separators) fall back to
+    trying the conversions.
+    """
+    if _INT_REGEX.match(token):
+        return int(token)
+    if _FLOAT_REGEX.match(token):
+        return float(token)
+    if '_' in token or token.lstrip('+-')[:1] in ('n', 'N', 'i', 'I'):
+        try:
+            return int(token)
+        except ValueError:
+            try:
+                return float(token)
+            except ValueError:
+                pass
+    return default
+
+
+def _schema_version(value):
+    return value if _HEX_REGEX.match(value) else _UNKNOWN
+
+
+def _schema_date(value):
+    date = _parse_date(value)
+    return _UNKNOWN if date is None else date
+
+
+def _schema_int(value):
+    token = value.strip().split(' ')[0]
+    return int(token) if _INT_REGEX.match(token) else _UNKNOWN
+
+
+_UNKNOWN = object()
+_SCHEMA = {
+    'Version': _schema_version,
+    'Date': _schema_date,
+    'Data offset': _schema_int,
+    'Data length': _schema_int,
+    'Bytes/pixel': _schema_int,
+    'Samps/line': _schema_int,
+    'Number of lines': _schema_int,
+    'Lines': _schema_int,
+}
+"""
+Converters for parameters whose type is known up front. Each returns
+``_UNKNOWN`` when the value does not have the expected form, in which case
+the value is classified like any other.
+"""
 
 
 class CiaoParameter(object):
@@ -21,7 +195,8 @@ class CiaoParameter(object):
 
     def __init__(self, parameter, hard_value):
         self.parameter = parameter
-        self.hard_value = self._parse_value(hard_value)
+        self.hard_value = self._parse_value(hard_value,
+                                            _SCHEMA.get(parameter))
 
     def __str__(self):
         return '{0}: {1}'.format(self.parameter, self.hard_value)
@@ -36,35 +211,36 @@ class CiaoParameter(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def _parse_value(self, value):
+    def _parse_value(self, value, schema=None):
         """
-        Try to parse and return the value as the following values:
+        Parse and return the value as the first of the following that fits:
 
         * ``datetime.datetime``
+        * ``None``
         * ``int``
         * ``float``
         * ``str``
-        * ``None``
 
         Trailing whitespace is stripped and an empty string is returned
-        as ``None``.
+        as ``None``. Numbers are taken from the first word of the value.
+
+        :param value: The value string.
+        :param schema: Optional converter for the parameter, tried first.
         """
-        try:
-            return datetime.datetime.strptime(value, '%I:%M:%S %p %a %b %d %Y')
-        except:
-            try:
-                split_value = value.strip().split(' ')[0]
-                if split_value in ('', 'None'):
-                    return None
-            except AttributeError:
-                return value
-            try:
-                return int(split_value)
-            except ValueError:
-                try:
-                    return float(split_value)
-                except ValueError:
-                    return value
+        if value is None:
+            return None
+        if schema is not None:
+            parsed = schema(value)
+            if parsed is not _UNKNOWN:
+                return parsed
+
+        date = _parse_date(value)
+        if date is not None:
+            return date
+        split_value = value.strip().split(' ')[0]
+        if split_value in ('', 'None'):
+            return None
+        return _parse_number(split_value, value)
 
 
 class CiaoValue(CiaoParameter):
@@ -89,19 +265,19 @@ class CiaoValue(CiaoParameter):
                 self.hard_scale == other.hard_scale and
                 self.hard_value == other.hard_value)
 
-    def _parse_value(self, value):
+    def _parse_value(self, value, schema=None):
         if value is None:
             return None
 
-        try:
-            return datetime.datetime.strptime(value, '%I:%M:%S %p %a %b %d %Y')
-        except:
-            if value.strip() in ('', 'None'):
-                return None
-            try:
-                return u.Quantity(value.strip().replace('º', 'deg'))
-            except (ValueError, TypeError):
-                return value
+        date = _parse_date(value)
+        if date is not None:
+            return date
+        if value.strip() in ('', 'None'):
+            return None
+        quantity = quantity_cache.parse(value.strip().replace('º', 'deg'))
+        if quantity is None:
+            return value
+        return quantity
 
 
 class CiaoScale(CiaoParameter):
@@ -197,38 +373,103 @@ def parse_parameter(string, encoding='utf-8'):
     :raises ValueError: If the string is not a valid CiaoParameter.
     """
     string = decode(string, encoding)
-    header_match = re.match(r'\\\*(?P<header>.+)', string)
+    header_match = _HEADER_REGEX.match(string)
     if header_match is not None:
         return CiaoSectionHeader(header_match.group('header'))
 
-    regex = re.compile(r'\\(?P<ciao>@?)(?:(?P<group>[0-9]+):)?'
-                       r'(?P<parameter>[^:]+): '
-                       r'(?:(?P<type>[VCS]) )?(?P<value>.*)')
-    m = regex.match(string)
+    m = _PARAMETER_REGEX.match(string)
     if m is None:
         raise InvalidParameter(string)
 
     parameter_type = m.group('type')
     value = m.group('value')
     if parameter_type == 'V':  # value
-        value_regex = (r'(?:\[(?P<soft_scale>[^\[\]]*)\] )?'
-                       r'(?:\((?P<hard_scale>[^\(\)]*)\) )?'
-                       r'(?P<hard_value>[^\[\]\(\)]*)')
-        vm = re.match(value_regex, value)
+        vm = _VALUE_REGEX.match(value)
         return CiaoValue(m.group('parameter'), vm.group('soft_scale'),
                          vm.group('hard_scale'), vm.group('hard_value'))
     elif parameter_type == 'C':  # scale
-        scale_regex = (r'(?:\[(?P<soft_scale>[^\[\]]*)\] )?'
-                       r'(?P<hard_value>[^\[\]]*)')
-        cm = re.match(scale_regex, value)
+        cm = _SCALE_REGEX.match(value)
         return CiaoScale(m.group('parameter'), cm.group('soft_scale'),
                          cm.group('hard_value'))
     elif parameter_type == 'S':  # select
-        select_regex = (r'(?:\[(?P<internal_designation>[^\[\]]*)\] )?'
-                        r'(?:\"(?P<external_designation>[^\"]*)\")?')
-        sm = re.match(select_regex, value)
+        sm = _SELECT_REGEX.match(value)
         return CiaoSelect(m.group('parameter'),
                           sm.group('internal_designation'),
                           sm.group('external_designation'))
     else:  # simple value
         return CiaoParameter(m.group('parameter'), value)
+
+
+def parse_header(string, encoding='utf-8'):
+    """
+    Generator that parses a whole header block, decoding it once and yielding
+    the CiaoParameter for each line in order.
+
+    :param string: The header block, may be binary or non-binary.
+    :param encoding: The encoding to use for a binary string. Defaults to utf-8.
+    :returns: An iterator of the CiaoParameters in the header.
+    :raises InvalidParameter: If a line is not a valid CiaoParameter.
+    """
+    string = decode(string, encoding)
+    if not string:
+        return
+    for line in string.split('\n'):
+        yield parse_parameter(line)
+
+
+def format_value(value):
+    """
+    Returns the header text of a parsed value, the inverse of the value
+    parsing of :func:`parse_parameter`.
+
+    :param value: A value as parsed from the header, e.g. a number, date or
+                  quantity.
+    :returns: The value as it is written in a header line.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.strftime(_DATE_FORMAT)
+    if isinstance(value, float):
+        return repr(value)
+    if hasattr(value, 'unit') and hasattr(value, 'value'):
+        unit = value.unit.to_string().replace(' / ', '/')
+        number = format_value(float(value.value))
+        return '{} {}'.format(number, unit) if unit else number
+    return six.text_type(value)
+
+
+def format_parameter(parameter, ciao=None, group=None):
+    """
+    Returns the header line of the CiaoParameter, without the line ending.
+    This is the inverse of :func:`parse_parameter`.
+
+    :param parameter: The CiaoParameter to format.
+    :param ciao: Whether to mark the line as a Ciao parameter with ``@``.
+                 Defaults to True for values, scales and selects.
+    :param group: The optional group number of the parameter, e.g. ``2``
+                  for ``\\@2:Z scale``.
+    :returns: The header line.
+    """
+    if parameter.type == 'H':
+        return '\\*' + parameter.header
+    if ciao is None:
+        ciao = parameter.type != 'P'
+    prefix = '\\{}{}{}: '.format('@' if ciao else '',
+                                 '' if group is None else '{}:'.format(group),
+                                 parameter.parameter)
+    if parameter.type == 'S':
+        return prefix + 'S [{}] "{}"'.format(parameter.internal or '',
+                                             parameter.external or '')
+    value = format_value(parameter.hard_value)
+    if parameter.type == 'C':
+        if parameter.soft_scale is not None:
+            value = '[{}] {}'.format(format_value(parameter.soft_scale), value)
+        return prefix + 'C ' + value
+    if parameter.type == 'V':
+        if parameter.hard_scale is not None:
+            value = '({}) {}'.format(format_value(parameter.hard_scale), value)
+        if parameter.soft_scale is not None:
+            value = '[{}] {}'.format(format_value(parameter.soft_scale), value)
+        return prefix + 'V ' + value
+    return prefix + value
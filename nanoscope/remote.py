@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Reading files from HTTP servers and S3-compatible object stores with range
+requests, so that only the header and the channels that are needed are
+downloaded::
+
+    from nanoscope.remote import read_remote
+
+    p = read_remote('https://bucket.example.com/scans/file.000',
+                    channels=['Height'])
+
+The header is fetched with a small ranged GET that grows until it holds the
+``\\*File list end`` line, within the same limits as for local files. The
+byte ranges of the requested channels follow from the ``Data offset`` of each
+image, and adjacent ranges are fetched together. Any other channel is fetched
+the first time it is accessed. Connections are kept open and reused per
+host.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import io
+import socket
+import threading
+
+import numpy as np
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
+
+from .nanoscope import NanoscopeFile
+
+
+__all__ = ['ConnectionPool', 'RemoteFile', 'read_remote']
+
+
+class ConnectionPool(object):
+    """
+    Keeps HTTP connections open for reuse, up to ``maxsize`` idle
+    connections per host. Safe to share between threads.
+
+    :param maxsize: The maximum number of idle connections kept per host.
+                    Defaults to 4.
+    :param timeout: The socket timeout in seconds. Defaults to 60.
+    :param headers: Optional dict of headers sent with every request, e.g.
+                    ``Authorization``.
+    """
+
+    def __init__(self, maxsize=4, timeout=60, headers=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.requests = 0
+        self.connections = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get_range(self, url, start, stop=None):
+        """
+        Returns the bytes from ``start`` up to ``stop`` of the resource, or to
+        its end if ``stop`` is ``None``. Fewer bytes are returned if the
+        resource ends sooner.
+
+        :raises IOError: If the server responds with an error.
+        """
+        if stop is not None and stop <= start:
+            return b''
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes={}-{}'.format(
+            start, '' if stop is None else stop - 1)
+
+        connection, reused = self._connection(key)
+        try:
+            response = self._request(connection, path, headers)
+        except (http_client.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            # the server closed an idle connection, retry on a new one
+            connection, _ = self._connection(key, reuse=False)
+            response = self._request(connection, path, headers)
+        body = response.read()
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+
+        if response.status == 206:
+            return body
+        if response.status == 200:
+            # the server ignored the range and sent the whole resource
+            return body[start:stop]
+        if response.status == 416:
+            return b''
+        raise IOError('HTTP {} {} for {}'.format(response.status,
+                                                 response.reason, url))
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, connection, path, headers):
+        with self._lock:
+            self.requests += 1
+        connection.request('GET', path, headers=headers)
+        return connection.getresponse()
+
+    def _connection(self, key, reuse=True):
+        """
+        Returns an idle connection to the host and True, or a new connection
+        and False.
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if reuse and idle:
+                return idle.pop(), True
+            self.connections += 1
+        scheme, netloc = key
+        if scheme == 'https':
+            connection_class = http_client.HTTPSConnection
+        elif scheme == 'http':
+            connection_class = http_client.HTTPConnection
+        else:
+            raise ValueError('Unsupported URL scheme {}'.format(scheme))
+        return connection_class(netloc, timeout=self.timeout), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(connection)
+                return
+        connection.close()
+
+
+_default_pool = ConnectionPool()
+
+
+class RemoteFile(object):
+    """
+    Read-only binary file object over a URL, fetching each read with a range
+    request.
+    """
+    mode = 'rb'
+
+    def __init__(self, url, pool=None):
+        self.url = url
+        self.pool = pool or _default_pool
+        self.closed = False
+        self._position = 0
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        stop = None if size is None or size < 0 else self._position + size
+        data = self.pool.get_range(self.url, self._position, stop)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise ValueError('Only seeking from the start or the current '
+                             'position is supported')
+        self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_remote(url, encoding='cp1252', header_only=False, check_version=True,
+                channels=None, cache=None, pool=None, header_chunk_size=16384,
+                max_gap=0):
+    """
+    Reads a file from a URL like :func:`nanoscope.read`, downloading only the
+    header and the data of the requested channels with range requests.
+
+    :param url: The http or https URL of the file, e.g. a presigned object
+                store URL.
+    :param encoding: The encoding to use when reading the file header.
+                     Defaults to cp1252.
+    :param header_only: Whether to read only the file header. Defaults to
+                        False.
+    :param check_version: Whether to enforce version checking for known
+                          supported versions. Defaults to True.
+    :param channels: Names of the image types to load up front, or ``None``
+                     to load all of them. Any other image type is fetched the
+                     first time it is accessed.
+    :param cache: Optional :class:`nanoscope.cache.ResultCache` for the
+                  images.
+    :param pool: The :class:`ConnectionPool` to use. Defaults to a pool
+                 shared by all reads.
+    :param header_chunk_size: The size of the first range fetched for the
+                              header, which doubles with each further range
+                              until the end of the header is found, up to
+                              the file level ``Data length``. Defaults to
+                              16 KiB.
+    :param max_gap: The largest number of unused bytes between the data of
+                    two channels that are still fetched in one range.
+                    Defaults to 0, which only joins adjacent channels.
+    :returns: A NanoscopeFile object containing the image data.
+    :raises IOError: If the server responds with an error.
+    :raises InvalidParameter: If the file does not start with a
+                              ``\\*File list`` line.
+    """
+    pool = pool or _default_pool
+    header = NanoscopeFile._read_header_block(RemoteFile(url, pool), encoding,
+                                              header_chunk_size, growth=2)
+    nanoscope_file = NanoscopeFile(io.BytesIO(header), encoding,
+                                   header_only=True,
+                                   check_version=check_version, cache=cache)
+    if header_only:
+        return nanoscope_file
+
+    nanoscope_file.header_only = False
+    nanoscope_file._file_object = RemoteFile(url, pool)
+    image_types = [image_type
+                   for image_type in nanoscope_file.config['_Images']
+                   if channels is None or image_type in channels]
+    extents = sorted(((nanoscope_file._image_extent(image_type), image_type)
+                      for image_type in image_types),
+                     key=lambda extent: extent[0][0])
+    for start, stop, members in _coalesce(extents, max_gap):
+        data = pool.get_range(url, start, stop)
+        for (offset, dtype, shape), image_type in members:
+            raw_data = np.frombuffer(data, dtype=dtype,
+                                     count=shape[0] * shape[1],
+                                     offset=offset - start)
+            nanoscope_file._add_image(image_type, raw_data.reshape(shape))
+    return nanoscope_file
+
+
+def _coalesce(extents, max_gap):
+    """
+    Groups the sorted ``((offset, dtype, shape), image_type)`` extents into
+    ``(start, stop, members)`` byte ranges, joining extents that are at most
+    ``max_gap`` bytes apart.
+    """
+    ranges = []
+    for extent in extents:
+        offset, dtype, shape = extent[0]
+        stop = offset + dtype.itemsize * shape[0] * shape[1]
+        if ranges and offset - ranges[-1][1] <= max_gap:
+            start, previous, members = ranges[-1]
+            ranges[-1] = (start, max(stop, previous), members + [extent])
+        else:
+            ranges.append((offset, stop, [extent]))
+    return ranges
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Sharing image data between processes without copying it through pickles.
+
+Pickling a NanoscopeImage normally copies its raw, flattened and converted
+arrays. Arrays that live in shared memory, or that are memory-mapped from a
+file, are pickled as small descriptors instead, and are attached or mapped
+again when unpickled, so images and files are cheap to send to a process
+pool.
+
+:func:`process_many` uses this to process the images of many files on a pool
+of processes::
+
+    from nanoscope.shared import process_many
+
+    files = [nanoscope.read(path, mmap=True) for path in paths]
+    process_many(files, order=1, workers=8)
+    files[0].height.summary()  # computed by a worker
+
+The workers map the raw data of memory-mapped files again, other raw data is
+copied once into shared memory. They flatten and convert into shared output
+arrays and send back only the statistics. Shared memory needs Python 3.8 or
+later.
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import collections
+import mmap
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+__all__ = ['SharedRef', 'MappedRef', 'SharedArrays', 'reference', 'resolve',
+           'process_many']
+
+
+SharedRef = collections.namedtuple('SharedRef', [
+    'name', 'offset', 'dtype', 'shape', 'strides'])
+"""
+Descriptor of an array at ``offset`` bytes into the shared memory block
+``name``.
+"""
+
+MappedRef = collections.namedtuple('MappedRef', [
+    'filename', 'offset', 'dtype', 'shape', 'mode'])
+"""
+Descriptor of a C-contiguous array memory-mapped from ``filename`` at
+``offset`` bytes.
+"""
+
+
+class _Block(object):
+    """
+    A shared memory block. Arrays use the block by address rather than
+    through its buffer, so that the block can close cleanly once the last
+    array using it is released.
+    """
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.name = shm.name
+        self.size = shm.size
+        self.address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        self.linked = True
+
+    def array(self, offset, dtype, shape, strides=None):
+        return np.asarray(_View(self, offset, dtype, shape, strides))
+
+    def __contains__(self, array):
+        start = array.__array_interface__['data'][0]
+        return self.address <= start < self.address + self.size
+
+
+class _View(object):
+    """
+    Exposes part of a block to numpy, and keeps the block alive for as long
+    as an array uses it.
+    """
+
+    def __init__(self, block, offset, dtype, shape, strides):
+        self.block = block
+        self.__array_interface__ = {
+            'version': 3,
+            'data': (block.address + offset, False),
+            'typestr': np.dtype(dtype).str,
+            'shape': tuple(shape),
+            'strides': strides,
+        }
+
+
+class SharedArrays(object):
+    """
+    Allocates arrays in shared memory that pickle as a :class:`SharedRef`.
+    Used as a context manager, the blocks are unlinked on exit. Arrays stay
+    valid in the processes that use them until they are released, but are
+    pickled by copying from then on.
+
+    :raises RuntimeError: If shared memory is not available.
+    """
+
+    def __init__(self):
+        if shared_memory is None:
+            raise RuntimeError('Shared memory needs Python 3.8 or later')
+        self._blocks = []
+
+    def empty(self, shape, dtype=np.float64):
+        """
+        Returns a new uninitialized array in shared memory.
+        """
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        block = _Block(shared_memory.SharedMemory(create=True,
+                                                  size=max(size, 1)))
+        self._blocks.append(block)
+        return block.array(0, dtype, shape)
+
+    def copy(self, array):
+        """
+        Returns a copy of the array in shared memory.
+        """
+        shared = self.empty(array.shape, array.dtype)
+        shared[...] = array
+        return shared
+
+    def close(self):
+        """
+        Unlinks the blocks, so the memory is freed once every process has
+        released its arrays.
+        """
+        blocks, self._blocks = self._blocks, []
+        for block in blocks:
+            block.linked = False
+            block.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _owner(array):
+    base = array
+    while isinstance(base, np.ndarray):
+        base = base.base
+    return base
+
+
+def reference(array, memo=None):
+    """
+    Returns a descriptor of the array if it is in linked shared memory or
+    memory-mapped read-only or read-write from a file, else the array itself.
+
+    :param array: The array, or ``None``.
+    :param memo: Optional dict of the descriptors already made, so that
+                 arrays referenced more than once get the same descriptor.
+    """
+    if not isinstance(array, np.ndarray):
+        return array
+    if memo is not None and id(array) in memo:
+        return memo[id(array)][1]
+
+    owner = _owner(array)
+    ref = array
+    if (isinstance(owner, _View) and owner.block.linked and
+            array in owner.block):
+        block = owner.block
+        ref = SharedRef(block.name,
+                        array.__array_interface__['data'][0] - block.address,
+                        array.dtype.str, array.shape, array.strides)
+    elif (isinstance(owner, mmap.mmap) and isinstance(array, np.memmap) and
+            array.filename is not None and array.mode in ('r', 'r+') and
+            array.flags.c_contiguous and len(owner)):
+        start = np.frombuffer(owner, dtype=np.uint8).ctypes.data
+        offset = (array.offset - array.offset % mmap.ALLOCATIONGRANULARITY +
+                  array.ctypes.data - start)
+        ref = MappedRef(array.filename, offset, array.dtype.str, array.shape,
+                        array.mode)
+    if memo is not None:
+        # keep the array alive so that its id is not reused
+        memo[id(array)] = (array, ref)
+    return ref
+
+
+def resolve(value, memo=None):
+    """
+    Returns the array of a descriptor made by :func:`reference`, attaching
+    the shared memory or mapping the file, or the value itself if it is not
+    a descriptor.
+
+    :param memo: Optional dict of the descriptors already resolved, so that
+                 a descriptor used more than once gives the same array.
+    """
+    if not isinstance(value, (SharedRef, MappedRef)):
+        return value
+    if memo is not None and id(value) in memo:
+        return memo[id(value)][1]
+    if isinstance(value, SharedRef):
+        block = _Block(shared_memory.SharedMemory(name=value.name))
+        array = block.array(value.offset, value.dtype, value.shape,
+                            value.strides)
+    else:
+        array = np.memmap(value.filename, dtype=value.dtype, mode=value.mode,
+                          offset=value.offset, shape=value.shape)
+    if memo is not None:
+        memo[id(value)] = (value, array)
+    return array
+
+
+def process_many(files, order=1, dtype=np.float64, channels=None,
+                 workers=None, executor='process'):
+    """
+    Flattens and converts the images of many files on a pool of processes
+    and calculates their statistics, with the same results as calling
+    ``image.process(order, dtype).summary()`` on each image. The files are
+    updated in place.
+
+    Only descriptors of the data are sent to the workers. The raw data of
+    memory-mapped files is mapped by the workers, any other raw data is
+    copied once into shared memory and then used from there. The workers
+    write the flattened and converted data into shared memory and send back
+    the statistics.
+
+    :param files: Iterable of NanoscopeFile objects.
+    :param order: The order of the polynomial to use when flattening.
+                  Defaults to 1 (linear).
+    :param dtype: The floating point type of the processed data. Defaults to
+                  float64.
+    :param channels: Names of the image types to process, or ``None`` to
+                     process all of them. Image types that a file does not
+                     have are skipped.
+    :param workers: The number of workers. Defaults to the number of CPUs.
+    :param executor: ``'process'``, ``'thread'``, or an existing
+                     ``concurrent.futures.Executor``. Defaults to
+                     ``'process'``.
+    :returns: The list of files.
+    :raises RuntimeError: If shared memory is not available.
+    """
+    from .batch import imap
+
+    files = list(files)
+    images = [f.image(image_type) for f in files
+              for image_type in f.image_types()
+              if channels is None or image_type in channels]
+    images = [image for image in images if image is not None]
+
+    with SharedArrays() as arrays:
+        tasks = []
+        outputs = []
+        for image in images:
+            if not isinstance(reference(image.raw_data),
+                              (SharedRef, MappedRef)):
+                image.raw_data = arrays.copy(image.raw_data)
+            output = (arrays.empty(image.raw_data.shape, dtype),
+                      arrays.empty(image.raw_data.shape, dtype))
+            outputs.append(output)
+            tasks.append((_worker_image(image), reference(output[0]),
+                          reference(output[1]), order))
+        results = imap(_process, tasks, workers, executor)
+        for image, (flat_data, converted_data), entries in zip(
+                images, outputs, results):
+            image._processed(order, flat_data, converted_data, entries)
+    return files
+
+
+def _worker_image(image):
+    """
+    Returns a copy of the image with only its raw data, to send to a worker.
+    """
+    copy = image.__class__.__new__(image.__class__)
+    copy.__dict__.update(image.__dict__)
+    copy.flat_data = copy.converted_data = copy._conversion = None
+    copy._provenance = []
+    copy._cache = {}
+    return copy
+
+
+def _process(task):
+    image, flat_data, converted_data, order = task
+    image.flatten(order, out=resolve(flat_data))
+    image.convert(out=resolve(converted_data))
+    image.summary()
+    return image._json_entries(image._cache)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+
+__all__ = ['Histogram', 'Moments', 'OrderStatistics']
+
+_MAX_BINS = 1 << 22
+
+
+def _histogram(data, integral=False):
+    """
+    Returns the distinct values of the flat array ``data`` in ascending order
+    and the number of times each occurs. Integer data, and floating point data
+    that is expected to hold whole numbers, is counted with ``np.bincount``
+    when its range is small enough; anything else is sorted by ``np.unique``.
+    """
+    if not data.size or not (data.dtype.kind in 'iu' or integral):
+        return np.unique(data, return_counts=True)
+    low = int(np.min(data))
+    high = int(np.max(data))
+    if high - low + 1 > max(_MAX_BINS, data.size):
+        return np.unique(data, return_counts=True)
+    offsets = data.astype(np.int64)
+    if data.dtype.kind not in 'iu' and not np.array_equal(offsets, data):
+        return np.unique(data, return_counts=True)
+    offsets -= low
+    counts = np.bincount(offsets, minlength=high - low + 1)
+    values = np.flatnonzero(counts)
+    counts = counts[values]
+    values += low
+    return values.astype(data.dtype), counts
+
+
+class OrderStatistics(object):
+    """
+    Order statistics of an image, built from a single histogram of its
+    values. Once built, any number of percentile, bearing ratio and n highest
+    or lowest point queries are answered from the histogram without sorting
+    the data again.
+
+    Integer data (and floating point data holding whole numbers, such as
+    flattened data) is counted with ``np.bincount`` in a single pass when its
+    range is small, as for the 2 byte data of most Nanoscope images. Other
+    data falls back to one sort with ``np.unique``.
+
+    :param data: The data to build the histogram from.
+    :param scale: Factor applied to every value, so that the statistics of
+                  converted data can be built from the whole-number data it
+                  was converted from.
+    :param integral: Whether floating point data is expected to hold only
+                     whole numbers. This is verified before it is relied on.
+    """
+
+    def __init__(self, data, scale=1, integral=False):
+        data = np.asarray(data).ravel()
+        self._set(*_histogram(data, integral), scale=scale)
+
+    @classmethod
+    def from_histogram(cls, values, counts, scale=1):
+        """
+        Returns the order statistics of a histogram that was already counted,
+        given its distinct values in ascending order and their counts.
+        """
+        statistics = cls.__new__(cls)
+        statistics._set(values, counts, scale)
+        return statistics
+
+    def _set(self, values, counts, scale=1):
+        if scale != 1:
+            values = values * scale
+        self.values = values
+        self.counts = counts
+        self.cumulative = np.cumsum(counts)
+        self.size = int(self.cumulative[-1]) if len(counts) else 0
+
+    def kth(self, k):
+        """
+        Returns the k-th smallest value (zero-based). ``k`` may be an array.
+        """
+        index = np.searchsorted(self.cumulative, k, side='right')
+        return self.values[index]
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile of the data, interpolated linearly between
+        the closest values like ``np.percentile``. ``q`` may be an array.
+        """
+        position = np.asarray(q, dtype=np.float64) / 100 * (self.size - 1)
+        lower = np.floor(position)
+        fraction = position - lower
+        lower = lower.astype(np.int64)
+        upper = np.minimum(lower + 1, self.size - 1)
+        low = self.kth(lower)
+        high = self.kth(upper)
+        return np.where(fraction < 0.5, low + (high - low) * fraction,
+                        high - (high - low) * (1 - fraction))
+
+    def bearing_ratio(self, height):
+        """
+        Returns the bearing (material) ratio at the given height: the fraction
+        of the data at or above it. ``height`` may be an array.
+        """
+        below = np.searchsorted(self.values, height, side='left')
+        below_count = np.where(below > 0,
+                               self.cumulative[np.maximum(below - 1, 0)], 0)
+        return (self.size - below_count) / self.size
+
+    def bearing_curve(self, points=101):
+        """
+        Returns the Abbott-Firestone curve as a tuple ``(ratios, heights)``
+        of ``points`` bearing ratios evenly spaced from 0 to 1 and the height
+        at which the data reaches each ratio.
+        """
+        ratios = np.linspace(0, 1, points)
+        return ratios, self.percentile((1 - ratios) * 100)
+
+    def largest(self, n):
+        """
+        Returns the n largest values in ascending order.
+        """
+        n = min(n, self.size)
+        return self.kth(np.arange(self.size - n, self.size))
+
+    def smallest(self, n):
+        """
+        Returns the n smallest values in ascending order.
+        """
+        return self.kth(np.arange(min(n, self.size)))
+
+
+class Histogram(object):
+    """
+    Histogram of whole-number data that arrives in blocks, such as the tiles
+    of an image that is processed out of core. The counts are kept in one
+    dense array over the range of the values, so memory use is bounded by
+    ``max_bins`` rather than by the size of the data or the number of
+    distinct values.
+
+    Once the range of the values grows beyond ``max_bins``, or a value is not
+    a whole number, counting stops and :attr:`overflowed` is set. The data
+    then has to be summarized another way, e.g. with :class:`Moments`.
+
+    :param integral: Whether floating point data is expected to hold only
+                     whole numbers, as for :class:`OrderStatistics`. If not,
+                     only integer data is counted.
+    :param max_bins: The largest range of values that is counted. Defaults
+                     to 4Mi, 32 MiB of counts.
+    """
+
+    def __init__(self, integral=False, max_bins=_MAX_BINS):
+        self.integral = integral
+        self.max_bins = max_bins
+        self.overflowed = False
+        self.low = None
+        self.counts = None
+        self.dtype = None
+
+    def add(self, data):
+        """
+        Counts the values of another block of data.
+
+        :returns: False if the histogram has overflowed, else True.
+        """
+        data = np.asarray(data).ravel()
+        if self.overflowed or not data.size:
+            return not self.overflowed
+        if data.dtype.kind not in 'iu' and not (
+                self.integral and data.dtype.kind == 'f'):
+            return self._overflow()
+
+        low, high = np.min(data), np.max(data)
+        if not (np.isfinite(low) and np.isfinite(high)):
+            return self._overflow()
+        low, high = int(low), int(high)
+        if self.counts is not None:
+            low = min(low, self.low)
+            high = max(high, self.low + len(self.counts) - 1)
+        if high - low + 1 > self.max_bins:
+            return self._overflow()
+
+        offsets = data.astype(np.int64)
+        if data.dtype.kind == 'f' and not np.array_equal(offsets, data):
+            return self._overflow()
+        offsets -= low
+        counts = np.bincount(offsets, minlength=high - low + 1)
+        del offsets
+        if self.counts is not None:
+            start = self.low - low
+            counts[start:start + len(self.counts)] += self.counts
+        else:
+            self.dtype = data.dtype
+        self.low, self.counts = low, counts
+        return True
+
+    def _overflow(self):
+        self.overflowed = True
+        self.low = self.counts = None
+        return False
+
+    def order_statistics(self, scale=1):
+        """
+        Returns the :class:`OrderStatistics` of all the data counted so far,
+        with every value multiplied by ``scale``.
+
+        :raises ValueError: If no data has been counted, or the histogram has
+                            overflowed.
+        """
+        if self.overflowed:
+            raise ValueError('The histogram has overflowed')
+        if self.counts is None:
+            raise ValueError('No data has been added to the histogram')
+        values = np.flatnonzero(self.counts)
+        counts = self.counts[values]
+        values += self.low
+        return OrderStatistics.from_histogram(values.astype(self.dtype),
+                                              counts, scale)
+
+
+class Moments(object):
+    """
+    Streaming summary of data that arrives in blocks: the number of values,
+    their sum, minimum and maximum, and the ``n`` largest and smallest
+    values. Memory use is bounded by ``n``.
+
+    :param n: The number of largest and smallest values kept. Defaults to 5.
+    """
+
+    def __init__(self, n=5):
+        self.n = n
+        self.size = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self._largest = np.empty(0)
+        self._smallest = np.empty(0)
+
+    def add(self, data):
+        """
+        Adds the values of another block of data.
+        """
+        data = np.asarray(data).ravel()
+        if not data.size:
+            return
+        self.size += data.size
+        self.total += np.sum(data, dtype=np.float64)
+        low, high = np.min(data), np.max(data)
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum,
+                                                            high)
+
+        k = min(self.n, data.size)
+        if data.size > 2 * k:
+            data = np.partition(data, [k - 1, data.size - k])
+        else:
+            data = np.sort(data)
+        self._smallest = np.sort(np.concatenate(
+            (self._smallest, data[:k])))[:self.n]
+        self._largest = np.sort(np.concatenate(
+            (self._largest, data[data.size - k:])))[-self.n:]
+
+    @property
+    def mean(self):
+        """
+        Returns the mean of the values.
+        """
+        return self.total / self.size
+
+    def largest(self, n):
+        """
+        Returns the n largest values in ascending order, up to the ``n`` of
+        the moments.
+        """
+        return self._largest[max(len(self._largest) - n, 0):]
+
+    def smallest(self, n):
+        """
+        Returns the n smallest values in ascending order, up to the ``n`` of
+        the moments.
+        """
+        return self._smallest[:n]
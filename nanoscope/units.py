@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import numbers
+import re
+
+from . import metrics
+
+
+__all__ = ['Quantity', 'Unit', 'parse_quantity']
+
+
+_NUMBER_REGEX = re.compile(r'\s*[+-]?((\d+\.?\d*)|(\.\d+)|([nN][aA][nN])|'
+                           r'([iI][nN][fF]([iI][nN][iI][tT][yY])?))'
+                           r'([eE][+-]?\d+)?[.+-]?\s*')
+_TOKEN_REGEX = re.compile(r'(?P<symbol>[^\W\d_]+)(?P<power>-?\d+)?$',
+                          re.UNICODE)
+_SEPARATOR_REGEX = re.compile(r'[\s*.]+')
+_SYMBOL_SPLIT_REGEX = re.compile(r'[\s*./()\d-]+')
+
+_PREFIXES = ('f', 'p', 'n', 'u', 'm', 'c', 'k', 'M', 'G', '')
+_BASES = ('m', 'V', 'A', 'Hz', 's', 'N', 'W', 'Ohm', 'F', 'C', 'g')
+KNOWN_UNITS = frozenset([p + b for p in _PREFIXES for b in _BASES] +
+                        ['deg', 'rad'])
+"""Unit symbols understood without loading astropy."""
+
+INVALID_UNITS = frozenset(['LSB', 'linked'])
+"""Symbols found in Nanoscope headers that astropy does not recognize."""
+
+
+class _UnknownUnit(Exception):
+    """Raised for units that need astropy to be parsed."""
+    pass
+
+
+def _astropy_units():
+    from astropy import units
+    return units
+
+
+class Unit(object):
+    """
+    Lightweight unit made of known unit symbols raised to integer powers.
+    Covers the units found in Nanoscope headers (nm, V, deg, ...) without
+    loading astropy. Anything not implemented here is delegated to the
+    equivalent ``astropy.units.Unit``, which is only imported at that point.
+    """
+    __slots__ = ('powers',)
+
+    def __init__(self, powers=()):
+        powers = dict(powers)
+        self.powers = tuple(sorted(((s, p) for s, p in powers.items() if p),
+                                   key=lambda sp: (-sp[1], sp[0])))
+
+    def _combine(self, other, sign):
+        powers = dict(self.powers)
+        for symbol, power in other.powers:
+            powers[symbol] = powers.get(symbol, 0) + sign * power
+        return Unit(powers)
+
+    def __mul__(self, other):
+        if isinstance(other, Unit):
+            return self._combine(other, 1)
+        return self.to_astropy() * other
+
+    def __truediv__(self, other):
+        if isinstance(other, Unit):
+            return self._combine(other, -1)
+        return self.to_astropy() / other
+
+    __div__ = __truediv__
+
+    def __eq__(self, other):
+        if isinstance(other, Unit):
+            return self.powers == other.powers
+        return self.to_astropy() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.powers)
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return 'Unit("{}")'.format(self.to_string())
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.to_astropy(), name)
+
+    def to_string(self):
+        """
+        Returns the unit in the same generic format as astropy, e.g.
+        ``nm / V`` or ``1 / (V s)``.
+        """
+        def fmt(powers):
+            return ' '.join(s if abs(p) == 1 else '{}{}'.format(s, abs(p))
+                            for s, p in powers)
+        numerator = [sp for sp in self.powers if sp[1] > 0]
+        denominator = sorted((sp for sp in self.powers if sp[1] < 0),
+                             key=lambda sp: (sp[1], sp[0]))
+        if not denominator:
+            return fmt(numerator)
+        string = fmt(numerator) or '1'
+        if len(denominator) == 1:
+            return '{} / {}'.format(string, fmt(denominator))
+        return '{} / ({})'.format(string, fmt(denominator))
+
+    def to_astropy(self):
+        """
+        Returns the equivalent ``astropy.units.Unit``.
+        """
+        return _astropy_units().Unit(self.to_string())
+
+
+class Quantity(object):
+    """
+    Lightweight, immutable stand-in for ``astropy.units.Quantity`` holding a
+    scalar value and a :class:`Unit`. Supports the arithmetic needed to scale
+    image data; any other attribute is delegated to the equivalent astropy
+    quantity.
+    """
+    __slots__ = ('value', 'unit')
+    __array_ufunc__ = None  # make numpy defer to the reflected operators
+
+    def __init__(self, value, unit=None):
+        self.value = float(value)
+        self.unit = Unit() if unit is None else unit
+
+    def _operate(self, other, op, unit_op):
+        if isinstance(other, Quantity):
+            return Quantity(op(self.value, other.value),
+                            unit_op(self.unit, other.unit))
+        if isinstance(other, numbers.Real):
+            return Quantity(op(self.value, other), self.unit)
+        if isinstance(other, Unit):
+            return Quantity(self.value, unit_op(self.unit, other))
+        return NotImplemented
+
+    def __mul__(self, other):
+        result = self._operate(other, lambda a, b: a * b,
+                               lambda a, b: a * b)
+        if result is NotImplemented:
+            return self.to_astropy() * other
+        return result
+
+    def __rmul__(self, other):
+        if isinstance(other, numbers.Real):
+            return Quantity(other * self.value, self.unit)
+        return other * self.to_astropy()
+
+    def __truediv__(self, other):
+        result = self._operate(other, lambda a, b: a / b,
+                               lambda a, b: a / b)
+        if result is NotImplemented:
+            return self.to_astropy() / other
+        return result
+
+    def __rtruediv__(self, other):
+        if isinstance(other, numbers.Real):
+            return Quantity(other / self.value, Unit() / self.unit)
+        return other / self.to_astropy()
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __neg__(self):
+        return Quantity(-self.value, self.unit)
+
+    def __eq__(self, other):
+        if isinstance(other, Quantity):
+            return self.value == other.value and self.unit == other.unit
+        if hasattr(other, 'unit'):
+            return bool(self.to_astropy() == other)
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __str__(self):
+        unit = self.unit.to_string()
+        return '{} {}'.format(self.value, unit) if unit else str(self.value)
+
+    def __repr__(self):
+        return '<Quantity {}>'.format(self.__str__())
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.to_astropy(), name)
+
+    def copy(self):
+        """
+        Returns a copy of the quantity.
+        """
+        return Quantity(self.value, self.unit)
+
+    def to_astropy(self):
+        """
+        Returns the equivalent ``astropy.units.Quantity``.
+        """
+        return _astropy_units().Quantity(self.value, self.unit.to_astropy())
+
+
+def _parse_unit(string):
+    """
+    Parses a unit string of known symbols such as ``nm/V`` or ``1/(V s)``.
+
+    :raises _UnknownUnit: If the string needs astropy to be parsed.
+    """
+    parts = string.split('/')
+    if len(parts) > 2:
+        raise _UnknownUnit(string)
+
+    powers = {}
+    for sign, part in zip((1, -1), parts):
+        part = part.strip()
+        if sign < 0 and part.startswith('(') and part.endswith(')'):
+            part = part[1:-1]
+        tokens = _SEPARATOR_REGEX.split(part.strip())
+        if sign > 0 and tokens == ['1']:
+            continue
+        for token in tokens:
+            m = _TOKEN_REGEX.match(token)
+            if m is None:
+                raise _UnknownUnit(string)
+            symbol = m.group('symbol').replace('µ', 'u')
+            if symbol not in KNOWN_UNITS:
+                raise _UnknownUnit(string)
+            power = int(m.group('power') or 1) * sign
+            powers[symbol] = powers.get(symbol, 0) + power
+    return Unit(powers)
+
+
+@metrics.timed('parse_quantity')
+def parse_quantity(string):
+    """
+    Parses a quantity string such as ``12.95302 nm/V``. Strings made of the
+    common units are returned as a lightweight :class:`Quantity`; anything
+    else is parsed by astropy, which is imported on first use.
+
+    :param string: The quantity string to parse.
+    :returns: A :class:`Quantity` or an ``astropy.units.Quantity``.
+    :raises ValueError: If the string has an invalid unit.
+    :raises TypeError: If the string does not start with a number.
+    """
+    if '[' in string:
+        return _astropy_units().Quantity(string)
+
+    m = _NUMBER_REGEX.match(string)
+    if m is None:
+        raise TypeError('Cannot parse "{}" as a Quantity'.format(string))
+    value = float(m.group().strip())
+    unit = string[m.end():].strip()
+    if not unit:
+        return Quantity(value)
+    if any(s in INVALID_UNITS for s in _SYMBOL_SPLIT_REGEX.split(unit)):
+        raise ValueError('{} is not a valid unit'.format(unit))
+
+    try:
+        return Quantity(value, _parse_unit(unit))
+    except _UnknownUnit:
+        return _astropy_units().Quantity(string)
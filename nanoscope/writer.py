@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Writing Nanoscope files.
+
+A file that was read keeps its original header, so writing it back without
+changes reproduces it byte for byte. Parameters changed in ``config`` are
+written in place of their original lines, and the ``Data offset`` and
+``Data length`` of every image are recalculated::
+
+    import nanoscope
+
+    p = nanoscope.read('./file.000')
+    p.config['_Images']['Height']['Z magnify'] = 0.003
+    p.write('./corrected.000')
+
+Files without an original header, such as those opened from a bundle, get a
+header generated from ``config``. Large files can be written one image at a
+time with :class:`NanoscopeWriter`, which writes the header up front and then
+each image with a single write, or fills it through a memory map::
+
+    from nanoscope.writer import NanoscopeWriter
+
+    with NanoscopeWriter('./new.000', p.config) as writer:
+        writer.write_image('Height', height)
+        amplitude = writer.map_image('Amplitude')
+        amplitude[...] = ...
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+import io
+import numbers
+
+import numpy as np
+import six
+
+from .parameter import (CiaoParameter, format_parameter, format_value,
+                        parse_parameter, _PARAMETER_REGEX)
+
+
+__all__ = ['NanoscopeWriter', 'write']
+
+
+HEADER_ALIGNMENT = 4096
+HEADER_END = '\\*File list end'
+
+_IMAGE_SECTION = 'Ciao image list'
+_IMAGE_KEYS = ('Image Data', 'Description')
+_GROUPS = {'Image Data': 2, 'Z scale': 2, 'Z offset': 2}
+
+
+def write(nanoscope_file, path):
+    """
+    Writes the header and the raw data of every image of the file as a
+    Nanoscope file. Images that have not been loaded yet are loaded first.
+
+    :param nanoscope_file: The NanoscopeFile to write.
+    :param path: The path of the file to write.
+    :raises ValueError: If the file was read with ``header_only``, or an
+                        image's raw data does not fit its header parameters.
+    """
+    if nanoscope_file.header_only:
+        raise ValueError('Cannot write a file that was read without its '
+                         'image data')
+    with NanoscopeWriter(path, nanoscope_file.config,
+                         getattr(nanoscope_file, '_header', None),
+                         nanoscope_file.encoding) as writer:
+        for image_type in writer.image_types:
+            writer.write_image(image_type,
+                               nanoscope_file.image(image_type).raw_data)
+
+
+class NanoscopeWriter(object):
+    """
+    Writes a Nanoscope file one image at a time. The header and the layout
+    of the images are written when the writer is created, and every image
+    not written is left zero-filled.
+
+    :param path: The path of the file to write.
+    :param config: The parsed header, as ``NanoscopeFile.config``. It is not
+                   changed; the header is written with the ``Data offset``
+                   and ``Data length`` of the new layout.
+    :param header: The original header block the config was read from, as
+                   bytes or text. Its lines are kept as they are for every
+                   parameter that was not changed. Defaults to None, which
+                   generates the header from the config.
+    :param encoding: The encoding of the header. Defaults to cp1252.
+    """
+
+    def __init__(self, path, config, header=None, encoding='cp1252'):
+        self.path = path
+        self.encoding = encoding
+        self.image_types = _image_order(config['_Images'])
+        if isinstance(header, bytes):
+            header = header.decode(encoding)
+
+        header_length = config.get('Data length')
+        if not isinstance(header_length, six.integer_types):
+            header_length = 0
+        while True:
+            self.config, end = _layout(config, self.image_types,
+                                       header_length)
+            if header:
+                text = _patch_header(header, self.config, self.image_types)
+            else:
+                text = _generate_header(self.config, self.image_types)
+            block = text.encode(encoding) + b'\x1a'
+            if len(block) <= header_length:
+                break
+            header_length = (-(-len(block) // HEADER_ALIGNMENT) *
+                             HEADER_ALIGNMENT)
+
+        self._file = io.open(path, 'wb')
+        try:
+            self._file.write(block)
+            self._file.write(b'\0' * (header_length - len(block)))
+            self._file.truncate(end)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self._file.close()
+
+    def write_image(self, image_type, data):
+        """
+        Writes the raw data of the image type with a single write.
+
+        :param image_type: The image type, as in ``config['_Images']``.
+        :param data: The raw data, an integer array with the number of lines
+                     and samples per line of the image. Any other integer
+                     type is converted to the type of the image.
+        :raises ValueError: If the data does not have the shape of the image
+                            or has values out of the range of its type.
+        """
+        offset, dtype, shape = self._image(image_type)
+        data = np.asarray(data)
+        if data.shape != shape:
+            raise ValueError('Data of {} must have shape {}'.format(
+                image_type, shape))
+        if data.dtype != dtype:
+            if data.dtype.kind not in 'iu':
+                raise ValueError('Data of {} must be integers'.format(
+                    image_type))
+            if not np.can_cast(data.dtype, dtype) and data.size and (
+                    data.min() < np.iinfo(dtype).min or
+                    data.max() > np.iinfo(dtype).max):
+                raise ValueError('Data of {} does not fit in {} bytes per '
+                                 'pixel'.format(image_type, dtype.itemsize))
+        data = np.ascontiguousarray(data, dtype=dtype)
+        self._file.seek(offset)
+        self._file.write(memoryview(data.reshape(-1).view(np.uint8)))
+
+    def map_image(self, image_type):
+        """
+        Returns a writable memory map of the raw data of the image type, to
+        fill in place. Changes are written when the map is flushed or
+        deleted.
+
+        :param image_type: The image type, as in ``config['_Images']``.
+        """
+        offset, dtype, shape = self._image(image_type)
+        self._file.flush()
+        return np.memmap(self.path, dtype=dtype, mode='r+', offset=offset,
+                         shape=shape)
+
+    def _image(self, image_type):
+        config = self.config['_Images'][image_type]
+        return (config['Data offset'],
+                np.dtype('<i{}'.format(config['Bytes/pixel'])),
+                (config['Number of lines'], config['Samps/line']))
+
+
+def _image_order(images):
+    """
+    Returns the image types in the order of their data in the original file,
+    with images that were not read from a file last.
+    """
+    def key(image_type):
+        offset = images[image_type].get('Data offset')
+        if isinstance(offset, numbers.Integral):
+            return 0, offset
+        return 1, 0
+    return sorted(images, key=key)
+
+
+def _layout(config, image_types, header_length):
+    """
+    Returns a copy of the config with the data of the images placed one after
+    the other after the header, and the end of the last image.
+    """
+    config = dict(config)
+    config['Data length'] = header_length
+    config['_Images'] = dict((k, dict(v))
+                             for k, v in six.iteritems(config['_Images']))
+    end = header_length
+    for image_type in image_types:
+        image = config['_Images'][image_type]
+        length = (image['Bytes/pixel'] * image['Number of lines'] *
+                  image['Samps/line'])
+        image['Data offset'] = end
+        image['Data length'] = length
+        end += length
+    return config, end
+
+
+def _config_value(parameter):
+    """
+    Returns the value that reading the parameter stores in the config.
+    """
+    if parameter.type == 'V' and (parameter.soft_scale or
+                                  parameter.hard_scale):
+        return parameter
+    return parameter.hard_value
+
+
+def _format_entry(key, value, newline):
+    """
+    Returns a generated header line for a config entry.
+    """
+    if isinstance(value, CiaoParameter):
+        return format_parameter(value, group=_GROUPS.get(key)) + newline
+    if hasattr(value, 'unit') and hasattr(value, 'value'):
+        return '\\@{}: V {}{}'.format(key, format_value(value), newline)
+    return '\\{}: {}{}'.format(key, format_value(value), newline)
+
+
+def _format_image(image, newline):
+    """
+    Returns the generated header lines of an image section.
+    """
+    lines = ['\\*{}{}'.format(_IMAGE_SECTION, newline)]
+    for key, value in six.iteritems(image):
+        if key == 'Image Data':
+            lines.append('\\@2:Image Data: S [{}] "{}"{}'.format(
+                image['Image Data'], image.get('Description') or '', newline))
+        elif key not in _IMAGE_KEYS:
+            lines.append(_format_entry(key, value, newline))
+    return lines
+
+
+def _generate_header(config, image_types, newline='\r\n'):
+    """
+    Returns a header generated from the config.
+    """
+    lines = ['\\*File list' + newline]
+    lines.extend(_format_entry(k, v, newline) for k, v in six.iteritems(config)
+                 if k != '_Images')
+    for image_type in image_types:
+        lines.extend(_format_image(config['_Images'][image_type], newline))
+    lines.append(HEADER_END + newline)
+    return ''.join(lines)
+
+
+def _rewrite(line, parameter, value, newline):
+    """
+    Returns the header line with the parameter set to the config value,
+    keeping the group, the scales of the original line and any text after
+    a number taken from the start of its value.
+    """
+    match = _PARAMETER_REGEX.match(line.rstrip('\r'))
+    ciao, group = bool(match.group('ciao')), match.group('group')
+    if isinstance(value, CiaoParameter):
+        return format_parameter(value, ciao, group) + newline
+    if parameter.type == 'P':
+        text = match.group('value').strip().split(' ', 1)
+        if isinstance(parameter.hard_value, (int, float)) and len(text) > 1:
+            value = '{} {}'.format(format_value(value), text[1])
+        else:
+            value = format_value(value)
+        return line[:match.start('value')] + value + newline
+    if parameter.type == 'V' and hasattr(value, 'unit'):
+        return '{}V {}{}'.format(line[:match.start('type')],
+                                 format_value(value), newline)
+    parameter.hard_value = value
+    return format_parameter(parameter, ciao, group) + newline
+
+
+def _sections(lines):
+    """
+    Splits the header lines into ``(header, lines)`` sections, each starting
+    with a section header line.
+    """
+    sections = []
+    for line in lines:
+        if line.startswith('\\*') or not sections:
+            sections.append((line, []))
+        else:
+            sections[-1][1].append(line)
+    return sections
+
+
+def _patch_section(lines, scope, newline, keep_last):
+    """
+    Returns the lines of a section with the parameters changed in the scope
+    rewritten and the ones removed from it dropped. Only the last line of a
+    parameter that appears more than once, which is the one in the config,
+    is compared.
+    """
+    patched = []
+    for line in lines:
+        parameter = parse_parameter(line)
+        key = parameter.parameter
+        if parameter.type == 'S':
+            if key == 'Image Data' and 'Image Data' in scope and (
+                    parameter.internal != scope['Image Data'] or
+                    parameter.external != scope.get('Description')):
+                parameter.internal = scope['Image Data']
+                parameter.external = scope.get('Description')
+                line = _rewrite(line, parameter, parameter, newline)
+        elif key not in scope:
+            continue
+        elif keep_last[key] is line:
+            value = scope[key]
+            if _config_value(parameter) != value:
+                line = _rewrite(line, parameter, value, newline)
+        patched.append(line)
+    return patched
+
+
+def _patch_header(header, config, image_types):
+    """
+    Returns the original header with the changes in the config applied.
+    """
+    text = header[:header.index(HEADER_END)]
+    newline = '\r\n' if '\r\n' in text else '\n'
+    sections = _sections(text.split('\n')[:-1])
+    sections = [(h + '\n', [line + '\n' for line in lines])
+                for h, lines in sections]
+
+    file_lines = {}
+    image_sections = []
+    for section, lines in sections:
+        if section.startswith('\\*' + _IMAGE_SECTION):
+            image_type = None
+            image_lines = {}
+            for line in lines:
+                parameter = parse_parameter(line)
+                if parameter.type == 'S':
+                    if parameter.parameter == 'Image Data':
+                        image_type = parameter.internal
+                else:
+                    image_lines[parameter.parameter] = line
+            image_sections.append((image_type, image_lines))
+        else:
+            for line in lines:
+                parameter = parse_parameter(line)
+                if parameter.type != 'S':
+                    file_lines[parameter.parameter] = line
+
+    output = []
+    written = set()
+    for section, lines in sections:
+        if section.startswith('\\*' + _IMAGE_SECTION):
+            image_type, image_lines = image_sections.pop(0)
+            if image_type not in config['_Images']:
+                continue
+            if not written:
+                output.extend(_new_entries(config, file_lines, newline))
+            written.add(image_type)
+            image = config['_Images'][image_type]
+            output.append(section)
+            output.extend(_patch_section(lines, image, newline, image_lines))
+            output.extend(_new_entries(image, image_lines, newline))
+        else:
+            output.append(section)
+            output.extend(_patch_section(lines, config, newline, file_lines))
+    if not written:
+        output.extend(_new_entries(config, file_lines, newline))
+    for image_type in image_types:
+        if image_type not in written:
+            output.extend(_format_image(config['_Images'][image_type],
+                                        newline))
+    output.append(HEADER_END + newline)
+    return ''.join(output)
+
+
+def _new_entries(scope, lines, newline):
+    """
+    Returns generated lines for the entries of the scope that were not in
+    the original header.
+    """
+    return [_format_entry(k, v, newline) for k, v in six.iteritems(scope)
+            if k not in lines and k not in _IMAGE_KEYS and k != '_Images']
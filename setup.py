@@ -42,6 +42,7 @@ requirements = [
     'numpy>=1.9,<1.11',
     'six>=1.8,<2',
     'astropy>=1.3,<2.0',
+    'futures>=3.0; python_version < "3"',
 ]
 
 
@@ -55,6 +56,10 @@ setup(
     author_email='jonathan.r.marini@gmail.com',
     packages=['nanoscope'],
     install_requires=requirements,
+    extras_require={'render': ['Pillow']},
+    entry_points={
+        'console_scripts': ['nanoscope = nanoscope.cli:main'],
+    },
     test_suite='tests',
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import sys
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import nanoscope
+from nanoscope import error, read
+
+if sys.version_info >= (3, 6):
+    import asyncio
+
+    from nanoscope import aio
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def collect(generator, limit=None):
+    """
+    Returns the items of an asynchronous generator, stopping after ``limit``
+    items.
+    """
+    items = []
+    loop = asyncio.new_event_loop()
+    try:
+        while limit is None or len(items) < limit:
+            try:
+                items.append(loop.run_until_complete(generator.__anext__()))
+            except StopAsyncIteration:
+                break
+        loop.run_until_complete(generator.aclose())
+    finally:
+        loop.close()
+    return items
+
+
+class AsyncPaths(object):
+    """
+    Asynchronous iterable of paths, written without async syntax so that
+    this module still compiles on Python 2.
+    """
+
+    def __init__(self, paths):
+        self.paths = iter(paths)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = aio._running_loop().create_future()
+        try:
+            future.set_result(next(self.paths))
+        except StopIteration:
+            future.set_exception(StopAsyncIteration())
+        return future
+
+
+@unittest.skipIf(sys.version_info < (3, 6), 'asyncio API needs Python 3.6')
+class TestAio(unittest.TestCase):
+
+    path = './tests/files/full_multiple_images.txt'
+
+    def setUp(self):
+        self.original = (aio.read, aio._read_bytes)
+
+    def tearDown(self):
+        aio.read, aio._read_bytes = self.original
+
+    def test_aread(self):
+        expected = read(self.path)
+        actual = run(nanoscope.aread(self.path))
+        self.assertEqual(actual.config, expected.config)
+        self.assertEqual(sorted(actual.images), ['Amplitude', 'Height'])
+        for image_type in expected.image_types():
+            np.testing.assert_array_equal(
+                actual.image(image_type).raw_data,
+                expected.image(image_type).raw_data)
+        self.assertEqual(actual.height.process().summary(),
+                         expected.height.process().summary())
+
+    def test_aread_channels(self):
+        actual = run(nanoscope.aread(self.path, channels=['Height']))
+        self.assertEqual(list(actual.images), ['Height'])
+        # other channels are loaded on first access
+        np.testing.assert_array_equal(actual.amplitude.raw_data,
+                                      read(self.path).amplitude.raw_data)
+
+    def test_aread_header_only(self):
+        actual = run(nanoscope.aread(self.path, header_only=True))
+        self.assertTrue(actual.header_only)
+        self.assertEqual(actual.images, {})
+
+    def test_aread_errors(self):
+        with self.assertRaises(EnvironmentError):
+            run(nanoscope.aread('./tests/files/missing.spm'))
+
+    def test_aread_many(self):
+        paths = [self.path, './tests/files/missing.spm', self.path]
+        results = collect(nanoscope.aread_many(paths, concurrency=2))
+        self.assertEqual([r.path for r in results], paths)
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, EnvironmentError)
+        self.assertIsNone(results[1].file)
+        np.testing.assert_array_equal(results[2].file.height.raw_data,
+                                      read(self.path).height.raw_data)
+
+    def test_aread_many_unordered(self):
+        paths = [self.path] * 5 + ['./tests/files/reference_raw.csv']
+        results = collect(nanoscope.aread_many(paths, ordered=False))
+        self.assertEqual(sorted(r.path for r in results), sorted(paths))
+        errors = [r.error for r in results if r.error is not None]
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], error.Error)
+
+    def test_aread_many_async_paths(self):
+        results = collect(nanoscope.aread_many(AsyncPaths([self.path] * 3)))
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(r.error is None for r in results))
+
+    def test_reads_overlap(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+        read_bytes = aio._read_bytes
+
+        def slow_read_bytes(*args):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            try:
+                return read_bytes(*args)
+            finally:
+                with lock:
+                    state['running'] -= 1
+        aio._read_bytes = slow_read_bytes
+
+        results = collect(nanoscope.aread_many([self.path] * 8,
+                                               concurrency=4))
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertGreater(state['peak'], 2)
+        self.assertLessEqual(state['peak'], 4)
+
+    def test_back_pressure(self):
+        started = []
+
+        def counting_read(path, *args, **kwargs):
+            started.append(path)
+            return self.original[0](path, *args, **kwargs)
+        aio.read = counting_read
+
+        results = collect(nanoscope.aread_many([self.path] * 10,
+                                               concurrency=3), limit=1)
+        self.assertEqual(len(results), 1)
+        self.assertLessEqual(len(started), 3)
+
+    def test_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            collect(nanoscope.aread_many([self.path], concurrency=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent import futures
+
+import numpy as np
+
+from nanoscope import error, read, read_many
+from nanoscope.batch import imap, prefetch
+
+
+class TestReadMany(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.invalid = os.path.join(cls.directory, 'invalid.000')
+        with open(cls.invalid, 'wb') as f:
+            f.write(b'\\*File list\r\n\\Version: 0x00000000\r\n'
+                    b'\\*File list end\r\n')
+        cls.missing = os.path.join(cls.directory, 'missing.000')
+        cls.valid = './tests/files/full_multiple_images.txt'
+        cls.paths = [cls.valid, cls.invalid, cls.missing, cls.valid]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def check_results(self, results):
+        self.assertEqual(self.paths, [r.path for r in results])
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].file)
+        self.assertIsInstance(results[1].error, error.UnsupportedVersion)
+        self.assertIsInstance(results[2].error, EnvironmentError)
+        expected = read(self.valid).height.raw_data
+        np.testing.assert_array_equal(expected, results[3].file.height.raw_data)
+
+    def test_thread(self):
+        results = list(read_many(self.paths, workers=2))
+        self.check_results(results)
+
+    def test_process(self):
+        results = list(read_many(self.paths, workers=2, executor='process'))
+        self.check_results(results)
+
+    def test_process_lazy_channels(self):
+        results = list(read_many([self.valid], workers=1, executor='process',
+                                 channels=['Height'], mmap=True))
+        self.assertEqual(['Height'], list(results[0].file.images.keys()))
+        self.assertIsNotNone(results[0].file.amplitude)
+
+    def test_existing_executor(self):
+        with futures.ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(read_many(self.paths, executor=pool))
+        self.check_results(results)
+
+    def test_unordered(self):
+        results = list(read_many(self.paths, workers=2, ordered=False,
+                                 header_only=True))
+        self.assertEqual(sorted(self.paths), sorted(r.path for r in results))
+
+    def test_invalid_executor(self):
+        with self.assertRaises(ValueError):
+            read_many(self.paths, executor='fiber')
+
+    def test_missing_parameter(self):
+        path = os.path.join(self.directory, 'no_scan_size.000')
+        with open(self.valid, 'rb') as f:
+            data = f.read().replace(b'\\Scan size: 2 2', b'\\Scan area: 2 2')
+        with open(path, 'wb') as f:
+            f.write(data)
+        results = list(read_many([path, self.valid], workers=2))
+        self.assertIsNone(results[0].file)
+        self.assertIsInstance(results[0].error, error.MissingParameter)
+        self.assertIsInstance(results[0].error, error.InvalidParameter)
+        self.assertIn('Scan size', str(results[0].error))
+        self.assertIsNone(results[1].error)
+
+    def test_imap(self):
+        self.assertEqual([1, 4, 9], list(imap(abs, [1, -4, 9], workers=2)))
+        self.assertEqual([0, 1, 4, 9], sorted(imap(
+            np.square, range(4), workers=2, executor='process',
+            ordered=False)))
+
+    def test_prefetch(self):
+        prefetcher = prefetch(self.paths)
+        results = list(prefetcher)
+        self.check_results(results)
+        self.assertEqual(results[0].file.image_types(),
+                         ['Height', 'Amplitude'])
+        self.assertEqual(sorted(results[0].file.images),
+                         ['Amplitude', 'Height'])
+        with self.assertRaises(ValueError):
+            iter(prefetcher)
+
+    def test_prefetch_channels(self):
+        results = list(prefetch([self.valid], channels=['Height']))
+        p = results[0].file
+        self.assertEqual(list(p.images), ['Height'])
+        np.testing.assert_array_equal(p.amplitude.raw_data,
+                                      read(self.valid).amplitude.raw_data)
+        p = list(prefetch([self.valid], header_only=True))[0].file
+        self.assertTrue(p.header_only)
+        self.assertEqual(p.images, {})
+
+    def test_prefetch_bounds(self):
+        size = 2 * 512 * 512 * 2
+        prefetcher = prefetch([self.valid] * 6, depth=3,
+                              max_bytes=2 * size)
+        peak = []
+        for result in prefetcher:
+            time.sleep(0.02)  # let the I/O thread fill up
+            with prefetcher._condition:
+                peak.append((len(prefetcher._queue), prefetcher._buffered))
+        self.assertLessEqual(max(queued for queued, _ in peak), 3)
+        self.assertLessEqual(max(buffered for _, buffered in peak), 2 * size)
+        self.assertEqual(max(buffered for _, buffered in peak), 2 * size)
+
+        # a file larger than the cap is read once the others are released
+        results = list(prefetch([self.valid] * 3, max_bytes=1))
+        self.assertTrue(all(r.error is None for r in results))
+
+    def test_prefetch_stats(self):
+        prefetcher = prefetch([self.valid] * 4)
+        for result in prefetcher:
+            time.sleep(0.02)
+        stats = prefetcher.stats()
+        self.assertEqual(stats.files, 4)
+        self.assertEqual(stats.bytes, 4 * 2 * 512 * 512 * 2)
+        self.assertGreaterEqual(stats.compute_seconds, 0.08)
+        self.assertLessEqual(stats.compute_seconds + stats.wait_seconds,
+                             stats.elapsed)
+        self.assertGreater(stats.compute_utilization, 0.5)
+        self.assertGreater(stats.io_seconds, 0)
+
+    def test_prefetch_close(self):
+        threads = threading.active_count()
+        with prefetch([self.valid] * 100, depth=1) as prefetcher:
+            for result in prefetcher:
+                break
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(prefetcher.stats().files, 1)
+        with self.assertRaises(ValueError):
+            prefetch(self.paths, depth=0)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from nanoscope import error, load_bundle, read
+from nanoscope.bundle import ALIGNMENT
+
+
+class TestBundle(unittest.TestCase):
+
+    path = './tests/files/full_multiple_images.txt'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.directory, 'file.nsb')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        original = read(self.path)
+        original.height.process()
+        original.amplitude.flatten(dtype=np.float32)
+        original.height.height_scale = 10
+        original.save_bundle(self.bundle)
+
+        loaded = load_bundle(self.bundle)
+        self.assertEqual(loaded.config, original.config)
+        self.assertEqual(sorted(loaded.image_types()),
+                         sorted(original.image_types()))
+        for image_type in original.image_types():
+            expected = original.image(image_type)
+            actual = loaded.image(image_type)
+            for name in ('raw_data', 'flat_data', 'converted_data'):
+                array = getattr(actual, name)
+                if getattr(expected, name) is None:
+                    self.assertIsNone(array)
+                    continue
+                self.assertIsInstance(array, np.memmap)
+                self.assertEqual(array.dtype, getattr(expected, name).dtype)
+                self.assertEqual(array.ctypes.data % ALIGNMENT, 0)
+                np.testing.assert_array_equal(array, getattr(expected, name))
+            self.assertEqual(actual.unit, expected.unit)
+            self.assertEqual(actual.height_scale, expected.height_scale)
+        self.assertEqual(loaded.height.summary(), original.height.summary())
+        self.assertEqual(loaded.height._params(loaded.height.converted_data),
+                         original.height._params(
+                             original.height.converted_data))
+
+    def test_read_only_by_default(self):
+        p = read(self.path)
+        p.height.process()
+        p.save_bundle(self.bundle)
+        with self.assertRaises(ValueError):
+            load_bundle(self.bundle).height.converted_data[0, 0] = 1
+        loaded = load_bundle(self.bundle, mode='c')
+        loaded.height.converted_data[0, 0] = 1
+        reloaded = load_bundle(self.bundle)
+        self.assertNotEqual(reloaded.height.converted_data[0, 0], 1)
+
+    def test_shared_arrays(self):
+        p = read(self.path, channels=['Height'])
+        p.height.convert()
+        p.save_bundle(self.bundle)
+        arrays = sum(image.raw_data.nbytes for image in p)
+        arrays += p.height.converted_data.nbytes
+        self.assertLess(os.path.getsize(self.bundle), arrays + 65536)
+        height = load_bundle(self.bundle).height
+        self.assertIs(height.flat_data, height.raw_data)
+        np.testing.assert_array_equal(height.converted_data,
+                                      p.height.converted_data)
+
+    def test_header_only(self):
+        read(self.path, header_only=True).save_bundle(self.bundle)
+        loaded = load_bundle(self.bundle)
+        self.assertTrue(loaded.header_only)
+        self.assertEqual(loaded.image_types(), [])
+        self.assertIn('Height', loaded.config['_Images'])
+
+    def test_invalid(self):
+        with open(self.bundle, 'wb') as f:
+            f.write(b'\\*File list\r\n')
+        with self.assertRaises(error.InvalidBundle):
+            load_bundle(self.bundle)
+
+    def test_truncated(self):
+        read(self.path).save_bundle(self.bundle)
+        with open(self.bundle, 'r+b') as f:
+            f.truncate(os.path.getsize(self.bundle) - 1)
+        with self.assertRaises(error.InvalidBundle):
+            load_bundle(self.bundle)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from nanoscope import read
+from nanoscope.cache import ResultCache, fingerprint
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprint(self):
+        data = np.arange(12, dtype='<i2').reshape(3, 4)
+        self.assertEqual(fingerprint(data), fingerprint(data.copy()))
+        self.assertNotEqual(fingerprint(data), fingerprint(data.reshape(4, 3)))
+        self.assertNotEqual(fingerprint(data), fingerprint(data.astype('<i4')))
+        changed = data.copy()
+        changed[1, 1] += 1
+        self.assertNotEqual(fingerprint(data), fingerprint(changed))
+
+    def test_key(self):
+        self.assertEqual(self.cache.key('abc', 'flatten', 1),
+                         self.cache.key('abc', 'flatten', 1))
+        self.assertNotEqual(self.cache.key('abc', 'flatten', 1),
+                            self.cache.key('abc', 'flatten', 2))
+
+    def test_array(self):
+        key = self.cache.key('abc')
+        self.assertIsNone(self.cache.load_array(key))
+        data = np.arange(6.0).reshape(2, 3)
+        self.cache.save_array(key, data)
+        loaded = self.cache.load_array(key)
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, data)
+        loaded[0, 0] = 100  # copy-on-write
+        np.testing.assert_array_equal(self.cache.load_array(key), data)
+        self.assertEqual(self.cache.info()[:3], (2, 1, 1))
+
+    def test_json(self):
+        key = self.cache.key('abc')
+        self.assertIsNone(self.cache.load_json(key))
+        self.cache.save_json(key, {'Ra': 1.5, 'Pc': 3})
+        self.assertEqual(self.cache.load_json(key), {'Ra': 1.5, 'Pc': 3})
+
+    def test_evicts_least_recently_used(self):
+        data = np.zeros(1000)
+        size = data.nbytes + 128
+        self.cache.max_bytes = 2 * size
+        first, second, third = [self.cache.key(str(i)) for i in range(3)]
+        self.cache.save_array(first, data)
+        self.cache.save_array(second, data)
+        past = time.time() - 60
+        os.utime(self.cache._path(second, '.npy'), (past, past))
+        self.cache.load_array(first)
+        self.cache.save_array(third, data)
+        self.assertIsNotNone(self.cache.load_array(first))
+        self.assertIsNone(self.cache.load_array(second))
+        self.assertIsNotNone(self.cache.load_array(third))
+        self.assertLessEqual(self.cache.info().size, self.cache.max_bytes)
+
+    def test_save_tracks_size(self):
+        listed = []
+        entries = self.cache._entries
+        self.cache._entries = lambda: listed.append(1) or entries()
+        data = np.zeros(1000)
+        self.cache.max_bytes = 2 * (data.nbytes + 128)
+        first, second = self.cache.key('first'), self.cache.key('second')
+        self.cache.save_array(first, data)
+        for _ in range(5):
+            # replacing an entry does not count it twice
+            self.cache.save_array(second, data)
+        self.assertEqual(1, len(listed))
+        self.assertIsNotNone(self.cache.load_array(first))
+        self.assertEqual(2, self.cache.info().entries)
+
+    def test_clear(self):
+        self.cache.save_json(self.cache.key('abc'), 1)
+        self.cache.load_json(self.cache.key('abc'))
+        self.cache.clear()
+        self.assertEqual(self.cache.info(), (0, 0, 0, 0))
+
+    def test_pickle(self):
+        cache = pickle.loads(pickle.dumps(self.cache))
+        self.assertEqual(cache.directory, self.cache.directory)
+
+
+class TestImageResultCache(unittest.TestCase):
+
+    path = './tests/files/full_multiple_images.txt'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResultCache(self.directory)
+        self.expected = read(self.path).height.process()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_warm_run(self):
+        cold = read(self.path, cache=self.cache).height
+        cold.process()
+        summary = cold.summary()
+        pixels = cold.colorize()
+        self.assertEqual(self.cache.hits, 0)
+
+        warm = read(self.path, cache=self.cache, mmap=True).height
+        warm.process()
+        self.assertIsInstance(warm.flat_data, np.memmap)
+        self.assertIsInstance(warm.converted_data, np.memmap)
+        np.testing.assert_array_equal(warm.flat_data, self.expected.flat_data)
+        np.testing.assert_array_equal(warm.converted_data,
+                                      self.expected.converted_data)
+        self.assertEqual(warm.summary(), summary)
+        np.testing.assert_array_equal(warm.colorize(), pixels)
+        self.assertEqual(self.cache.hits, 4)
+
+    def test_summarize(self):
+        summary = read(self.path, cache=self.cache).height.summarize()
+        image = read(self.path, cache=self.cache).height
+        image._flatten_tiles = None  # any recalculation would now fail
+        self.assertEqual(image.summarize(), summary)
+        self.assertEqual(self.cache.hits, 1)
+        read(self.path, cache=self.cache).height.summarize(order=2)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_parameters_are_part_of_the_key(self):
+        read(self.path, cache=self.cache).height.process()
+        image = read(self.path, cache=self.cache).height
+        image.process(order=2)
+        self.assertEqual(self.cache.hits, 0)
+        image.process(dtype=np.float32)
+        self.assertEqual(self.cache.hits, 0)
+        self.assertEqual(image.converted_data.dtype, np.float32)
+
+    def test_raw_data_is_part_of_the_key(self):
+        read(self.path, cache=self.cache).height.process()
+        image = read(self.path, cache=self.cache).height
+        image.raw_data = image.raw_data.copy()
+        image.raw_data[0, 0] += 1
+        image.process()
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_replaced_raw_data(self):
+        image = read(self.path, cache=self.cache).height
+        image.process()
+        image.raw_data = image.raw_data[::-1].copy()
+        image.process()
+        expected = read(self.path).height
+        expected.raw_data = expected.raw_data[::-1].copy()
+        expected.process()
+        self.assertEqual(self.cache.hits, 0)
+        np.testing.assert_array_equal(image.flat_data, expected.flat_data)
+        np.testing.assert_array_equal(image.converted_data,
+                                      expected.converted_data)
+        self.assertEqual(image.summary(), expected.summary())
+
+    def test_inplace_and_out(self):
+        read(self.path, cache=self.cache).height.process()
+        image = read(self.path, cache=self.cache).height
+        out = np.empty(image.raw_data.shape)
+        image.process(out=out, keep=())
+        self.assertEqual(self.cache.hits, 2)
+        self.assertIs(image.converted_data, out)
+        np.testing.assert_array_equal(out, self.expected.converted_data)
+
+    def test_unknown_data_is_not_cached(self):
+        image = read(self.path, cache=self.cache).height
+        image.flat_data = self.expected.flat_data.copy()
+        image.convert()
+        image.summary()
+        self.assertEqual(self.cache.info().entries, 0)
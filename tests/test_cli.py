@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import csv
+import errno
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from nanoscope import cli, load_bundle, read
+
+
+class TestCli(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        source = './tests/files/full_multiple_images.txt'
+        os.makedirs(os.path.join(cls.directory, 'scans', 'nested'))
+        cls.first = os.path.join(cls.directory, 'scans', 'a.spm')
+        cls.second = os.path.join(cls.directory, 'scans', 'nested', 'b.spm')
+        cls.invalid = os.path.join(cls.directory, 'scans', 'c.spm')
+        shutil.copy(source, cls.first)
+        shutil.copy(source, cls.second)
+        with open(cls.invalid, 'wb') as f:
+            f.write(b'junk\r\n')
+        with open(os.path.join(cls.directory, 'scans', 'notes.txt'),
+                  'wb') as f:
+            f.write(b'not a scan\n')
+        cls.expected = read(source).height.process()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def run_cli(self, *argv):
+        stdout = io.StringIO()
+        status = cli.main(list(argv), stdout=stdout)
+        return status, stdout.getvalue()
+
+    def test_expand(self):
+        scans = os.path.join(self.directory, 'scans')
+        self.assertEqual([self.first, self.invalid, self.second],
+                         list(cli._expand([scans], ['*.spm'])))
+        self.assertEqual([self.first, self.invalid],
+                         list(cli._expand([os.path.join(scans, '*.spm')],
+                                          ['*'])))
+        self.assertEqual(['missing.spm'],
+                         list(cli._expand(['missing.spm'], ['*'])))
+
+    def test_default_patterns(self):
+        _, output = self.run_cli('info', os.path.join(self.directory,
+                                                      'scans'))
+        paths = set(r['path'] for r in csv.DictReader(io.StringIO(output)))
+        self.assertEqual(set([self.first, self.invalid, self.second]), paths)
+
+    def test_error_truncated(self):
+        message = cli._error(ValueError('x' * 500 + '\nsecond line'))
+        self.assertEqual(cli._MAX_ERROR, len(message))
+        self.assertTrue(message.startswith('ValueError: xxx'))
+        self.assertTrue(message.endswith('...'))
+        self.assertEqual('ValueError: bad', cli._error(ValueError('bad')))
+
+    def test_broken_pipe(self):
+        class Closed(io.StringIO):
+            def write(self, text):
+                raise IOError(errno.EPIPE, 'Broken pipe')
+
+        status = cli.main(['info', self.first, self.invalid],
+                          stdout=Closed())
+        self.assertEqual(0, status)
+
+    def test_info_csv(self):
+        status, output = self.run_cli('info', self.first, self.invalid,
+                                      '--channels', 'Height,Phase')
+        self.assertEqual(1, status)
+        rows = list(csv.DictReader(io.StringIO(output)))
+        self.assertEqual(['Height', ''], [r['channel'] for r in rows])
+        self.assertEqual('512', rows[0]['lines'])
+        self.assertEqual('0x05120130', rows[0]['version'])
+        self.assertEqual('', rows[0]['error'])
+        self.assertEqual(self.invalid, rows[1]['path'])
+        self.assertIn('InvalidParameter', rows[1]['error'])
+
+    def test_stats_ndjson_parallel(self):
+        status, output = self.run_cli(
+            'stats', os.path.join(self.directory, 'scans'), '-j', '2',
+            '--pattern', '*.spm', '--channels', 'Height', '--format',
+            'ndjson')
+        self.assertEqual(1, status)
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual([self.first, self.invalid, self.second],
+                         [r['path'] for r in rows])
+        for row in (rows[0], rows[2]):
+            self.assertEqual('nm', row['unit'])
+            self.assertAlmostEqual(self.expected.Ra, row['Ra'], delta=1e-9)
+            self.assertAlmostEqual(self.expected.Rz, row['Rz'], delta=1e-9)
+            self.assertEqual(self.expected.Pc, row['Pc'])
+        self.assertNotIn('Ra', rows[1])
+
+    def test_render_ppm(self):
+        output_directory = os.path.join(self.directory, 'render')
+        status, output = self.run_cli('render', self.first, '-o',
+                                      output_directory, '--channels',
+                                      'Height', '--image-format', 'ppm')
+        self.assertEqual(0, status)
+        row = list(csv.DictReader(io.StringIO(output)))[0]
+        with open(row['output'], 'rb') as f:
+            self.assertEqual(b'P6\n512 512\n255\n', f.read(15))
+            pixels = np.frombuffer(f.read(), dtype=np.uint8)
+        np.testing.assert_array_equal(pixels.reshape(512, 512, 3),
+                                      self.expected.colorize())
+
+    def test_convert_bundle(self):
+        output_directory = os.path.join(self.directory, 'bundles')
+        status, output = self.run_cli('convert', self.first, '-o',
+                                      output_directory, '--channels',
+                                      'Height')
+        self.assertEqual(0, status)
+        row = list(csv.DictReader(io.StringIO(output)))[0]
+        bundle = load_bundle(row['output'])
+        self.assertEqual(['Height'], bundle.image_types())
+        np.testing.assert_array_equal(bundle.height.converted_data,
+                                      self.expected.converted_data)
+
+    def test_convert_npy(self):
+        output_directory = os.path.join(self.directory, 'npy')
+        status, output = self.run_cli('convert', self.first, '-o',
+                                      output_directory, '--to', 'npy',
+                                      '--order', '2')
+        self.assertEqual(0, status)
+        rows = list(csv.DictReader(io.StringIO(output)))
+        self.assertEqual(['Height', 'Amplitude'], [r['channel'] for r in rows])
+        expected = read(self.first).height.process(order=2)
+        np.testing.assert_array_equal(np.load(rows[0]['output']),
+                                      expected.converted_data)
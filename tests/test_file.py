@@ -340,6 +340,52 @@ class TestNanoscopeFile(unittest.TestCase):
         f.close()
         self.assertDictEqual(parsed_data, p.config)
 
+    def test_read_header_small_chunks(self):
+        class SmallChunkFile(NanoscopeFile):
+            header_chunk_size = 7
+
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252', header_only=True)
+        with io.open('./tests/files/full_multiple_images.txt', 'rb') as f:
+            p = SmallChunkFile(f, encoding='cp1252', header_only=True)
+        self.assertDictEqual(expected.config, p.config)
+
+    def test_read_header_ignores_data_after_end(self):
+        file_data = ('\\*File list\n'
+                     '\\Version: 0x05120130\n'
+                     '\\*File list end\n'
+                     'not a parameter\n')
+        f = six.StringIO(file_data)
+        p = NanoscopeFile(f)
+        f.close()
+        self.assertDictEqual({'Version': '0x05120130', '_Images': {}},
+                             p.config)
+
+    def test_read_header_not_nanoscope(self):
+        f = io.BytesIO(b'x,y,z\n' + b'1,2,3\n' * 100000)
+        with self.assertRaises(error.InvalidParameter) as context:
+            NanoscopeFile(f, header_only=True)
+        self.assertEqual(context.exception.parameter, 'x,y,z')
+        self.assertLessEqual(f.tell(), NanoscopeFile.header_chunk_size)
+
+    def test_read_header_stops_at_data_length(self):
+        file_data = ('\\*File list\n'
+                     '\\Version: 0x05120130\n'
+                     '\\Data length: 74\n'
+                     '\\Text: \n' + '\\Text: \n' * 10000)
+        f = six.StringIO(file_data)
+        p = NanoscopeFile(f, header_only=True)
+        self.assertEqual(len(p._header), 74)
+
+    def test_read_header_size_limit(self):
+        class SmallHeaderFile(NanoscopeFile):
+            header_chunk_size = 7
+            max_header_size = 1004
+
+        f = io.BytesIO(b'\\*File list\n' + b'\\Text: \n' * 10000)
+        p = SmallHeaderFile(f, header_only=True)
+        self.assertEqual(len(p._header), 1004)
+
     def test_read_filename(self):
         p = read('./tests/files/full_multiple_images.txt', encoding='cp1252')
         self.assertIsNotNone(p.height)
@@ -385,6 +431,78 @@ class TestNanoscopeFile(unittest.TestCase):
                     msg='@ ({0}, {1}) '
                         '0x{2:X}'.format(i, j, get_loc(i, j)))
 
+    def test_read_mmap(self):
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252')
+        p = read('./tests/files/full_multiple_images.txt', encoding='cp1252',
+                 mmap=True)
+        self.assertIsInstance(p.height.raw_data, np.memmap)
+        self.assertFalse(p.height.raw_data.flags.writeable)
+        self.assertEqual(expected.height.raw_data.dtype,
+                         p.height.raw_data.dtype)
+        np.testing.assert_array_equal(expected.height.raw_data,
+                                      p.height.raw_data)
+        np.testing.assert_array_equal(expected.amplitude.raw_data,
+                                      p.amplitude.raw_data)
+
+    def test_read_file_object_mmap(self):
+        with io.open('./tests/files/full_multiple_images.txt', 'rb') as f:
+            p = read(f, encoding='cp1252', mmap=True)
+        self.assertIsInstance(p.height.raw_data, np.memmap)
+        self.assertEqual((512, 512), p.height.raw_data.shape)
+
+    def test_read_bytes_io_mmap(self):
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252')
+        with io.open('./tests/files/full_multiple_images.txt', 'rb') as f:
+            data = io.BytesIO(f.read())
+        # nothing to map, so the data is read instead
+        p = read(data, encoding='cp1252', mmap=True, channels=['Height'])
+        self.assertNotIsInstance(p.height.raw_data, np.memmap)
+        np.testing.assert_array_equal(expected.height.raw_data,
+                                      p.height.raw_data)
+        np.testing.assert_array_equal(expected.amplitude.raw_data,
+                                      p.amplitude.raw_data)
+
+    def test_read_channels(self):
+        p = read('./tests/files/full_multiple_images.txt', encoding='cp1252',
+                 channels=['Height'])
+        self.assertEqual(['Height'], list(p.images.keys()))
+        self.assertEqual(['Height', 'Amplitude'], p.image_types())
+
+    def test_read_channels_lazy(self):
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252')
+        p = read('./tests/files/full_multiple_images.txt', encoding='cp1252',
+                 channels=[])
+        self.assertEqual({}, p.images)
+        np.testing.assert_array_equal(expected.amplitude.raw_data,
+                                      p.amplitude.raw_data)
+        self.assertEqual(['Amplitude'], list(p.images.keys()))
+        self.assertIsNone(p.phase)
+
+    def test_read_channels_lazy_mmap(self):
+        p = read('./tests/files/full_multiple_images.txt', encoding='cp1252',
+                 mmap=True, channels=['Height'])
+        self.assertIsInstance(p.amplitude.raw_data, np.memmap)
+
+    def test_read_channels_lazy_open_file_object(self):
+        with io.open('./tests/files/full_multiple_images.txt', 'rb') as f:
+            data = f.read()
+        f = io.BytesIO(data)
+        p = NanoscopeFile(f, encoding='cp1252', channels=[])
+        self.assertIsNotNone(p.height)
+        f.close()
+        with self.assertRaises(ValueError):
+            p.amplitude
+
+    def test_describe_images_lazy(self):
+        p = read('./tests/files/full_multiple_images.txt', encoding='cp1252',
+                 channels=[])
+        self.assertEqual([('Height', 'Height'), ('Amplitude', 'Amplitude')],
+                         p.describe_images())
+        self.assertEqual({}, p.images)
+
     def test_iterate_images(self):
         p = read('./tests/files/full_multiple_images.txt', encoding='cp1252')
         images = [image for image in p]
@@ -33,6 +33,23 @@ class TestNanoscopeImage(unittest.TestCase):
                     msg='@ ({0}, {1}) '
                         '0x{2:X}'.format(i, j, self.get_loc(i, j)))
 
+    def test_flatten_matches_polyfit(self):
+        raw_data = self.height.raw_data[:16]
+        x = np.arange(raw_data.shape[1])
+        expected = np.round([line - np.polyval(np.polyfit(x, line, 2), x)
+                             for line in raw_data])
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        image.raw_data = raw_data
+        actual = image.flatten(order=2).flat_data
+        np.testing.assert_array_equal(actual, expected)
+
+    def test_flatten_cache_is_bounded(self):
+        cls = type(self.height)
+        for samples in range(2, cls._flatten_cache_size + 12):
+            cls._flatten_basis(samples, 1)
+        self.assertLessEqual(len(cls._flatten_cache), cls._flatten_cache_size)
+
     def test_convert_height_data(self):
         expected = np.loadtxt('./tests/files/reference_converted.csv',
                               delimiter=',')
@@ -60,6 +77,27 @@ class TestNanoscopeImage(unittest.TestCase):
                         msg='@ ({0}, {1}) '
                             '0x{2:X}'.format(i, j, self.get_loc(i, j)))
 
+    def test_colorize_matches_colortable(self):
+        colors = self.height.supported_colortables[12]
+        scale = self.height.height_scale
+        data = self.height.converted_data[::-1]
+        expected = np.dstack([colors[c]((data + (scale / 2)) / scale)
+                              for c in 'rgb']).astype(np.uint8)
+        actual = self.height.colorize()
+        np.testing.assert_array_equal(actual, expected)
+
+    def test_colorize_output_buffer(self):
+        num_lines, num_columns = self.height.converted_data.shape
+        out = np.zeros((num_lines, num_columns, 3), dtype=np.uint8)
+        actual = self.height.colorize(out=out)
+        self.assertIs(actual, out)
+        np.testing.assert_array_equal(out, self.height.colorize())
+
+    def test_colorize_output_buffer_invalid(self):
+        out = np.zeros((1, 1, 3), dtype=np.uint8)
+        with self.assertRaises(ValueError):
+            self.height.colorize(out=out)
+
     def test_colorize_invalid(self):
         with self.assertRaises(ValueError,
                                msg='Colortable 0 is not currently supported'):
@@ -125,3 +163,229 @@ class TestNanoscopeImage(unittest.TestCase):
         expected = self.height.mean_peak + self.height.mean_valley
         actual = self.height.mean_total_roughness
         self.assertAlmostEqual(actual, expected, delta=0.001)
+
+    def test_summary(self):
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252').height.process()
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height.process()
+        actual = image.summary()
+        for key in ('Ra', 'Rq', 'Rp', 'Rv', 'Rt', 'Rpm', 'Rvm', 'Rz', 'Pc',
+                    'Pd', 'HSC', 'LSC', 'mean_height', 'min_height',
+                    'max_height'):
+            self.assertAlmostEqual(getattr(expected, key), actual[key],
+                                   delta=1e-9, msg=key)
+
+    def test_process_float32(self):
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252').height.process()
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        image.process(dtype=np.float32)
+        self.assertEqual(image.flat_data.dtype, np.float32)
+        self.assertEqual(image.converted_data.dtype, np.float32)
+        np.testing.assert_array_equal(image.flat_data, expected.flat_data)
+        np.testing.assert_allclose(image.converted_data,
+                                   expected.converted_data, rtol=1e-6)
+        self.assertAlmostEqual(image.Ra, expected.Ra, delta=1e-4)
+        self.assertAlmostEqual(image.Rz, expected.Rz, delta=1e-4)
+
+    def test_process_keep_nothing(self):
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252').height.process()
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        out = np.empty(image.raw_data.shape, dtype=np.float32)
+        image.process(out=out, keep=())
+        self.assertIsNone(image.raw_data)
+        self.assertIsNone(image.flat_data)
+        self.assertIs(image.converted_data, out)
+        np.testing.assert_allclose(out, expected.converted_data, rtol=1e-6)
+        self.assertEqual(image.summary()['Pc'], expected.Pc)
+
+    def test_process_keep_unknown(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        with self.assertRaises(ValueError):
+            image.process(keep=('converted',))
+
+    def test_flatten_out(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        out = np.empty(image.raw_data.shape)
+        self.assertIs(image.flatten(out=out).flat_data, out)
+        np.testing.assert_array_equal(out, self.height.flat_data)
+        with self.assertRaises(ValueError):
+            image.flatten(out=np.empty((2, 2)))
+
+    def test_convert_out_and_dtype(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height.flatten()
+        out = np.empty(image.raw_data.shape)
+        self.assertIs(image.convert(out=out).converted_data, out)
+        np.testing.assert_array_equal(out, self.height.converted_data)
+        self.assertIs(image.flat_data.dtype, np.dtype(np.float64))
+        image.convert(dtype=np.float32)
+        self.assertEqual(image.converted_data.dtype, np.float32)
+
+    def test_convert_inplace(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height.flatten()
+        flat = image.flat_data
+        image.convert(inplace=True)
+        self.assertIs(image.converted_data, flat)
+        self.assertIsNone(image.flat_data)
+        np.testing.assert_array_equal(flat, self.height.converted_data)
+        self.assertEqual(image.Rz, self.height.Rz)
+
+    def test_convert_inplace_needs_float_data(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        with self.assertRaises(ValueError):
+            image.convert(inplace=True)
+        image.flatten(dtype=np.float32)
+        with self.assertRaises(ValueError):
+            image.convert(dtype=np.float64, inplace=True)
+
+    def test_flatten_inplace(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        raw_data = image.raw_data.astype(np.float32)
+        image.raw_data = raw_data
+        image.flatten(inplace=True)
+        self.assertIs(image.flat_data, raw_data)
+        self.assertIsNone(image.raw_data)
+        np.testing.assert_array_equal(raw_data, self.height.flat_data)
+
+    def test_flatten_inplace_needs_float_data(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252', mmap=True).height
+        with self.assertRaises(ValueError):
+            image.flatten(inplace=True)
+        image.raw_data = image.raw_data.astype(np.float64)
+        image.raw_data.flags.writeable = False
+        with self.assertRaises(ValueError):
+            image.flatten(inplace=True)
+
+    def test_process_inplace(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        raw_data = image.raw_data.astype(np.float64)
+        image.raw_data = raw_data
+        image.process(inplace=True)
+        self.assertIs(image.converted_data, raw_data)
+        self.assertIsNone(image.raw_data)
+        self.assertIsNone(image.flat_data)
+        np.testing.assert_array_equal(raw_data, self.height.converted_data)
+        self.assertEqual(image.summary(), self.height.summary())
+
+    def test_process_tiled(self):
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252').height.process()
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252', mmap=True).height
+        flat = np.empty(image.raw_data.shape)
+        out = np.empty(image.raw_data.shape)
+        self.assertIs(image.process_tiled(tile_lines=7, out=out,
+                                          flat_out=flat), image)
+        self.assertIs(image.converted_data, out)
+        self.assertIs(image.flat_data, flat)
+        np.testing.assert_array_equal(flat, expected.flat_data)
+        np.testing.assert_array_equal(out, expected.converted_data)
+
+        # statistics were gathered while tiling
+        image.raw_data = image.flat_data = image.converted_data = None
+        actual = image.summary()
+        for key in ('Ra', 'Rq', 'Rp', 'Rv', 'Rt', 'Rpm', 'Rvm', 'Rz', 'Pc',
+                    'Pd', 'HSC', 'LSC', 'mean_height', 'min_height',
+                    'max_height'):
+            self.assertAlmostEqual(getattr(expected, key), actual[key],
+                                   delta=1e-9, msg=key)
+        self.assertEqual(image.percentile(50),
+                         np.percentile(expected.converted_data, 50))
+
+    def test_process_tiled_checks_shape(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        with self.assertRaises(ValueError):
+            image.process_tiled(out=np.empty((3, 3)))
+        with self.assertRaises(ValueError):
+            image.process_tiled(flat_out=np.empty((3, 3)))
+
+    def test_process_tiled_wide_range(self):
+        random = np.random.RandomState(0)
+        raw_data = random.randint(-2 ** 30, 2 ** 30, size=(60, 50))
+        expected = read('./tests/files/full_multiple_images.txt',
+                        encoding='cp1252').height
+        expected.raw_data = raw_data.astype('<i4')
+        expected.bytes_per_pixel = 4
+        expected = expected.process().summary()
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        image.raw_data = raw_data.astype('<i4')
+        image.bytes_per_pixel = 4
+        image.process_tiled(tile_lines=7)
+        # too wide for a histogram, so summarized from the tiles
+        self.assertNotIn('order_statistics', image._cache)
+        actual = image.summary()
+        self.assertEqual(sorted(actual), sorted(expected))
+        for key in expected:
+            np.testing.assert_allclose(
+                actual[key], expected[key], rtol=1e-9,
+                atol=1e-12 * expected['max_height'], err_msg=key)
+
+    def test_summarize(self):
+        for order in (1, 2):
+            expected = read('./tests/files/full_multiple_images.txt',
+                            encoding='cp1252').height.process(order).summary()
+            image = read('./tests/files/full_multiple_images.txt',
+                         encoding='cp1252', mmap=True).height
+            actual = image.summarize(order, tile_lines=100)
+            self.assertIsNone(image.flat_data)
+            self.assertIsNone(image.converted_data)
+            self.assertEqual(sorted(actual), sorted(expected))
+            for key in expected:
+                self.assertAlmostEqual(actual[key], expected[key],
+                                       delta=1e-9, msg=key)
+            self.assertIs(image.summarize(order), actual)
+
+    def test_summarize_raw(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height
+        actual = image.summarize(order=None)
+        image.flat_data = image.raw_data
+        expected = image.convert().summary()
+        for key in expected:
+            self.assertAlmostEqual(actual[key], expected[key], delta=1e-9,
+                                   msg=key)
+
+    def test_summarize_wide_range(self):
+        random = np.random.RandomState(1)
+        raw_data = random.randint(-2 ** 30, 2 ** 30,
+                                  size=(60, 50)).astype('<i4')
+        for order in (None, 1):
+            image = read('./tests/files/full_multiple_images.txt',
+                         encoding='cp1252').height
+            image.raw_data = raw_data
+            image.bytes_per_pixel = 4
+            actual = image.summarize(order, tile_lines=7)
+            if order is None:
+                image.flat_data = raw_data.astype(np.float64)
+                expected = image.convert().summary()
+            else:
+                expected = image.process(order).summary()
+            self.assertEqual(sorted(actual), sorted(expected))
+            for key in expected:
+                np.testing.assert_allclose(
+                    actual[key], expected[key], rtol=1e-9,
+                    atol=1e-12 * expected['max_height'], err_msg=key)
+
+    def test_summary_fills_cache(self):
+        image = read('./tests/files/full_multiple_images.txt',
+                     encoding='cp1252').height.process()
+        image.summary()
+        # any recalculation would now fail
+        image.raw_data = image.flat_data = image.converted_data = None
+        for key in ('Ra', 'Rq', 'Rp', 'Rv', 'Rt', 'Rpm', 'Rvm', 'Rz', 'Pc',
+                    'Pd', 'HSC', 'LSC'):
+            getattr(image, key)
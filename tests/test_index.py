@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from nanoscope.index import Index
+from nanoscope.nanoscope import NanoscopeFile
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'sub'))
+        self.paths = [os.path.join(self.directory, 'a.000'),
+                      os.path.join(self.directory, 'sub', 'b.000')]
+        for path in self.paths:
+            shutil.copy('./tests/files/full_multiple_images.txt', path)
+        for filename in ('notes.txt', 'corrupt.001'):
+            with open(os.path.join(self.directory, filename), 'w') as f:
+                f.write('not a nanoscope file\n')
+        self.index = Index()
+        self.counts = self.index.update(self.directory)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_update(self):
+        self.assertEqual(2, self.counts['added'])
+        self.assertEqual(1, self.counts['skipped'])
+        self.assertEqual(2, len(self.index))
+        self.assertIn(self.paths[0], self.index)
+
+    def test_update_unchanged(self):
+        counts = self.index.update(self.directory)
+        self.assertEqual(2, counts['unchanged'])
+        self.assertEqual(0, counts['added'] + counts['updated'])
+
+    def test_update_modified(self):
+        stat = os.stat(self.paths[0])
+        os.utime(self.paths[0], (stat.st_atime, stat.st_mtime + 10))
+        counts = self.index.update(self.directory)
+        self.assertEqual(1, counts['updated'])
+        self.assertEqual(1, counts['unchanged'])
+
+    def test_update_removed(self):
+        os.remove(self.paths[1])
+        counts = self.index.update(self.directory)
+        self.assertEqual(1, counts['removed'])
+        self.assertEqual([self.paths[0]], self.index.query())
+
+    def test_update_patterns(self):
+        index = Index()
+        counts = index.update(self.directory, patterns=['b.*'])
+        self.assertEqual(1, counts['added'])
+        self.assertEqual(0, counts['skipped'])
+        index.close()
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symbolic links')
+    def test_update_broken_link(self):
+        os.symlink(os.path.join(self.directory, 'gone.000'),
+                   os.path.join(self.directory, 'link.000'))
+        os.remove(self.paths[1])
+        os.symlink(os.path.join(self.directory, 'gone.000'), self.paths[1])
+        counts = self.index.update(self.directory)
+        # the two links and corrupt.001
+        self.assertEqual(3, counts['skipped'])
+        self.assertEqual(1, counts['removed'])
+        self.assertEqual(1, counts['unchanged'])
+        self.assertEqual([self.paths[0]], self.index.query())
+
+    def test_update_all_files(self):
+        index = Index()
+        counts = index.update(self.directory, patterns=['*'])
+        self.assertEqual(2, counts['added'])
+        self.assertEqual(2, counts['skipped'])
+        index.close()
+
+    def test_update_case_sensitive_root(self):
+        directories = [os.path.join(self.directory, name)
+                       for name in ('scans', 'Scans')]
+        for directory in directories:
+            if os.path.exists(directory):
+                self.skipTest('the file system ignores case')
+            os.mkdir(directory)
+            shutil.copy(self.paths[0], os.path.join(directory, 'c.000'))
+        for directory in directories:
+            self.assertEqual(1, self.index.update(directory)['added'])
+        counts = self.index.update(directories[0])
+        self.assertEqual(0, counts['removed'])
+        self.assertEqual(1, counts['unchanged'])
+        for directory in directories:
+            self.assertEqual([os.path.join(directory, 'c.000')],
+                             self.index.query(root=directory))
+
+    def test_persistent(self):
+        path = os.path.join(self.directory, 'index.db')
+        with Index(path) as index:
+            index.update(self.directory, patterns=['*.000'])
+        with Index(path) as index:
+            self.assertEqual(sorted(self.paths), index.query())
+            counts = index.update(self.directory, patterns=['*.000'])
+        self.assertEqual(2, counts['unchanged'])
+
+    def test_query_channel(self):
+        self.assertEqual(sorted(self.paths), self.index.query(channel='Height'))
+        self.assertEqual([], self.index.query(channel='Phase'))
+
+    def test_query_where(self):
+        paths = self.index.query(where={'Serial number': '1965G',
+                                        'Scan size': 2000})
+        self.assertEqual(sorted(self.paths), paths)
+        self.assertEqual([], self.index.query(where={'Scan size': 500}))
+
+    def test_query_where_operator(self):
+        self.assertEqual(sorted(self.paths),
+                         self.index.query(where={'Scan size': ('>', 1000)}))
+        self.assertEqual(sorted(self.paths),
+                         self.index.query(where={'Scanner file':
+                                                 ('like', '1965%')}))
+
+    def test_query_where_invalid_operator(self):
+        with self.assertRaises(ValueError):
+            self.index.query(where={'Scan size': ('~', 1000)})
+
+    def test_query_channel_where(self):
+        paths = self.index.query(channel='Amplitude',
+                                 channel_where={'Z magnify': ('<', 1)})
+        self.assertEqual(sorted(self.paths), paths)
+        paths = self.index.query(channel='Height',
+                                 channel_where={'Z magnify': ('>', 1)})
+        self.assertEqual([], paths)
+
+    def test_query_date(self):
+        date = datetime.datetime(2014, 10, 17)
+        self.assertEqual(sorted(self.paths), self.index.query(since=date))
+        self.assertEqual([], self.index.query(until=date))
+
+    def test_query_root(self):
+        paths = self.index.query(root=os.path.join(self.directory, 'sub'))
+        self.assertEqual([self.paths[1]], paths)
+
+    def test_channels(self):
+        channels = self.index.channels(self.paths[0])
+        self.assertEqual(['Height', 'Amplitude'],
+                         [c['name'] for c in channels])
+        self.assertEqual(40960, channels[0]['data_offset'])
+        self.assertEqual(512, channels[0]['samps_per_line'])
+
+    def test_open(self):
+        files = list(self.index.open(channel='Height'))
+        self.assertEqual(2, len(files))
+        self.assertIsInstance(files[0], NanoscopeFile)
+        self.assertEqual(['Height'], list(files[0].images.keys()))
+        self.assertIsNotNone(files[0].amplitude)
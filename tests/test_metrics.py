@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import shutil
+import tempfile
+import unittest
+
+from nanoscope import metrics, read
+from nanoscope.cache import ResultCache
+from nanoscope.parameter import quantity_cache
+
+
+class TestMetrics(unittest.TestCase):
+
+    path = './tests/files/full_multiple_images.txt'
+
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+
+    def test_disabled(self):
+        metrics.disable()
+        read(self.path).height.process().summary()
+        self.assertFalse(metrics.enabled())
+        self.assertEqual(metrics.snapshot(), {'stages': {}, 'counters': {}})
+
+    def test_stages(self):
+        quantity_cache.clear()
+        p = read(self.path)
+        p.height.process().summary()
+        p.height.colorize()
+        stages = metrics.snapshot()['stages']
+        for stage in ('read', 'read_header', 'parse_quantity', 'flatten',
+                      'convert', 'process', 'summary', 'colorize'):
+            self.assertIn(stage, stages)
+        self.assertEqual(stages['read']['calls'], 1)
+        self.assertEqual(stages['read_image_data']['calls'], 2)
+        self.assertGreaterEqual(stages['read']['seconds'],
+                                stages['read_header']['seconds'])
+        self.assertLessEqual(stages['read']['max_seconds'],
+                             stages['read']['seconds'])
+
+    def test_counters(self):
+        quantity_cache.clear()
+        read(self.path)
+        read(self.path, channels=['Height'])
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['header_lines'], 2 * 523)
+        self.assertEqual(counters['bytes_read'],
+                         2 * 17996 + 3 * 512 * 512 * 2)
+        self.assertGreater(counters['quantity_cache_hits'], 0)
+        self.assertEqual(counters['quantity_cache_misses'],
+                         quantity_cache.info().misses)
+
+    def test_result_cache_counters(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ResultCache(directory)
+            read(self.path, cache=cache).height.process().summary()
+            read(self.path, cache=cache).height.process().summary()
+        finally:
+            shutil.rmtree(directory)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['result_cache_hits'], cache.hits)
+        self.assertEqual(counters['result_cache_misses'], cache.misses)
+
+    def test_hook(self):
+        calls = []
+
+        def hook(stage, seconds):
+            calls.append((stage, seconds))
+        metrics.add_hook(hook)
+        try:
+            read(self.path, header_only=True)
+        finally:
+            metrics.remove_hook(hook)
+        self.assertEqual([stage for stage, _ in calls][-2:],
+                         ['read_header', 'read'])
+        self.assertTrue(all(seconds >= 0 for _, seconds in calls))
+        count = len(calls)
+        read(self.path, header_only=True)
+        self.assertEqual(len(calls), count)
+
+    def test_prometheus(self):
+        read(self.path, header_only=True)
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE nanoscope_stage_seconds_total counter\n', text)
+        self.assertIn('nanoscope_stage_calls_total{stage="read"} 1\n', text)
+        self.assertIn('nanoscope_header_lines_total 523\n', text)
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                float(line.rsplit(' ', 1)[1])
+        self.assertTrue(metrics.to_prometheus('afm').startswith(
+            '# HELP afm_'))
+
+    def test_reset(self):
+        read(self.path, header_only=True)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {'stages': {}, 'counters': {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
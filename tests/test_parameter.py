@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import datetime
+import sys
 import unittest
 
 import six
@@ -112,6 +113,25 @@ class TestParameterParsing(unittest.TestCase):
         self.assertEqual('param', p.header)
 
 
+class TestHeaderParsing(unittest.TestCase):
+
+    def test_parse_header(self):
+        header = six.b('\\*File list\r\n'
+                       '\\Version: 0x05120130\r\n'
+                       '\\*File list end\r\n')
+        expected = [parameter.parse_parameter(line)
+                    for line in header.split(six.b('\n'))[:-1]]
+        actual = list(parameter.parse_header(header))
+        self.assertEqual(expected, actual)
+
+    def test_parse_header_empty(self):
+        self.assertEqual([], list(parameter.parse_header('')))
+
+    def test_parse_header_invalid_line(self):
+        with self.assertRaises(error.InvalidParameter):
+            list(parameter.parse_header('\\*File list\ninvalid\n'))
+
+
 class TestSimpleParameter(unittest.TestCase):
 
     def test_empty_value(self):
@@ -163,6 +183,46 @@ class TestSimpleParameter(unittest.TestCase):
         p = parameter.parse_parameter(r'\param: {0}'.format(value))
         self.assertEqual(value, p.hard_value)
 
+    def test_float_special(self):
+        p = parameter.parse_parameter(r'\param: -inf')
+        self.assertEqual(float('-inf'), p.hard_value)
+
+    def test_integer_separator(self):
+        p = parameter.parse_parameter(r'\param: 1_000')
+        # underscores in numeric literals need Python 3.6 (PEP 515)
+        expected = 1000 if sys.version_info >= (3, 6) else '1_000'
+        self.assertEqual(expected, p.hard_value)
+
+    def test_time_like_string(self):
+        value = '10:27 AM'
+        p = parameter.parse_parameter(r'\param: ' + value)
+        self.assertEqual(value, p.hard_value)
+
+    def test_hex_string(self):
+        value = '0x05120130'
+        p = parameter.parse_parameter(r'\param: ' + value)
+        self.assertEqual(value, p.hard_value)
+
+    def test_schema_version(self):
+        p = parameter.parse_parameter(r'\Version: 0x05120130')
+        self.assertEqual('0x05120130', p.hard_value)
+
+    def test_schema_version_fallback(self):
+        p = parameter.parse_parameter(r'\Version: 5')
+        self.assertEqual(5, p.hard_value)
+
+    def test_schema_date_fallback(self):
+        p = parameter.parse_parameter(r'\Date: None')
+        self.assertIsNone(p.hard_value)
+
+    def test_schema_integer(self):
+        p = parameter.parse_parameter(r'\Samps/line: 512 512')
+        self.assertEqual(512, p.hard_value)
+
+    def test_schema_integer_fallback(self):
+        p = parameter.parse_parameter(r'\Samps/line: 1.5')
+        self.assertEqual(1.5, p.hard_value)
+
     def test_str(self):
         param = 'param'
         hard_value = 'hard_value'
@@ -240,6 +300,51 @@ class TestValueParameter(unittest.TestCase):
             param, soft_scale, hard_scale, value))
 
 
+class TestQuantityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = parameter.QuantityCache(maxsize=2)
+
+    def test_hit(self):
+        first = self.cache.parse('12.95302 nm/V')
+        second = self.cache.parse('12.95302 nm/V')
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.unit, second.unit)
+        self.assertEqual((1, 1), self.cache.info()[:2])
+
+    def test_invalid(self):
+        self.assertIsNone(self.cache.parse('0.006693481 V/LSB'))
+        self.assertIsNone(self.cache.parse('0.006693481 V/LSB'))
+        self.assertEqual((1, 1), self.cache.info()[:2])
+
+    def test_evict_least_recently_used(self):
+        self.cache.parse('1 V')
+        self.cache.parse('2 V')
+        self.cache.parse('1 V')
+        self.cache.parse('3 V')
+        self.cache.parse('1 V')
+        self.cache.parse('2 V')
+        self.assertEqual((2, 4, 2, 2), self.cache.info())
+
+    def test_resize(self):
+        self.cache.parse('1 V')
+        self.cache.parse('2 V')
+        self.cache.resize(1)
+        self.assertEqual((0, 2, 1, 1), self.cache.info())
+
+    def test_clear(self):
+        self.cache.parse('1 V')
+        self.cache.clear()
+        self.assertEqual((0, 0, 2, 0), self.cache.info())
+
+    def test_value_uses_shared_cache(self):
+        hits = parameter.quantity_cache.info().hits
+        parameter.parse_parameter(r'\param: V [soft] (1 V) 2 V')
+        parameter.parse_parameter(r'\param: V [soft] (1 V) 2 V')
+        self.assertEqual(hits + 2, parameter.quantity_cache.info().hits)
+
+
 class TestScaleParameter(unittest.TestCase):
 
     def test_only_soft_scale(self):
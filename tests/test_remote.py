@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import io
+import re
+import threading
+import unittest
+
+import numpy as np
+from six.moves import BaseHTTPServer, socketserver
+
+from nanoscope import error, read
+from nanoscope.remote import ConnectionPool, read_remote
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the files of the server from memory, honoring single byte ranges
+    like an object store.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            return self.respond(404, b'')
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        self.server.ranges.append((self.path, self.headers.get('Range')))
+        if match is None or not self.server.ranges_supported:
+            return self.respond(200, data)
+        start = int(match.group(1))
+        stop = int(match.group(2) or len(data) - 1) + 1
+        if start >= len(data):
+            return self.respond(416, b'')
+        stop = min(stop, len(data))
+        self.respond(206, data[start:stop], {
+            'Content-Range': 'bytes {}-{}/{}'.format(start, stop - 1,
+                                                     len(data))})
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestRemote(unittest.TestCase):
+
+    path = './tests/files/full_multiple_images.txt'
+
+    @classmethod
+    def setUpClass(cls):
+        with io.open(cls.path, 'rb') as f:
+            cls.data = f.read()
+        cls.server = RangeServer(('127.0.0.1', 0), RangeHandler)
+        cls.server.files = {'/scan.000': cls.data}
+        cls.url = 'http://127.0.0.1:{}/scan.000'.format(
+            cls.server.server_address[1])
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.ranges = []
+        self.server.connections = 0
+        self.server.ranges_supported = True
+        self.pool = ConnectionPool()
+        self.expected = read(self.path)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def assertSameImages(self, actual, image_types):
+        for image_type in image_types:
+            np.testing.assert_array_equal(
+                actual.image(image_type).raw_data,
+                self.expected.image(image_type).raw_data)
+        self.assertEqual(sorted(actual.images), sorted(image_types))
+
+    def test_read(self):
+        actual = read_remote(self.url, pool=self.pool)
+        self.assertEqual(actual.config, self.expected.config)
+        self.assertEqual(actual._header, self.expected._header)
+        self.assertSameImages(actual, ['Amplitude', 'Height'])
+        self.assertEqual(actual.height.process().summary(),
+                         self.expected.height.process().summary())
+        # two header ranges up to the data length, then both channels in one
+        # range
+        self.assertEqual([r for _, r in self.server.ranges],
+                         ['bytes=0-16383', 'bytes=16384-40959',
+                          'bytes=40960-1089535'])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_header_only(self):
+        actual = read_remote(self.url, header_only=True, pool=self.pool,
+                             header_chunk_size=4096)
+        self.assertTrue(actual.header_only)
+        self.assertEqual(actual.images, {})
+        self.assertEqual(actual.config, self.expected.config)
+        fetched = [re.match(r'bytes=(\d+)-(\d+)', r).groups()
+                   for _, r in self.server.ranges]
+        self.assertLess(sum(int(stop) + 1 - int(start)
+                            for start, stop in fetched), 64 * 1024)
+
+    def test_channels(self):
+        actual = read_remote(self.url, channels=['Height'], pool=self.pool)
+        self.assertSameImages(actual, ['Height'])
+        self.assertEqual(self.server.ranges[-1][1], 'bytes=40960-565247')
+        # other channels are fetched on first access
+        self.assertSameImages(actual, ['Amplitude', 'Height'])
+        self.assertEqual(self.server.ranges[-1][1], 'bytes=565248-1089535')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_max_gap(self):
+        read_remote(self.url, pool=self.pool, max_gap=-1)
+        self.assertEqual([r for _, r in self.server.ranges][-2:],
+                         ['bytes=40960-565247', 'bytes=565248-1089535'])
+
+    def test_ranges_ignored(self):
+        self.server.ranges_supported = False
+        actual = read_remote(self.url, pool=self.pool)
+        self.assertEqual(actual.config, self.expected.config)
+        self.assertSameImages(actual, ['Amplitude', 'Height'])
+
+    def test_missing(self):
+        with self.assertRaises(IOError):
+            read_remote(self.url.replace('scan', 'missing'), pool=self.pool)
+
+    def test_truncated(self):
+        self.server.files['/short.000'] = self.data[:len(self.data) // 2]
+        try:
+            with self.assertRaises(ValueError):
+                read_remote(self.url.replace('scan', 'short'),
+                            pool=self.pool)
+        finally:
+            del self.server.files['/short.000']
+
+    def test_not_nanoscope(self):
+        self.server.files['/junk.bin'] = b'junk\r\n' * (1 << 20)
+        try:
+            with self.assertRaises(error.InvalidParameter):
+                read_remote(self.url.replace('scan.000', 'junk.bin'),
+                            pool=self.pool)
+        finally:
+            del self.server.files['/junk.bin']
+        self.assertEqual(['bytes=0-16383'],
+                         [r for _, r in self.server.ranges])
+
+    def test_pool(self):
+        for _ in range(3):
+            read_remote(self.url, header_only=True, pool=self.pool)
+        self.assertEqual(self.pool.connections, 1)
+        self.assertEqual(self.pool.requests, len(self.server.ranges))
+        self.pool.close()
+        read_remote(self.url, header_only=True, pool=self.pool)
+        self.assertEqual(self.pool.connections, 2)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_stale_connection(self):
+        read_remote(self.url, header_only=True, pool=self.pool)
+        for connections in self.pool._idle.values():
+            for connection in connections:
+                connection.sock.close()
+        actual = read_remote(self.url, channels=['Height'], pool=self.pool)
+        self.assertSameImages(actual, ['Height'])
+        self.assertEqual(self.pool.connections, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import pickle
+import unittest
+
+import numpy as np
+
+from nanoscope import read
+from nanoscope.shared import (MappedRef, SharedArrays, SharedRef,
+                              process_many, reference, resolve, shared_memory)
+
+
+@unittest.skipIf(shared_memory is None, 'shared memory needs Python 3.8')
+class TestShared(unittest.TestCase):
+
+    path = './tests/files/full_multiple_images.txt'
+
+    def test_shared_arrays(self):
+        with SharedArrays() as arrays:
+            array = arrays.copy(np.arange(12.0).reshape(3, 4))
+            ref = reference(array[1:])
+            self.assertIsInstance(ref, SharedRef)
+            np.testing.assert_array_equal(resolve(ref), array[1:])
+            resolve(ref)[0, 0] = -1
+            self.assertEqual(array[1, 0], -1)
+            self.assertLess(len(pickle.dumps(ref)), 200)
+        # unlinked blocks are still usable but pickled by copying
+        self.assertIs(reference(array), array)
+        self.assertEqual(array.sum(), 61)
+
+    def test_plain_arrays(self):
+        array = np.arange(4)
+        self.assertIs(reference(array), array)
+        self.assertIs(resolve(array), array)
+        self.assertIsNone(reference(None))
+
+    def test_pickle_mapped(self):
+        expected = read(self.path)
+        p = read(self.path, mmap=True)
+        self.assertIsInstance(reference(p.height.raw_data), MappedRef)
+        data = pickle.dumps(p)
+        self.assertLess(len(data), 64 * 1024)
+        self.assertGreater(len(pickle.dumps(expected)), 1024 * 1024)
+        actual = pickle.loads(data)
+        for image_type in expected.image_types():
+            np.testing.assert_array_equal(
+                actual.image(image_type).raw_data,
+                expected.image(image_type).raw_data)
+
+    def test_pickle_shared(self):
+        p = read(self.path)
+        with SharedArrays() as arrays:
+            image = p.height
+            image.raw_data = arrays.copy(image.raw_data)
+            image.flatten(out=arrays.empty(image.raw_data.shape))
+            image.convert(out=arrays.empty(image.raw_data.shape))
+            image.summary()
+            data = pickle.dumps(image)
+            self.assertLess(len(data), 64 * 1024)
+            actual = pickle.loads(data)
+        self.assertIs(actual._conversion[0], actual.flat_data)
+        self.assertEqual(actual._params(actual.flat_data),
+                         ('flatten', 1, '<f8'))
+        np.testing.assert_array_equal(actual.converted_data,
+                                      image.converted_data)
+        self.assertEqual(actual.summary(), image.summary())
+
+    def test_process_many(self):
+        expected = read(self.path)
+        files = [read(self.path), read(self.path, mmap=True),
+                 read(self.path, channels=['Height'])]
+        self.assertIs(process_many(files, workers=2)[0], files[0])
+        for p in files:
+            for image_type in expected.image_types():
+                image = expected.image(image_type).process()
+                actual = p.image(image_type)
+                np.testing.assert_array_equal(actual.flat_data,
+                                              image.flat_data)
+                np.testing.assert_array_equal(actual.converted_data,
+                                              image.converted_data)
+                self.assertEqual(actual.summary(), image.summary())
+
+    def test_process_many_options(self):
+        expected = read(self.path).height.process(2, dtype=np.float32)
+        p = read(self.path)
+        process_many([p], order=2, dtype=np.float32, channels=['Height'],
+                     executor='thread')
+        self.assertIsNone(p.amplitude.converted_data)
+        self.assertEqual(p.height.converted_data.dtype, np.float32)
+        np.testing.assert_array_equal(p.height.converted_data,
+                                      expected.converted_data)
+        self.assertEqual(p.height.summary(), expected.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+import numpy as np
+
+from nanoscope import read
+from nanoscope.statistics import Histogram, Moments, OrderStatistics
+
+
+class TestOrderStatistics(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.ints = random.randint(-300, 300, size=(64, 48)).astype('<i2')
+        self.floats = random.normal(size=(32, 32))
+
+    def assert_matches(self, data, statistics):
+        q = [0, 0.5, 1, 12.5, 25, 50, 75, 99, 100]
+        np.testing.assert_allclose(statistics.percentile(q),
+                                   np.percentile(data, q))
+        ordered = np.sort(data, axis=None)
+        np.testing.assert_array_equal(statistics.largest(5), ordered[-5:])
+        np.testing.assert_array_equal(statistics.smallest(5), ordered[:5])
+        np.testing.assert_array_equal(statistics.kth([0, 7, data.size - 1]),
+                                      ordered[[0, 7, data.size - 1]])
+
+    def test_integer_data(self):
+        statistics = OrderStatistics(self.ints)
+        self.assertEqual(statistics.values.dtype, self.ints.dtype)
+        self.assertEqual(statistics.counts.sum(), self.ints.size)
+        self.assert_matches(self.ints, statistics)
+
+    def test_integral_float_data(self):
+        data = self.ints.astype(np.float64)
+        statistics = OrderStatistics(data, integral=True)
+        self.assertEqual(statistics.values.dtype, np.float64)
+        self.assert_matches(data, statistics)
+
+    def test_integral_hint_is_checked(self):
+        statistics = OrderStatistics(self.floats, integral=True)
+        self.assertEqual(len(statistics.values), self.floats.size)
+        self.assert_matches(self.floats, statistics)
+
+    def test_float_data(self):
+        self.assert_matches(self.floats, OrderStatistics(self.floats))
+
+    def test_wide_range_falls_back(self):
+        data = np.array([0, 1 << 40, 5, 5], dtype=np.int64)
+        statistics = OrderStatistics(data)
+        np.testing.assert_array_equal(statistics.values, [0, 5, 1 << 40])
+        np.testing.assert_array_equal(statistics.counts, [1, 2, 1])
+
+    def test_scale(self):
+        statistics = OrderStatistics(self.ints, scale=0.25)
+        self.assert_matches(self.ints * 0.25, statistics)
+
+    def test_bearing_ratio(self):
+        statistics = OrderStatistics(self.ints)
+        heights = [-1000, -300, -12, 0, 0.5, 151, 299, 1000]
+        expected = [np.mean(self.ints >= h) for h in heights]
+        np.testing.assert_allclose(statistics.bearing_ratio(heights), expected)
+        self.assertEqual(statistics.bearing_ratio(0)[()], expected[3])
+
+    def test_bearing_curve(self):
+        statistics = OrderStatistics(self.floats)
+        ratios, heights = statistics.bearing_curve(5)
+        np.testing.assert_allclose(ratios, [0, 0.25, 0.5, 0.75, 1])
+        self.assertEqual(heights[0], self.floats.max())
+        self.assertEqual(heights[-1], self.floats.min())
+        self.assertTrue(np.all(np.diff(heights) <= 0))
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_blocks(self):
+        random = np.random.RandomState(1)
+        data = np.round(random.normal(scale=40, size=(50, 20)))
+        histogram = Histogram(integral=True)
+        for start in range(0, 50, 8):
+            histogram.add(data[start:start + 8])
+        statistics = histogram.order_statistics(scale=0.5)
+        expected = OrderStatistics(data, scale=0.5)
+        np.testing.assert_array_equal(statistics.values, expected.values)
+        np.testing.assert_array_equal(statistics.counts, expected.counts)
+        self.assertEqual(statistics.size, data.size)
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            Histogram().order_statistics()
+
+    def test_overflow(self):
+        histogram = Histogram(integral=True, max_bins=100)
+        self.assertTrue(histogram.add(np.arange(50.0)))
+        self.assertFalse(histogram.add(np.arange(60.0, 120.0)))
+        self.assertTrue(histogram.overflowed)
+        self.assertIsNone(histogram.counts)
+        with self.assertRaises(ValueError):
+            histogram.order_statistics()
+
+    def test_not_whole_numbers(self):
+        histogram = Histogram(integral=True)
+        self.assertFalse(histogram.add(np.array([1.0, 2.5])))
+        self.assertFalse(Histogram().add(np.array([1.0, 2.0])))
+
+
+class TestMoments(unittest.TestCase):
+
+    def test_blocks(self):
+        random = np.random.RandomState(2)
+        data = random.normal(size=(40, 30))
+        moments = Moments(n=5)
+        for start in range(0, 40, 7):
+            moments.add(data[start:start + 7])
+        ordered = np.sort(data, axis=None)
+        self.assertEqual(moments.size, data.size)
+        self.assertAlmostEqual(moments.mean, np.mean(data), delta=1e-12)
+        self.assertEqual(moments.minimum, ordered[0])
+        self.assertEqual(moments.maximum, ordered[-1])
+        np.testing.assert_array_equal(moments.largest(5), ordered[-5:])
+        np.testing.assert_array_equal(moments.smallest(3), ordered[:3])
+
+    def test_small_blocks(self):
+        moments = Moments(n=5)
+        for value in (3, 1, 2):
+            moments.add(np.array([value]))
+        np.testing.assert_array_equal(moments.largest(5), [1, 2, 3])
+        np.testing.assert_array_equal(moments.smallest(2), [1, 2])
+
+
+class TestImageOrderStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.image = read('./tests/files/full_multiple_images.txt').height
+
+    def test_raw_data(self):
+        data = self.image.data
+        statistics = self.image.order_statistics()
+        self.assertIs(statistics.values.dtype, data.dtype)
+        self.assertEqual(self.image.percentile(50), np.percentile(data, 50))
+
+    def test_converted_data_uses_integral_source(self):
+        self.image.process()
+        data = self.image.data
+        statistics = self.image.order_statistics()
+        self.assertEqual(len(statistics.values), len(np.unique(data)))
+        np.testing.assert_allclose(self.image.percentile([5, 50, 95]),
+                                   np.percentile(data, [5, 50, 95]))
+        self.assertEqual(self.image.bearing_ratio(0.0), np.mean(data >= 0.0))
+
+    def test_n_point_roughness(self):
+        self.image.process()
+        data = self.image.data
+        mean = np.mean(data)
+        peaks = np.sort(data[data > mean])[-5:]
+        valleys = np.sort(data[data < mean])[:5]
+        self.assertEqual(self.image.Rz, np.mean(peaks + valleys))
+        self.assertEqual(self.image.summary()['Rz'], self.image.Rz)
+
+    def test_results_are_cached(self):
+        statistics = self.image.order_statistics()
+        self.assertIs(self.image.order_statistics(), statistics)
+        self.image.percentile(50)
+        self.assertIn(('percentile', 50), self.image._cache)
+        self.image.convert()
+        self.assertNotIn('order_statistics', self.image._cache)
+        self.assertIsNot(self.image.order_statistics(), statistics)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import subprocess
+import sys
+import unittest
+
+from astropy import units as u
+
+from nanoscope import units
+
+
+class TestUnit(unittest.TestCase):
+
+    def test_known_units_match_astropy(self):
+        for symbol in units.KNOWN_UNITS:
+            self.assertEqual(symbol, u.Unit(symbol).to_string())
+
+    def test_to_string_matches_astropy(self):
+        for string in ['nm/V', 'V nm', 'nm2', '1/V', '1/(V s)', 'V/V',
+                       's V nm/(A Hz)', 'nm V-1', 'µm']:
+            expected = u.Unit(string).to_string()
+            actual = units.parse_quantity('1 ' + string).unit.to_string()
+            self.assertEqual(expected, actual, msg=string)
+
+    def test_multiply(self):
+        unit = units.Unit({'nm': 1, 'V': -1}) * units.Unit({'V': 1})
+        self.assertEqual(units.Unit({'nm': 1}), unit)
+
+    def test_to_astropy(self):
+        unit = units.Unit({'nm': 1, 'V': -1})
+        self.assertEqual(u.nm / u.V, unit.to_astropy())
+
+
+class TestQuantity(unittest.TestCase):
+
+    def test_parse(self):
+        q = units.parse_quantity('12.95302 nm/V')
+        self.assertIsInstance(q, units.Quantity)
+        self.assertEqual(12.95302, q.value)
+        self.assertEqual('nm / V', q.unit.to_string())
+
+    def test_parse_dimensionless(self):
+        q = units.parse_quantity('1.000000')
+        self.assertEqual(1.0, q.value)
+        self.assertEqual('', q.unit.to_string())
+
+    def test_parse_invalid_unit(self):
+        for string in ['0.006693481 V/LSB', '1000.000 kHz linked',
+                       '1 furlongs']:
+            with self.assertRaises(ValueError):
+                units.parse_quantity(string)
+
+    def test_parse_not_a_number(self):
+        with self.assertRaises(TypeError):
+            units.parse_quantity('value')
+
+    def test_parse_unknown_unit_uses_astropy(self):
+        q = units.parse_quantity('2 lyr')
+        self.assertIsInstance(q, u.Quantity)
+        self.assertEqual(u.Quantity('2 lyr'), q)
+
+    def test_multiply(self):
+        sensitivity = units.parse_quantity('12.95302 nm/V')
+        value = units.parse_quantity('438.6572 V')
+        expected = u.Quantity('12.95302 nm/V') * u.Quantity('438.6572 V')
+        actual = sensitivity * value
+        self.assertIsInstance(actual, units.Quantity)
+        self.assertAlmostEqual(expected.value, actual.value)
+        self.assertEqual(expected.unit.to_string(), actual.unit.to_string())
+
+    def test_scalar_arithmetic(self):
+        q = units.parse_quantity('2 V')
+        self.assertEqual(units.Quantity(4, q.unit), 2 * q)
+        self.assertEqual(units.Quantity(1, q.unit), q / 2)
+
+    def test_equal_astropy(self):
+        self.assertEqual(units.parse_quantity('2 V'), u.Quantity('2 V'))
+
+    def test_delegates_to_astropy(self):
+        q = units.parse_quantity('2000 nm')
+        self.assertAlmostEqual(2.0, q.to(u.um).value)
+
+
+class TestLazyAstropy(unittest.TestCase):
+
+    def test_read_does_not_import_astropy(self):
+        code = ('import sys, nanoscope\n'
+                'p = nanoscope.read("./tests/files/full_multiple_images.txt")\n'
+                'p.height.process()\n'
+                'p.height.colorize()\n'
+                'sys.exit("astropy" in sys.modules)\n')
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', code]))
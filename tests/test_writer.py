@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from nanoscope import load_bundle, read
+from nanoscope.parameter import format_parameter, parse_parameter
+from nanoscope.writer import NanoscopeWriter
+
+
+class TestWriter(unittest.TestCase):
+
+    path = './tests/files/full_multiple_images.txt'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'file.000')
+        with io.open(self.path, 'rb') as f:
+            self.original = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def written(self):
+        with io.open(self.output, 'rb') as f:
+            return f.read()
+
+    def test_round_trip(self):
+        for options in ({}, {'mmap': True}, {'channels': ['Height']}):
+            read(self.path, **options).write(self.output)
+            self.assertEqual(self.written(), self.original)
+
+    def test_round_trip_bundle(self):
+        p = read(self.path)
+        p.height.process()
+        bundle = os.path.join(self.directory, 'file.nsb')
+        p.save_bundle(bundle)
+        load_bundle(bundle).write(self.output)
+        self.assertEqual(self.written(), self.original)
+
+    def test_changed_parameters(self):
+        p = read(self.path)
+        height = p.config['_Images']['Height']
+        height['Z magnify'] = 0.003
+        height['Scan size'] = 3
+        p.config['Sens. Zscan'] = p.config['Sens. Zscan'] * 2
+        p.config['Operator'] = 'someone'
+        p.write(self.output)
+
+        lines = self.written()[:p.config['Data length']].split(b'\r\n')
+        self.assertIn(b'\\@Z magnify: C [2:Z scale] 0.003', lines)
+        self.assertIn(b'\\Scan size: 3 2 ~m', lines)
+        self.assertIn(b'\\@Sens. Zscan: V 25.90604 nm/V', lines)
+        changed = [line for line in lines
+                   if line not in self.original.split(b'\r\n')]
+        # the three changed lines, the new one and the padding at the end
+        self.assertEqual(len(changed), 5)
+
+        q = read(self.output)
+        self.assertEqual(q.config['_Images']['Height']['Z magnify'], 0.003)
+        self.assertEqual(q.config['_Images']['Height']['Scan size'], 3)
+        self.assertEqual(q.config['Sens. Zscan'], p.config['Sens. Zscan'])
+        self.assertEqual(q.config['Operator'], 'someone')
+        np.testing.assert_array_equal(q.height.raw_data, p.height.raw_data)
+
+    def test_removed_image(self):
+        p = read(self.path)
+        del p.config['_Images']['Height']
+        p.write(self.output)
+        q = read(self.output)
+        self.assertEqual(q.image_types(), ['Amplitude'])
+        self.assertEqual(q.config['_Images']['Amplitude']['Data offset'],
+                         p.config['Data length'])
+        self.assertEqual(len(self.written()), 40960 + 512 * 512 * 2)
+        np.testing.assert_array_equal(q.amplitude.raw_data,
+                                      p.amplitude.raw_data)
+
+    def test_generated_header(self):
+        p = read(self.path)
+        p._header = None
+        p.write(self.output)
+        q = read(self.output)
+        self.assertEqual(q.config, p.config)
+        for image_type in p.image_types():
+            np.testing.assert_array_equal(q.image(image_type).raw_data,
+                                          p.image(image_type).raw_data)
+
+    def test_header_grows(self):
+        p = read(self.path)
+        p.config['Note'] = 'x' * 30000
+        p.write(self.output)
+        q = read(self.output)
+        self.assertEqual(q.config['Data length'], 49152)
+        self.assertEqual(q.config['Note'], p.config['Note'])
+        np.testing.assert_array_equal(q.amplitude.raw_data,
+                                      p.amplitude.raw_data)
+
+    def test_streaming(self):
+        p = read(self.path, header_only=True)
+        height = np.arange(512 * 512).reshape(512, 512) % 30000
+        with NanoscopeWriter(self.output, p.config) as writer:
+            writer.write_image('Height', height)
+            amplitude = writer.map_image('Amplitude')
+            amplitude[:] = -7
+            amplitude.flush()
+            del amplitude
+        q = read(self.output)
+        np.testing.assert_array_equal(q.height.raw_data, height)
+        self.assertTrue(np.all(q.amplitude.raw_data == -7))
+        self.assertEqual(len(self.written()), len(self.original))
+
+    def test_invalid_data(self):
+        p = read(self.path, header_only=True)
+        with NanoscopeWriter(self.output, p.config) as writer:
+            with self.assertRaises(ValueError):
+                writer.write_image('Height', np.zeros((512, 256), np.int16))
+            with self.assertRaises(ValueError):
+                writer.write_image('Height', np.zeros((512, 512)))
+            with self.assertRaises(ValueError):
+                writer.write_image('Height',
+                                   np.full((512, 512), 1 << 20, np.int32))
+            writer.write_image('Height', np.ones((512, 512), np.int32))
+
+    def test_header_only(self):
+        with self.assertRaises(ValueError):
+            read(self.path, header_only=True).write(self.output)
+
+
+class TestFormatParameter(unittest.TestCase):
+
+    def test_round_trip(self):
+        lines = [
+            '\\*Ciao image list',
+            '\\Scan size: 2 2 ~m',
+            '\\Note: ',
+            '\\Date: 10:27:26 AM Fri Oct 17 2014',
+            '\\@Sens. Zscan: V 12.95302 nm/V',
+            '\\@Z magnify: C [2:Z scale] 0.002639945',
+            '\\@2:Z scale: V [Sens. Zscan] (0.006693481 V/LSB) 438.6572 V',
+            '\\@2:Image Data: S [Height] "Height"',
+        ]
+        for line in lines:
+            parameter = parse_parameter(line)
+            formatted = format_parameter(
+                parameter, ciao='@' in line,
+                group=2 if '@2:' in line else None)
+            self.assertEqual(parse_parameter(formatted), parameter)
+
+    def test_format(self):
+        self.assertEqual(
+            format_parameter(parse_parameter('\\@Sens. Zscan: V 12.5 nm/V')),
+            '\\@Sens. Zscan: V 12.5 nm/V')
+        self.assertEqual(
+            format_parameter(parse_parameter('\\@2:Image Data: S [H] "H"'),
+                             group=2),
+            '\\@2:Image Data: S [H] "H"')
+        self.assertEqual(format_parameter(parse_parameter('\\Lines: 512')),
+                         '\\Lines: 512')
+
+
+if __name__ == '__main__':
+    unittest.main()